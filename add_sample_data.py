@@ -1,9 +1,16 @@
+"""
+Add sample cases to the database
+
+    python add_sample_data.py                  # 50 cases in Abuja through the ingestion API
+    python add_sample_data.py --cases 1000000  # bulk synthetic data, see synthetic_data.py
+"""
+import argparse
+import os
+
 from data_ingestion import DataIngestion
 from datetime import datetime, timedelta
 import random
 
-ingestion = DataIngestion()
-
 # Sample locations in Abuja
 locations = [
     "Wuse 2, Abuja",
@@ -17,30 +24,57 @@ locations = [
 
 diseases = ["Malaria", "Typhoid", "Tuberculosis"]
 
-print("Adding sample test results...")
-
-# Add 50 sample cases
-for i in range(50):
-    test_date = datetime.now().date() - timedelta(days=random.randint(0, 30))
-    
-    test_data = {
-        'hospital_id': 1,
-        'disease_type': random.choice(diseases),
-        'test_result': random.choice(['Positive', 'Positive', 'Negative']),
-        'test_date': str(test_date),
-        'severity': random.choice(['Mild', 'Moderate', 'Severe']),
-        'symptoms': 'Fever, headache',
-        'patient_data': {
+
+def add_sample_cases(count: int = 50):
+    """Add count random recent cases one by one, geocoding their addresses like real submissions"""
+    ingestion = DataIngestion()
+
+    print("Adding sample test results...")
+
+    for i in range(count):
+        test_date = datetime.now().date() - timedelta(days=random.randint(0, 30))
+
+        test_data = {
             'hospital_id': 1,
-            'external_patient_id': f'PT{i+1:03d}',
-            'age': random.randint(1, 80),
-            'gender': random.choice(['Male', 'Female']),
-            'address': random.choice(locations),
-            'phone': f'+23480{random.randint(10000000, 99999999)}'
+            'disease_type': random.choice(diseases),
+            'test_result': random.choice(['Positive', 'Positive', 'Negative']),
+            'test_date': str(test_date),
+            'severity': random.choice(['Mild', 'Moderate', 'Severe']),
+            'symptoms': 'Fever, headache',
+            'patient_data': {
+                'hospital_id': 1,
+                'external_patient_id': f'PT{i+1:03d}',
+                'age': random.randint(1, 80),
+                'gender': random.choice(['Male', 'Female']),
+                'address': random.choice(locations),
+                'phone': f'+23480{random.randint(10000000, 99999999)}'
+            }
         }
-    }
-    
-    ingestion.add_test_result(test_data)
-    print(f"Added case {i+1}/50")
 
-print("✅ Sample data added successfully!")
\ No newline at end of file
+        ingestion.add_test_result(test_data)
+        print(f"Added case {i+1}/{count}")
+
+    print("✅ Sample data added successfully!")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add sample cases to the database')
+    parser.add_argument('--cases', type=int,
+                        help='generate this many synthetic cases in bulk instead of the 50 Abuja samples')
+    parser.add_argument('--hospitals', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.cases is None:
+        add_sample_cases()
+    else:
+        import synthetic_data
+
+        seed = synthetic_data.DEFAULT_SEED if args.seed is None else args.seed
+        db_path = os.environ.get('DATABASE_PATH', 'demicstech.db')
+        try:
+            summary = synthetic_data.generate(db_path, args.cases, args.hospitals, args.days, seed)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"✅ Added {summary['test_results']:,} synthetic test results in {summary['seconds']}s")
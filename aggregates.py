@@ -0,0 +1,266 @@
+from typing import Dict, List, Optional
+
+from geo import count_cells
+
+# Geohash precision of the finest heatmap cell (~1.2km x 0.6km). Coarser
+# zoom levels roll these up by geohash prefix.
+HEATMAP_PRECISION = 6
+
+# Highest web map zoom level served by each heatmap precision
+ZOOM_PRECISION = [(3, 1), (5, 2), (8, 3), (10, 4), (13, 5)]
+
+MAX_HEATMAP_CELLS = 4096
+
+# Geohash precision of the cube's spatial dimension (~4.9km x 4.9km)
+CUBE_PRECISION = 5
+
+# Upper age (inclusive) of each band; anything older falls in the last band
+AGE_BANDS = [(4, '0-4'), (14, '5-14'), (24, '15-24'), (44, '25-44'), (64, '45-64')]
+OLDEST_AGE_BAND = '65+'
+UNKNOWN = 'Unknown'
+
+# Cube dimensions a query may group or filter by, mapped to SQL expressions
+CUBE_DIMENSIONS = {
+    'disease_type': 'disease_type',
+    'stat_date': 'stat_date',
+    'week': "strftime('%Y-W%W', stat_date)",
+    'month': 'substr(stat_date, 1, 7)',
+    'year': 'substr(stat_date, 1, 4)',
+    'cell': 'cell',
+    'hospital_id': 'hospital_id',
+    'age_band': 'age_band',
+    'gender': 'gender',
+    'test_result': 'test_result'
+}
+
+
+def create_cell_count_table(cursor):
+    """Create the per-day, per-cell counts used by the heatmap"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS case_cell_counts (
+        disease_type TEXT NOT NULL,
+        stat_date DATE NOT NULL,
+        cell TEXT NOT NULL,
+        total_cases INTEGER NOT NULL DEFAULT 0,
+        positive_cases INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (disease_type, stat_date, cell)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cell_counts_cell ON case_cell_counts(disease_type, cell, stat_date)')
+
+
+def create_cube_table(cursor):
+    """Create the surveillance cube: case counts over every analysis dimension"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS surveillance_cube (
+        disease_type TEXT NOT NULL,
+        stat_date DATE NOT NULL,
+        cell TEXT NOT NULL,
+        hospital_id INTEGER NOT NULL,
+        age_band TEXT NOT NULL,
+        gender TEXT NOT NULL,
+        test_result TEXT NOT NULL,
+        case_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (disease_type, stat_date, cell, hospital_id, age_band, gender, test_result)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cube_date ON surveillance_cube(stat_date)')
+
+
+def create_aggregate_tables(cursor):
+    """Create every summary table maintained alongside test_results"""
+    create_cell_count_table(cursor)
+    create_cube_table(cursor)
+
+
+def age_band(age: Optional[int]) -> str:
+    """Return the cube age band for an age in years"""
+    if age is None:
+        return UNKNOWN
+    for upper, band in AGE_BANDS:
+        if age <= upper:
+            return band
+    return OLDEST_AGE_BAND
+
+
+def _age_band_sql(column: str) -> str:
+    """SQL CASE expression equivalent to age_band()"""
+    branches = ' '.join(f"WHEN {column} <= {upper} THEN '{band}'" for upper, band in AGE_BANDS)
+    return f"CASE WHEN {column} IS NULL THEN '{UNKNOWN}' {branches} ELSE '{OLDEST_AGE_BAND}' END"
+
+
+def record_case(cursor, test_data: Dict, patient):
+    """
+    Add one ingested test result to the summary tables
+    patient must provide the stored geohash, age and gender
+    """
+    disease_type = test_data['disease_type']
+    test_date = test_data['test_date']
+    test_result = test_data['test_result']
+    geohash = patient['geohash']
+
+    if geohash:
+        _add_cell_count(cursor, disease_type, test_date, geohash[:HEATMAP_PRECISION],
+                        1, 1 if test_result == 'Positive' else 0)
+
+    cell, band, gender = _cube_patient_key(patient)
+    _add_cube_count(cursor, (disease_type, test_date, cell, test_data['hospital_id'],
+                             band, gender, test_result), 1)
+
+
+def _add_cell_count(cursor, disease_type: str, test_date: str, cell: str, total: int, positive: int):
+    """Add to (or, with negative counts, take from) one case_cell_counts row"""
+    cursor.execute('''
+    INSERT INTO case_cell_counts (disease_type, stat_date, cell, total_cases, positive_cases)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (disease_type, stat_date, cell) DO UPDATE SET
+        total_cases = total_cases + excluded.total_cases,
+        positive_cases = positive_cases + excluded.positive_cases
+    ''', (disease_type, test_date, cell, total, positive))
+    if total < 0:
+        # A rebuild has no rows for empty cells
+        cursor.execute('''
+        DELETE FROM case_cell_counts
+        WHERE disease_type = ? AND stat_date = ? AND cell = ? AND total_cases <= 0
+        ''', (disease_type, test_date, cell))
+
+
+def _add_cube_count(cursor, key: tuple, count: int):
+    """Add count (negative to take away) to the surveillance_cube row for key"""
+    cursor.execute('''
+    INSERT INTO surveillance_cube
+    (disease_type, stat_date, cell, hospital_id, age_band, gender, test_result, case_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (disease_type, stat_date, cell, hospital_id, age_band, gender, test_result)
+    DO UPDATE SET case_count = case_count + excluded.case_count
+    ''', (*key, count))
+    if count < 0:
+        cursor.execute('''
+        DELETE FROM surveillance_cube
+        WHERE disease_type = ? AND stat_date = ? AND cell = ? AND hospital_id = ?
+          AND age_band = ? AND gender = ? AND test_result = ? AND case_count <= 0
+        ''', key)
+
+
+def _cube_patient_key(patient) -> tuple:
+    """The cube's cell, age band and gender for a patient's stored fields"""
+    return ((patient['geohash'] or '')[:CUBE_PRECISION], age_band(patient['age']),
+            patient['gender'] or UNKNOWN)
+
+
+def move_patient_cases(cursor, patient_id: int, old, new):
+    """
+    Move a patient's test results to the summary cells of their updated
+    fields, in the caller's transaction; old and new provide the geohash,
+    age and gender before and after the update
+    """
+    old_cell = (old['geohash'] or '')[:HEATMAP_PRECISION]
+    new_cell = (new['geohash'] or '')[:HEATMAP_PRECISION]
+    old_cube, new_cube = _cube_patient_key(old), _cube_patient_key(new)
+    if old_cell == new_cell and old_cube == new_cube:
+        return
+
+    cursor.execute('''
+    SELECT disease_type, test_date, hospital_id, test_result, COUNT(*)
+    FROM test_results
+    WHERE patient_id = ?
+    GROUP BY disease_type, test_date, hospital_id, test_result
+    ''', (patient_id,))
+    for disease_type, test_date, hospital_id, test_result, count in cursor.fetchall():
+        if old_cell != new_cell:
+            positive = count if test_result == 'Positive' else 0
+            if old_cell:
+                _add_cell_count(cursor, disease_type, test_date, old_cell, -count, -positive)
+            if new_cell:
+                _add_cell_count(cursor, disease_type, test_date, new_cell, count, positive)
+        if old_cube != new_cube:
+            old_key = (disease_type, test_date, old_cube[0], hospital_id, *old_cube[1:], test_result)
+            new_key = (disease_type, test_date, new_cube[0], hospital_id, *new_cube[1:], test_result)
+            _add_cube_count(cursor, old_key, -count)
+            _add_cube_count(cursor, new_key, count)
+
+
+def archived_through(cursor) -> str:
+    """
+    Newest test_date moved to an archive file ('' if none). Summary rows up
+    to it are kept by rebuilds, since main no longer holds all their results.
+    """
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'archive_partitions'").fetchone():
+        # Shards and databases from before archiving
+        return ''
+    return cursor.execute('SELECT MAX(max_date) FROM archive_partitions').fetchone()[0] or ''
+
+
+def rebuild_cell_counts(cursor):
+    """Recompute case_cell_counts from test_results and patients, after the archived range"""
+    since = archived_through(cursor)
+    cursor.execute('DELETE FROM case_cell_counts WHERE stat_date > ?', (since,))
+    cursor.execute('''
+    INSERT INTO case_cell_counts (disease_type, stat_date, cell, total_cases, positive_cases)
+    SELECT
+        tr.disease_type,
+        tr.test_date,
+        substr(p.geohash, 1, ?),
+        COUNT(*),
+        SUM(CASE WHEN tr.test_result = 'Positive' THEN 1 ELSE 0 END)
+    FROM test_results tr
+    JOIN patients p ON tr.patient_id = p.patient_id
+    WHERE p.geohash IS NOT NULL AND tr.test_date > ?
+    GROUP BY tr.disease_type, tr.test_date, substr(p.geohash, 1, ?)
+    ''', (HEATMAP_PRECISION, since, HEATMAP_PRECISION))
+
+
+def rebuild_cube(cursor):
+    """Recompute surveillance_cube from test_results and patients, after the archived range"""
+    since = archived_through(cursor)
+    cursor.execute('DELETE FROM surveillance_cube WHERE stat_date > ?', (since,))
+    cursor.execute(f'''
+    INSERT INTO surveillance_cube
+    (disease_type, stat_date, cell, hospital_id, age_band, gender, test_result, case_count)
+    SELECT
+        tr.disease_type,
+        tr.test_date,
+        substr(COALESCE(p.geohash, ''), 1, ?) as cube_cell,
+        tr.hospital_id,
+        {_age_band_sql('p.age')} as cube_age_band,
+        COALESCE(p.gender, '{UNKNOWN}') as cube_gender,
+        tr.test_result,
+        COUNT(*)
+    FROM test_results tr
+    JOIN patients p ON tr.patient_id = p.patient_id
+    WHERE tr.test_date > ?
+    GROUP BY tr.disease_type, tr.test_date, cube_cell, tr.hospital_id,
+             cube_age_band, cube_gender, tr.test_result
+    ''', (CUBE_PRECISION, since))
+
+
+def rebuild_aggregates(cursor):
+    """Recompute every summary table from test_results and patients, after the archived range"""
+    rebuild_cell_counts(cursor)
+    rebuild_cube(cursor)
+
+
+def heatmap_precision(zoom: int, bbox: tuple, max_cells: int = MAX_HEATMAP_CELLS) -> int:
+    """
+    Pick the heatmap cell precision for a map zoom level, coarsening it
+    until the bounding box is covered by at most max_cells cells
+    """
+    precision = HEATMAP_PRECISION
+    for max_zoom, zoom_precision in ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            precision = zoom_precision
+            break
+
+    while precision > 1 and count_cells(bbox, precision) > max_cells:
+        precision -= 1
+    return precision
+
+
+def cube_dimension_sql(dimension: str, cell_precision: int = CUBE_PRECISION) -> str:
+    """Return the SQL expression for a cube dimension, rejecting unknown names"""
+    if dimension not in CUBE_DIMENSIONS:
+        raise ValueError(f"Unknown cube dimension: {dimension}. "
+                         f"Use one of: {', '.join(CUBE_DIMENSIONS)}")
+    if dimension == 'cell' and cell_precision < CUBE_PRECISION:
+        return f'substr(cell, 1, {int(cell_precision)})'
+    return CUBE_DIMENSIONS[dimension]
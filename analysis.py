@@ -1,18 +1,85 @@
 import sqlite3
-import pandas as pd
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 from collections import defaultdict
 import json
 import math
-import numpy as np
+
+from geo import bbox_conditions, cell_size, cover_bbox, decode, intersects, prefix_conditions, radius_bbox
+from aggregates import CUBE_PRECISION, MAX_HEATMAP_CELLS, cube_dimension_sql, heatmap_precision
+from model_serving import FEATURE_COLUMNS, build_area_features, hotspot_model
+from forecasting import AREA_PRECISION, CaseForecaster
+from data_ingestion import month_date_range
+from archive import ArchiveRouter
+from sharding import shard_router
+from series_store import NEGATIVE, POSITIVE, TOTAL
+from lazy import lazy_import
+from timing import open_connection, timed
+from metrics import CACHE_REQUESTS
+
+# Heavy; loaded on first use
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 class DiseaseAnalyzer:
-    def __init__(self, db_path='demicstech.db'):
+    def __init__(self, db_path='demicstech.db', model=None, case_store=None, series_store=None,
+                 shards=None, replica=None):
         self.db_path = db_path
+        self.archive = ArchiveRouter(db_path)
+        # ShardRouter when SHARDING is enabled; case scans fan out over every shard
+        self.shards = shards if shards is not None else shard_router(db_path)
+        # Optional ReadReplica; reads go to a recent snapshot, off the primary's locks
+        self.replica = replica
+        self.model = model or hotspot_model
+        # Optional in-memory CaseStore; analyses inside its window skip SQL
+        self.case_store = case_store
+        # Optional DailySeriesStore; daily counts over any range skip SQL
+        self.series_store = series_store
+        self.forecaster = CaseForecaster(series_store=series_store)
+    
+    def _in_case_store(self, start_date) -> bool:
+        if self.case_store is None:
+            return False
+        covered = self.case_store.covers(start_date)
+        CACHE_REQUESTS.inc(cache='case_store', result='hit' if covered else 'miss')
+        return covered
+    
+    def _in_series_store(self, start_date, end_date) -> bool:
+        if self.series_store is None:
+            return False
+        if not self.series_store.covers(start_date, end_date):
+            CACHE_REQUESTS.inc(cache='series_store', result='miss')
+            return False
+        CACHE_REQUESTS.inc(cache='series_store', result='hit')
+        self.series_store.sync()
+        return True
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def get_connection(self, date_range: tuple = None):
+        """
+        Pass the (start, end) test dates a query reads from test_results to
+        have archived results in that range included; see archive.ArchiveRouter
+        When sharded, every connection reads the sharded tables across all shards
+        With a replica, connections are read-only; save results through
+        _write_connection
+        """
+        if self.shards is not None:
+            return self.shards.connect()
+        if self.replica is not None:
+            conn = self.replica.connect()
+            if date_range is not None:
+                return self.archive.connect(*date_range, conn=conn)
+            return conn
+        if date_range is not None:
+            return self.archive.connect(*date_range)
+        conn = open_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _write_connection(self):
+        """Connection for saving analysis results, always on the primary database"""
+        if self.replica is None:
+            return self.get_connection()
+        conn = open_connection(self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
     
@@ -50,44 +117,37 @@ class DiseaseAnalyzer:
         
         return R * c
     
+    def _distances_km(self, lat: float, lon: float, lats, lons):
+        """Haversine distances in kilometers from one point to arrays of points"""
+        lat_rad, lats_rad = math.radians(lat), np.radians(lats)
+        delta_lat = lats_rad - lat_rad
+        delta_lon = np.radians(lons - lon)
+        
+        a = np.sin(delta_lat/2)**2 + math.cos(lat_rad) * np.cos(lats_rad) * np.sin(delta_lon/2)**2
+        return 6371 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    
+    @timed('analyzer.generate_daily_statistics')
     def generate_daily_statistics(self, disease_type: str, date: str) -> Dict:
         """Generate daily statistics for a specific disease"""
-        conn = self.get_connection()
+        conn = self.get_connection((date, date))
         cursor = conn.cursor()
         
-        cursor.execute('''
-        SELECT 
-            COUNT(*) as total_tests,
-            SUM(CASE WHEN test_result = 'Positive' THEN 1 ELSE 0 END) as positive_cases,
-            SUM(CASE WHEN test_result = 'Negative' THEN 1 ELSE 0 END) as negative_cases,
-            COUNT(DISTINCT p.latitude || ',' || p.longitude) as unique_locations
-        FROM test_results tr
-        JOIN patients p ON tr.patient_id = p.patient_id
-        WHERE tr.disease_type = ? AND tr.test_date = ?
-        ''', (disease_type, date))
-        
-        stats = dict(cursor.fetchone())
-        
-        # Get location breakdown
-        cursor.execute('''
-        SELECT 
-            p.address,
-            COUNT(*) as case_count,
-            SUM(CASE WHEN tr.test_result = 'Positive' THEN 1 ELSE 0 END) as positive_count
-        FROM test_results tr
-        JOIN patients p ON tr.patient_id = p.patient_id
-        WHERE tr.disease_type = ? AND tr.test_date = ?
-        GROUP BY p.address
-        ORDER BY positive_count DESC
-        ''', (disease_type, date))
+        if self._in_case_store(date):
+            stats = self.case_store.daily_statistics(disease_type, date)
+        elif self.shards is not None:
+            stats = self._daily_statistics_shards(disease_type, date)
+        else:
+            stats = self._daily_statistics_sql(cursor, disease_type, date)
         
-        locations = [dict(row) for row in cursor.fetchall()]
+        conn.close()
         
-        stats['locations'] = locations
+        locations = stats['locations']
         stats['date'] = date
         stats['disease_type'] = disease_type
         
         # Save to database
+        conn = self._write_connection()
+        cursor = conn.cursor()
         cursor.execute('''
         INSERT OR REPLACE INTO daily_statistics 
         (disease_type, stat_date, total_cases, positive_cases, negative_cases, locations_affected, summary_data)
@@ -108,9 +168,123 @@ class DiseaseAnalyzer:
         # Convert to native types before returning
         return self._convert_to_native_types(stats)
     
+    def _daily_statistics_sql(self, cursor, disease_type: str, date: str) -> Dict:
+        cursor.execute('''
+        SELECT 
+            COUNT(*) as total_tests,
+            SUM(CASE WHEN test_result = 'Positive' THEN 1 ELSE 0 END) as positive_cases,
+            SUM(CASE WHEN test_result = 'Negative' THEN 1 ELSE 0 END) as negative_cases,
+            COUNT(DISTINCT p.latitude || ',' || p.longitude) as unique_locations
+        FROM test_results tr
+        JOIN patients p ON tr.patient_id = p.patient_id
+        WHERE tr.disease_type = ? AND tr.test_date = ?
+        ''', (disease_type, date))
+        
+        stats = dict(cursor.fetchone())
+        
+        # Get location breakdown, grouped on the interned location id
+        # (one address per id, so p.address is the same across each group)
+        cursor.execute('''
+        SELECT 
+            p.address,
+            COUNT(*) as case_count,
+            SUM(CASE WHEN tr.test_result = 'Positive' THEN 1 ELSE 0 END) as positive_count
+        FROM test_results tr
+        JOIN patients p ON tr.patient_id = p.patient_id
+        WHERE tr.disease_type = ? AND tr.test_date = ?
+        GROUP BY p.location_id
+        ORDER BY positive_count DESC
+        ''', (disease_type, date))
+        
+        stats['locations'] = [dict(row) for row in cursor.fetchall()]
+        return stats
+    
+    def _daily_statistics_shards(self, disease_type: str, date: str) -> Dict:
+        """Daily statistics merged from per-shard, per-location partial counts"""
+        def partial(conn):
+            return conn.execute('''
+            SELECT 
+                MIN(p.address) as address,
+                lower(trim(p.address)) as address_key,
+                p.latitude || ',' || p.longitude as location,
+                COUNT(*) as case_count,
+                SUM(CASE WHEN tr.test_result = 'Positive' THEN 1 ELSE 0 END) as positive_count,
+                SUM(CASE WHEN tr.test_result = 'Negative' THEN 1 ELSE 0 END) as negative_count
+            FROM test_results tr
+            JOIN patients p ON tr.patient_id = p.patient_id
+            WHERE tr.disease_type = ? AND tr.test_date = ?
+            GROUP BY address_key, location
+            ''', (disease_type, date)).fetchall()
+        
+        rows = [row for rows in self.shards.fan_out(partial) for row in rows]
+        total = sum(row['case_count'] for row in rows)
+        
+        # Each shard interns addresses separately, so the same place is matched
+        # ignoring case and surrounding spaces
+        locations = {}
+        for row in rows:
+            merged = locations.setdefault(row['address_key'], {'address': row['address'], 'case_count': 0,
+                                                               'positive_count': 0})
+            merged['case_count'] += row['case_count']
+            merged['positive_count'] += row['positive_count']
+        
+        return {
+            # SUM over no rows is NULL in SQL
+            'total_tests': total,
+            'positive_cases': sum(row['positive_count'] for row in rows) if total else None,
+            'negative_cases': sum(row['negative_count'] for row in rows) if total else None,
+            'unique_locations': len({row['location'] for row in rows if row['location'] is not None}),
+            'locations': sorted(locations.values(), key=lambda l: l['positive_count'], reverse=True)
+        }
+    
+    @timed('analyzer.generate_monthly_statistics')
     def generate_monthly_statistics(self, disease_type: str, month: int, year: int) -> Dict:
         """Generate monthly statistics summary"""
-        conn = self.get_connection()
+        start, next_month = month_date_range(int(month), int(year))
+        last_day = datetime.strptime(next_month, '%Y-%m-%d').date() - timedelta(days=1)
+        if self._in_series_store(start, last_day):
+            df = self._daily_breakdown_series(disease_type, start, last_day)
+        elif self._in_case_store(start):
+            df = pd.DataFrame(self.case_store.daily_breakdown(disease_type, start, last_day),
+                              columns=['test_date', 'total_tests', 'positive_cases', 'negative_cases'])
+        else:
+            df = self._monthly_breakdown_sql(disease_type, month, year)
+        
+        if df.empty:
+            return {'error': 'No data found for specified period'}
+        
+        with timed('pandas'):
+            summary = {
+                'disease_type': disease_type,
+                'month': int(month),
+                'year': int(year),
+                'total_tests': int(df['total_tests'].sum()),
+                'total_positive': int(df['positive_cases'].sum()),
+                'total_negative': int(df['negative_cases'].sum()),
+                'avg_daily_cases': float(df['positive_cases'].mean()),
+                'peak_day': str(df.loc[df['positive_cases'].idxmax(), 'test_date']) if len(df) > 0 else None,
+                'peak_day_cases': int(df['positive_cases'].max()) if len(df) > 0 else 0,
+                'daily_breakdown': df.to_dict('records')
+            }
+        
+        # Convert to native types
+        return self._convert_to_native_types(summary)
+    
+    def _daily_breakdown_series(self, disease_type: str, start_date, end_date):
+        window = self.series_store.window(disease_type, start_date, end_date)
+        tested = np.flatnonzero(window[TOTAL])
+        start = datetime.strptime(str(start_date), '%Y-%m-%d').date()
+        return pd.DataFrame({
+            'test_date': [str(start + timedelta(days=int(i))) for i in tested],
+            'total_tests': window[TOTAL, tested].astype(np.int64),
+            'positive_cases': window[POSITIVE, tested].astype(np.int64),
+            'negative_cases': window[NEGATIVE, tested].astype(np.int64)
+        })
+    
+    def _monthly_breakdown_sql(self, disease_type: str, month: int, year: int):
+        if self.shards is not None:
+            return self._monthly_breakdown_shards(disease_type, month, year)
+        conn = self.get_connection(month_date_range(int(month), int(year)))
         
         query = f'''
         SELECT 
@@ -128,37 +302,43 @@ class DiseaseAnalyzer:
         
         df = pd.read_sql_query(query, conn, params=(disease_type, f'{month:02d}', str(year)))
         conn.close()
-        
-        if df.empty:
-            return {'error': 'No data found for specified period'}
-        
-        summary = {
-            'disease_type': disease_type,
-            'month': int(month),
-            'year': int(year),
-            'total_tests': int(df['total_tests'].sum()),
-            'total_positive': int(df['positive_cases'].sum()),
-            'total_negative': int(df['negative_cases'].sum()),
-            'avg_daily_cases': float(df['positive_cases'].mean()),
-            'peak_day': str(df.loc[df['positive_cases'].idxmax(), 'test_date']) if len(df) > 0 else None,
-            'peak_day_cases': int(df['positive_cases'].max()) if len(df) > 0 else 0,
-            'daily_breakdown': df.to_dict('records')
-        }
-        
-        # Convert to native types
-        return self._convert_to_native_types(summary)
+        return df
     
-    def detect_hotspots(self, disease_type: str, start_date: str, end_date: str, 
-                       radius_km: float = 5.0, min_cases: int = 3) -> List[Dict]:
-        """
-        Detect disease hotspots using clustering analysis
-        Groups cases within radius_km that have at least min_cases
-        """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _monthly_breakdown_shards(self, disease_type: str, month: int, year: int):
+        """Each shard's daily counts for the month, summed per test date"""
+        start_date, end_date = month_date_range(int(month), int(year))
+        
+        def partial(conn):
+            return conn.execute('''
+            SELECT 
+                tr.test_date,
+                COUNT(*) as total_tests,
+                SUM(CASE WHEN tr.test_result = 'Positive' THEN 1 ELSE 0 END) as positive_cases,
+                SUM(CASE WHEN tr.test_result = 'Negative' THEN 1 ELSE 0 END) as negative_cases
+            FROM test_results tr
+            WHERE tr.disease_type = ?
+            AND tr.test_date >= ? AND tr.test_date < ?
+            GROUP BY tr.test_date
+            ''', (disease_type, start_date, end_date)).fetchall()
+        
+        days = defaultdict(lambda: [0, 0, 0])
+        for rows in self.shards.fan_out(partial):
+            for test_date, total, positive, negative in rows:
+                merged = days[test_date]
+                merged[0] += total
+                merged[1] += positive
+                merged[2] += negative
+        
+        return pd.DataFrame([[day] + days[day] for day in sorted(days)],
+                            columns=['test_date', 'total_tests', 'positive_cases', 'negative_cases'])
+    
+    def _fetch_positive_cases(self, cursor, disease_type: str, start_date: str, end_date: str,
+                              bbox: tuple = None) -> List[Dict]:
+        """Get positive, geocoded cases in a date range, optionally inside a bounding box"""
+        if self._in_case_store(start_date):
+            return self.case_store.positive_cases(disease_type, start_date, end_date, bbox)
         
-        # Get all positive cases in date range with location
-        cursor.execute('''
+        query = '''
         SELECT 
             tr.result_id,
             tr.test_date,
@@ -174,97 +354,362 @@ class DiseaseAnalyzer:
         AND tr.test_date BETWEEN ? AND ?
         AND p.latitude IS NOT NULL
         AND p.longitude IS NOT NULL
-        ''', (disease_type, start_date, end_date))
+        '''
+        params = [disease_type, start_date, end_date]
+        
+        if bbox:
+            spatial_sql, spatial_params = bbox_conditions(bbox)
+            query += f' AND {spatial_sql}'
+            params.extend(spatial_params)
+        
+        # A stable order keeps hotspot clustering deterministic
+        query += ' ORDER BY tr.test_date, tr.result_id'
+        if self.shards is not None:
+            # Clustering runs over the merged cases, so hotspots spanning zones stay whole
+            partials = self.shards.fan_out(lambda conn: [dict(row) for row in conn.execute(query, params)])
+            return sorted((case for cases in partials for case in cases),
+                          key=lambda c: (c['test_date'], c['result_id']))
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+    
+    @timed('analyzer.find_cases_in_bbox')
+    def find_cases_in_bbox(self, disease_type: str, start_date: str, end_date: str,
+                           bbox: tuple) -> List[Dict]:
+        """Get positive cases inside a (min_lat, min_lon, max_lat, max_lon) box"""
+        conn = self.get_connection((start_date, end_date))
+        cases = self._fetch_positive_cases(conn.cursor(), disease_type, start_date, end_date, bbox)
+        conn.close()
+        return cases
+    
+    @timed('analyzer.find_cases_near')
+    def find_cases_near(self, disease_type: str, start_date: str, end_date: str,
+                        latitude: float, longitude: float, radius_km: float) -> List[Dict]:
+        """Get positive cases within radius_km of a point, nearest first"""
+        candidates = self.find_cases_in_bbox(
+            disease_type, start_date, end_date, radius_bbox(latitude, longitude, radius_km)
+        )
+        
+        nearby = []
+        for case in candidates:
+            distance = self.calculate_distance(latitude, longitude, case['latitude'], case['longitude'])
+            if distance <= radius_km:
+                case['distance_km'] = round(distance, 3)
+                nearby.append(case)
+        
+        return sorted(nearby, key=lambda c: c['distance_km'])
+    
+    @timed('analyzer.detect_hotspots')
+    def detect_hotspots(self, disease_type: str, start_date: str, end_date: str, 
+                       radius_km: float = 5.0, min_cases: int = 3, bbox: tuple = None,
+                       save: bool = True) -> List[Dict]:
+        """
+        Detect disease hotspots using clustering analysis
+        Groups cases within radius_km that have at least min_cases
+        If bbox is given, only cases inside it are considered
+        Hotspots are added to hotspot_analysis unless save is False or bbox is given
+        """
+        conn = self.get_connection((start_date, end_date))
+        cursor = conn.cursor()
         
-        cases = [dict(row) for row in cursor.fetchall()]
+        # Get all positive cases in date range with location
+        cases = self._fetch_positive_cases(cursor, disease_type, start_date, end_date, bbox)
         
         if len(cases) < min_cases:
             conn.close()
             return []
         
+        conn.close()
+        
         # Simple clustering algorithm
         clusters = []
-        used_cases = set()
-        
-        for i, case in enumerate(cases):
-            if i in used_cases:
-                continue
-            
-            cluster = [case]
-            cluster_indices = {i}
-            
-            for j, other_case in enumerate(cases):
-                if j in used_cases or i == j:
+        saved = []
+        with timed('cluster'):
+            lats = np.array([c['latitude'] for c in cases], dtype=np.float64)
+            lons = np.array([c['longitude'] for c in cases], dtype=np.float64)
+            used_cases = np.zeros(len(cases), dtype=bool)
+        
+            for i, case in enumerate(cases):
+                if used_cases[i]:
                     continue
-                
-                distance = self.calculate_distance(
-                    case['latitude'], case['longitude'],
-                    other_case['latitude'], other_case['longitude']
-                )
-                
-                if distance <= radius_km:
-                    cluster.append(other_case)
-                    cluster_indices.add(j)
             
-            if len(cluster) >= min_cases:
-                # Calculate cluster center
-                avg_lat = sum(c['latitude'] for c in cluster) / len(cluster)
-                avg_lon = sum(c['longitude'] for c in cluster) / len(cluster)
+                # Every unused case within radius_km of this one, in list order
+                within = ~used_cases & (self._distances_km(case['latitude'], case['longitude'], lats, lons) <= radius_km)
+                within[i] = False
+                cluster_indices = [i] + np.flatnonzero(within).tolist()
+                cluster = [cases[j] for j in cluster_indices]
+            
+                if len(cluster) >= min_cases:
+                    # Calculate cluster center
+                    avg_lat = sum(c['latitude'] for c in cluster) / len(cluster)
+                    avg_lon = sum(c['longitude'] for c in cluster) / len(cluster)
                 
-                # Determine risk level
-                if len(cluster) >= 10:
-                    risk_level = 'Critical'
-                elif len(cluster) >= 5:
-                    risk_level = 'High'
-                else:
-                    risk_level = 'Moderate'
+                    # Determine risk level
+                    if len(cluster) >= 10:
+                        risk_level = 'Critical'
+                    elif len(cluster) >= 5:
+                        risk_level = 'High'
+                    else:
+                        risk_level = 'Moderate'
                 
-                hotspot = {
-                    'location': cluster[0]['address'],
-                    'latitude': float(avg_lat),
-                    'longitude': float(avg_lon),
-                    'case_count': int(len(cluster)),
-                    'risk_level': risk_level,
-                    'cases': cluster,
-                    'radius_km': float(radius_km)
-                }
+                    hotspot = {
+                        'location': cluster[0]['address'],
+                        'latitude': float(avg_lat),
+                        'longitude': float(avg_lon),
+                        'case_count': int(len(cluster)),
+                        'risk_level': risk_level,
+                        'cases': cluster,
+                        'radius_km': float(radius_km)
+                    }
                 
-                clusters.append(hotspot)
-                used_cases.update(cluster_indices)
+                    clusters.append(hotspot)
+                    used_cases[cluster_indices] = True
                 
-                # Save to database
-                cursor.execute('''
-                INSERT INTO hotspot_analysis 
-                (disease_type, analysis_date, location, latitude, longitude, case_count, risk_level, analysis_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    disease_type,
-                    end_date,
-                    hotspot['location'],
-                    avg_lat,
-                    avg_lon,
-                    len(cluster),
-                    risk_level,
-                    json.dumps({'cases': [c['result_id'] for c in cluster]})
-                ))
-        
-        conn.commit()
-        conn.close()
+                    saved.append((
+                        disease_type,
+                        end_date,
+                        hotspot['location'],
+                        avg_lat,
+                        avg_lon,
+                        len(cluster),
+                        risk_level,
+                        json.dumps({'cases': [c['result_id'] for c in cluster]})
+                    ))
+        
+        # Save to database in one short transaction, after clustering; results
+        # limited to a bbox are partial and are not saved
+        if save and bbox is None:
+            conn = self._write_connection()
+            conn.executemany('''
+            INSERT INTO hotspot_analysis 
+            (disease_type, analysis_date, location, latitude, longitude, case_count, risk_level, analysis_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', saved)
+            conn.commit()
+            conn.close()
         
         # Convert to native types
         return self._convert_to_native_types(sorted(clusters, key=lambda x: x['case_count'], reverse=True))
     
-    def detect_outbreak(self, disease_type: str, days_window: int = 7, 
-                       threshold_increase: float = 2.0) -> Dict:
+    @timed('analyzer.get_heatmap')
+    def get_heatmap(self, disease_type: str, start_date: str, end_date: str, bbox: tuple,
+                    zoom: int = 6, max_cells: int = MAX_HEATMAP_CELLS) -> Dict:
         """
-        Detect potential outbreak by comparing recent cases to historical average
+        Aggregate case counts into geohash cells for map rendering
+        Reads the precomputed per-day cell counts, so the cost depends on the
+        number of cells rather than the number of cases. Results are returned
+        as parallel arrays to keep the payload small.
         """
+        precision = heatmap_precision(zoom, bbox, max_cells)
+        _, cover = cover_bbox(bbox, max_precision=precision)
+        prefix_sql, prefix_params = prefix_conditions(cover, 'cell')
+        
         conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+        SELECT 
+            substr(cell, 1, ?) as area,
+            SUM(total_cases) as total_cases,
+            SUM(positive_cases) as positive_cases
+        FROM case_cell_counts
+        WHERE disease_type = ?
+        AND stat_date BETWEEN ? AND ?
+        AND {prefix_sql}
+        GROUP BY area
+        ''', [precision, disease_type, start_date, end_date] + prefix_params)
+        rows = cursor.fetchall()
+        conn.close()
+        
+        lat_size, lon_size = cell_size(precision)
+        heatmap = {
+            'disease_type': disease_type,
+            'start_date': start_date,
+            'end_date': end_date,
+            'precision': precision,
+            'cell_size': [lat_size, lon_size],
+            'cells': [],
+            'latitude': [],
+            'longitude': [],
+            'total_cases': [],
+            'positive_cases': []
+        }
+        
+        for row in rows:
+            if not intersects(row['area'], bbox):
+                continue
+            min_lat, min_lon, max_lat, max_lon = decode(row['area'])
+            heatmap['cells'].append(row['area'])
+            heatmap['latitude'].append(round((min_lat + max_lat) / 2, 6))
+            heatmap['longitude'].append(round((min_lon + max_lon) / 2, 6))
+            heatmap['total_cases'].append(row['total_cases'])
+            heatmap['positive_cases'].append(row['positive_cases'])
+        
+        return heatmap
+    
+    @timed('analyzer.query_cube')
+    def query_cube(self, start_date: str, end_date: str, group_by: List[str],
+                   filters: Dict = None, cell_precision: int = CUBE_PRECISION) -> List[Dict]:
+        """
+        Slice and roll up the surveillance cube
+        group_by lists the dimensions to keep (see aggregates.CUBE_DIMENSIONS);
+        all other dimensions are summed away. filters maps a dimension to a
+        value or list of values. Each row carries total and positive counts.
+        """
+        filters = filters or {}
+        expressions = [cube_dimension_sql(d, cell_precision) for d in group_by]
+        selected = [f'{expr} AS {d}' for expr, d in zip(expressions, group_by)]
+        
+        conditions = ['stat_date BETWEEN ? AND ?']
+        params = [start_date, end_date]
+        for dimension, value in filters.items():
+            column = cube_dimension_sql(dimension, cell_precision)
+            values = value if isinstance(value, (list, tuple)) else [value]
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        
+        query = f'''
+        SELECT 
+            {''.join(f'{col}, ' for col in selected)}
+            SUM(case_count) as total_cases,
+            SUM(CASE WHEN test_result = 'Positive' THEN case_count ELSE 0 END) as positive_cases
+        FROM surveillance_cube
+        WHERE {' AND '.join(conditions)}
+        '''
+        if group_by:
+            # Group on the expressions; aliases would resolve to raw columns
+            query += f" GROUP BY {', '.join(expressions)} ORDER BY {', '.join(expressions)}"
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return rows
+    
+    @timed('analyzer.score_area_risk')
+    def score_area_risk(self, disease_type: str, end_date: str, window_days: int = 30,
+                        recent_days: int = 7) -> List[Dict]:
+        """
+        Score hotspot risk for every area (cube cell) with cases in the window
+        Features for all areas come from one aggregate query over the cube and
+        are scored by the hotspot model in a single batch
+        """
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        window_start = end - timedelta(days=window_days - 1)
+        recent_start = end - timedelta(days=recent_days - 1)
+        previous_start = recent_start - timedelta(days=recent_days)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT 
+            cell as area,
+            SUM(CASE WHEN test_result = 'Positive' THEN case_count ELSE 0 END) as positive_cases,
+            SUM(case_count) as total_tests,
+            SUM(CASE WHEN test_result = 'Positive' AND stat_date >= ? THEN case_count ELSE 0 END) as recent_positive,
+            SUM(CASE WHEN test_result = 'Positive' AND stat_date >= ? AND stat_date < ?
+                THEN case_count ELSE 0 END) as previous_positive,
+            COUNT(DISTINCT stat_date) as active_days
+        FROM surveillance_cube
+        WHERE disease_type = ?
+        AND stat_date BETWEEN ? AND ?
+        AND cell != ''
+        GROUP BY cell
+        ''', (str(recent_start), str(previous_start), str(recent_start),
+              disease_type, str(window_start), str(end)))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
         
-        today = datetime.now().date()
+        features = build_area_features(rows)
+        scores = self.model.score(features)
+        
+        areas = []
+        for row, feature_row, score in zip(rows, features, scores):
+            min_lat, min_lon, max_lat, max_lon = decode(row['area'])
+            areas.append({
+                'area': row['area'],
+                'latitude': (min_lat + max_lat) / 2,
+                'longitude': (min_lon + max_lon) / 2,
+                'risk_score': score,
+                'features': dict(zip(FEATURE_COLUMNS, feature_row))
+            })
+        
+        return self._convert_to_native_types(sorted(areas, key=lambda a: a['risk_score'], reverse=True))
+    
+    @timed('analyzer.forecast_cases')
+    def forecast_cases(self, end_date: str, horizon: int = 7, disease_type: str = None,
+                       area_precision: int = AREA_PRECISION, method: str = 'poisson') -> Dict:
+        """
+        Forecast daily positive cases for every disease x area series
+        Areas are geohash cells at area_precision; see forecasting.CaseForecaster
+        """
+        conn = self.get_connection()
+        try:
+            return self.forecaster.forecast(conn, end_date, horizon, disease_type, area_precision, method)
+        finally:
+            conn.close()
+    
+    @timed('analyzer.detect_outbreak')
+    def detect_outbreak(self, disease_type: str, days_window: int = 7, 
+                       threshold_increase: float = 2.0, analysis_date: str = None) -> Dict:
+        """
+        Detect potential outbreak by comparing recent cases to historical average
+        as of analysis_date (default today)
+        """
+        if analysis_date:
+            today = datetime.strptime(analysis_date, '%Y-%m-%d').date()
+        else:
+            today = datetime.now().date()
         recent_start = today - timedelta(days=days_window)
         historical_start = today - timedelta(days=30)
         
+        if self._in_series_store(historical_start, today):
+            recent_count = int(self.series_store.window(disease_type, recent_start, today)[POSITIVE].sum())
+            historical_count = int(self.series_store.window(disease_type, historical_start, recent_start)[POSITIVE].sum())
+        elif self._in_case_store(historical_start):
+            recent_count = self.case_store.count_positive(disease_type, recent_start, today)
+            historical_count = self.case_store.count_positive(disease_type, historical_start, recent_start)
+        else:
+            recent_count, historical_count = self._outbreak_counts_sql(
+                disease_type, today, recent_start, historical_start
+            )
+        
+        avg_per_week = historical_count / (30 / 7) if historical_count > 0 else 0
+        
+        is_outbreak = bool(recent_count >= (avg_per_week * threshold_increase) and recent_count >= 5)
+        
+        result = {
+            'disease_type': disease_type,
+            'is_outbreak': is_outbreak,
+            'recent_cases': int(recent_count),
+            'historical_avg': float(round(avg_per_week, 2)),
+            'increase_factor': float(round(recent_count / avg_per_week, 2)) if avg_per_week > 0 else 0.0,
+            'analysis_date': str(today),
+            'alert_level': 'High' if is_outbreak else 'Normal'
+        }
+        
+        # Convert to native types
+        return self._convert_to_native_types(result)
+    
+    def _outbreak_counts_sql(self, disease_type: str, today, recent_start, historical_start) -> tuple:
+        if self.shards is not None:
+            def partial(conn):
+                return conn.execute('''
+                SELECT 
+                    SUM(CASE WHEN test_date BETWEEN ? AND ? THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN test_date BETWEEN ? AND ? THEN 1 ELSE 0 END)
+                FROM test_results
+                WHERE disease_type = ?
+                AND test_result = 'Positive'
+                AND test_date BETWEEN ? AND ?
+                ''', (str(recent_start), str(today), str(historical_start), str(recent_start),
+                      disease_type, str(historical_start), str(today))).fetchone()
+            
+            counts = self.shards.fan_out(partial)
+            return sum(recent or 0 for recent, _ in counts), sum(historical or 0 for _, historical in counts)
+        
+        conn = self.get_connection((str(historical_start), str(today)))
+        
         # Get recent cases
         query_recent = '''
         SELECT COUNT(*) as count
@@ -292,23 +737,7 @@ class DiseaseAnalyzer:
         historical_count = int(historical_df['count'][0])
         
         conn.close()
-        
-        avg_per_week = historical_count / (30 / 7) if historical_count > 0 else 0
-        
-        is_outbreak = bool(recent_count >= (avg_per_week * threshold_increase) and recent_count >= 5)
-        
-        result = {
-            'disease_type': disease_type,
-            'is_outbreak': is_outbreak,
-            'recent_cases': int(recent_count),
-            'historical_avg': float(round(avg_per_week, 2)),
-            'increase_factor': float(round(recent_count / avg_per_week, 2)) if avg_per_week > 0 else 0.0,
-            'analysis_date': str(today),
-            'alert_level': 'High' if is_outbreak else 'Normal'
-        }
-        
-        # Convert to native types
-        return self._convert_to_native_types(result)
+        return recent_count, historical_count
 
 
 # Example usage
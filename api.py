@@ -1,31 +1,278 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from datetime import datetime, timedelta
+import functools
+import hmac
 import sys
 import os
+import tempfile
+import threading
+import time
+import uuid
 
 # Import our modules
-from data_ingestion import DataIngestion
+from data_ingestion import DataIngestion, DEFAULT_PAGE_SIZE, month_date_range, validate_case_fields
+from data_export import (
+    COLUMNAR_FIELDS, EXPORT_FORMATS, build_case_columns, export_stream, write_case_columns
+)
 from analysis import DiseaseAnalyzer
-from create_db import create_database, check_database_exists
+from case_store import CASE_STORE_DAYS, CaseStore
+from series_store import DailySeriesStore
+from sharding import SHARDING, check_unarchived
+from replica import read_replica
+from aggregates import CUBE_DIMENSIONS, CUBE_PRECISION, MAX_HEATMAP_CELLS
+from model_serving import FEATURE_COLUMNS, ModelUnavailableError
+from forecasting import AREA_PRECISION
+from jobs import JobManager, JobRunner
+from singleflight import SingleFlight
+from precompute import (
+    PRECOMPUTED_ANALYSES, PrecomputeScheduler, ResultStore, analysis_params, serve_analysis
+)
+from create_db import ensure_database
+from lazy import load_lazy_modules
+import timing
+from timing import TIMING_HEADER, TIMING_LOG, timed
+from metrics import CACHE_REQUESTS, ERRORS, REGISTRY, REQUEST_SECONDS, REQUESTS
+from slow_queries import QUERY_LOG
+from profiler import (
+    PROFILE_INTERVAL, REQUEST_PROFILE_INTERVAL, StackSampler, load_profile, profile_worker, save_profile
+)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with serialization timed as 'json'"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        with timed('json'):
+            return super().dumps(obj, **kwargs)
+
 
 app = Flask(__name__)
-CORS(app)
+app.json = TimedJSONProvider(app)
+CORS(app, expose_headers=['Server-Timing'])
 
 # Initialize database on startup
 DB_PATH = os.environ.get('DATABASE_PATH', 'demicstech.db')
 
-print("🔍 Checking database...")
-if not check_database_exists(DB_PATH):
-    print("📦 Database not found. Creating new database...")
-    create_database(DB_PATH)
-    print("✅ Database initialized successfully!")
-else:
-    print("✅ Database found and ready!")
+# Default map extent (min_lat,min_lon,max_lat,max_lon)
+NIGERIA_BBOX = '4.0,2.5,14.0,15.0'
+
+# Token /admin endpoints require in the X-Admin-Token header; they are disabled while unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Admin requests sending this header with value 1 are profiled; see /admin/profiles/<id>
+PROFILE_HEADER = 'X-Profile'
+
+# Optionally precompute dashboard analytics alongside the API;
+# alternatively run `python precompute.py` as a separate worker
+PRECOMPUTE_IN_PROCESS = os.environ.get('PRECOMPUTE_IN_PROCESS', 'false').lower() in ('1', 'true', 'yes')
+
+# Job pool workers are spawned, and a spawned process first re-imports the
+# script its parent was started from as __mp_main__. When that is this file
+# (`python api.py`), the database and services are left alone in them.
+if __name__ != '__mp_main__':
+    # Creates or migrates the database only when its schema version is behind
+    if ensure_database(DB_PATH):
+        print("✅ Database initialized successfully!")
+    if SHARDING:
+        check_unarchived(DB_PATH)
+
+    # Initialize services
+    # Memory-mapped daily count series beside the database; SERIES_STORE=false disables them.
+    # Both stores read the main database only, so they are off when SHARDING is enabled.
+    USE_SERIES_STORE = os.environ.get('SERIES_STORE', 'true').lower() in ('1', 'true', 'yes') and not SHARDING
+    series_store = DailySeriesStore(db_path=DB_PATH) if USE_SERIES_STORE else None
+    ingestion = DataIngestion(db_path=DB_PATH, series_store=series_store)
+    # Recent cases kept in memory for repeat analytics; CASE_STORE_DAYS=0 disables it
+    case_store = CaseStore(db_path=DB_PATH) if CASE_STORE_DAYS > 0 and not SHARDING else None
+    # Analytics read a snapshot copy when READ_REPLICA is 'memory' or 'file'
+    replica = read_replica(DB_PATH)
+    analyzer = DiseaseAnalyzer(db_path=DB_PATH, case_store=case_store, series_store=series_store,
+                               replica=replica)
+    result_store = ResultStore(db_path=DB_PATH)
+    job_manager = JobManager(db_path=DB_PATH)
+    # Runs queued jobs under the development server only; serve.py runs
+    # them in its background process instead of in recycled web workers
+    job_runner = JobRunner(db_path=DB_PATH)
+
+    # Concurrent identical analytics requests share one computation
+    analysis_flights = SingleFlight()
+    # Runs when PRECOMPUTE_IN_PROCESS is set
+    scheduler = PrecomputeScheduler(db_path=DB_PATH)
+
+    # Statement statistics are snapshotted with the metrics, for /admin/queries in any worker
+    if QUERY_LOG.enabled:
+        REGISTRY.on_flush(QUERY_LOG.flush)
+
+    # Queue depths, read whenever metrics are exported
+    REGISTRY.gauge('demicstech_analyses_in_flight', 'Distinct analyses being computed for waiting requests',
+                   function=analysis_flights.in_flight)
+    # Read from the shared database by the exporting worker alone
+    JOBS_BY_STATUS = REGISTRY.gauge('demicstech_jobs', 'Background analysis jobs by status', ('status',),
+                                    shared=False)
+    if replica is not None:
+        REGISTRY.gauge('demicstech_replica_lag_seconds', 'Age of the read replica', shared=False,
+                       function=lambda: replica.lag)
+
+# Upper bound on how much of the database file warm_up reads into the page cache
+WARM_UP_MAX_BYTES = int(os.environ.get('WARM_UP_MAX_BYTES', 256 * 1024 * 1024))
+
+
+def warm_up():
+    """
+    Prepare the process before it serves (or forks workers that serve):
+    read the database into the OS page cache, bring the daily series up to
+    date, load recent cases, map the model if present and prime the forecast cache, so the first requests are
+    not the slow ones
+    """
+    load_lazy_modules()
+
+    read = 0
+    with open(DB_PATH, 'rb') as f:
+        while read < WARM_UP_MAX_BYTES:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            read += len(chunk)
+
+    if series_store is not None:
+        series_store.sync()
+    if case_store is not None:
+        case_store.refresh()
+    if replica is not None:
+        try:
+            replica.refresh()
+        except Exception as e:
+            print(f"Replica warm-up skipped: {e}")
+
+    try:
+        analyzer.model.load()
+    except ModelUnavailableError:
+        pass
 
-# Initialize services
-ingestion = DataIngestion(db_path=DB_PATH)
-analyzer = DiseaseAnalyzer(db_path=DB_PATH)
+    try:
+        analyzer.forecast_cases(datetime.now().strftime('%Y-%m-%d'))
+    except Exception as e:
+        print(f"Forecast warm-up skipped: {e}")
+
+    print(f"🔥 Warmed up ({read // 1024} KB of database cached)")
+
+
+def start_background_services():
+    """Start threads that must live in the serving process, after any fork"""
+    job_runner.start()
+    if PRECOMPUTE_IN_PROCESS:
+        scheduler.start()
+
+
+@app.before_request
+def start_request_timing():
+    g.started = time.perf_counter()
+    # TIMING turns timing on for every request; the header for just this one
+    timing.begin(force=request.headers.get(TIMING_HEADER) == '1')
+    if request.headers.get(PROFILE_HEADER) == '1' and is_admin_request():
+        g.profiler = StackSampler(REQUEST_PROFILE_INTERVAL, thread_ids=[threading.get_ident()],
+                                  include_idle=True).start()
+
+
+@app.after_request
+def add_server_timing(response):
+    """Report where the request's time went as a Server-Timing header, and record its metrics"""
+    timings = timing.finish()
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.header()
+        if TIMING_LOG:
+            timing.log(request.method, request.path, response.status_code, timings)
+
+    # Labelled by route pattern, not path, so ids and query strings do not add series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    if response.status_code >= 400:
+        ERRORS.inc(method=request.method, route=route)
+    if 'started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.started, method=request.method, route=route)
+    REGISTRY.maybe_flush()
+
+    if 'profiler' in g:
+        profile_id = uuid.uuid4().hex
+        save_profile(profile_id, g.pop('profiler').stop().collapsed())
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    """Stop the request's sampler if after_request never got to it, e.g. when a handler raised"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+
+def is_admin_request() -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+
+def require_admin(view):
+    """Reject requests to view that do not carry ADMIN_TOKEN"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'success': False, 'error': 'Admin endpoints are disabled; set ADMIN_TOKEN'}), 404
+        if not is_admin_request():
+            return jsonify({'success': False, 'error': 'Invalid or missing X-Admin-Token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def serve_coalesced(analysis: str, disease_type: str, params: dict) -> tuple:
+    """serve_analysis, with concurrent identical requests waiting on a single run"""
+    key = ResultStore.result_key(analysis, disease_type, params)
+    (result, freshness), shared = analysis_flights.do(
+        key, serve_analysis, result_store, analyzer, analysis, disease_type, params
+    )
+    CACHE_REQUESTS.inc(cache='coalesced', result='hit' if shared else 'miss')
+    if shared:
+        freshness = dict(freshness, coalesced=True)
+    return result, freshness
+
+
+def parse_case_date_range(args) -> tuple:
+    """Read start_date/end_date from query args, falling back to month/year"""
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    
+    if start_date or end_date:
+        if not start_date or not end_date:
+            raise ValueError('start_date and end_date must be given together')
+        for value in (start_date, end_date):
+            datetime.strptime(value, '%Y-%m-%d')
+        return start_date, end_date
+    
+    # Legacy month/year parameters cover the whole calendar month
+    month = int(args.get('month', datetime.now().month))
+    year = int(args.get('year', datetime.now().year))
+    start_date, next_month = month_date_range(month, year)
+    end_date = str(datetime.strptime(next_month, '%Y-%m-%d').date() - timedelta(days=1))
+    return start_date, end_date
+
+
+def parse_bbox(value: str) -> tuple:
+    """Parse a 'min_lat,min_lon,max_lat,max_lon' bounding box"""
+    try:
+        parts = [float(v) for v in value.split(',')]
+    except ValueError:
+        parts = []
+    if len(parts) != 4:
+        raise ValueError('bbox must be min_lat,min_lon,max_lat,max_lon')
+    min_lat, min_lon, max_lat, max_lon = parts
+    if not (-90 <= min_lat <= 90 and -90 <= max_lat <= 90):
+        raise ValueError('bbox latitudes must be between -90 and 90')
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError('bbox longitudes must be between -180 and 180')
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError('bbox minimums must not exceed its maximums (min_lat,min_lon,max_lat,max_lon)')
+    return tuple(parts)
 
 
 @app.route('/', methods=['GET'])
@@ -37,11 +284,19 @@ def home():
         'status': 'running',
         'endpoints': {
             'health': '/health',
+            'metrics': '/metrics',
             'hospitals': '/api/hospitals',
             'test_results': '/api/test-results',
             'statistics': '/api/statistics',
             'hotspots': '/api/hotspots',
+            'heatmap': '/api/heatmap',
+            'hotspot_risk': '/api/hotspots/risk',
+            'forecast': '/api/forecast',
+            'jobs': '/api/jobs',
+            'cube': '/api/cube',
             'outbreak': '/api/outbreak/detect',
+            'cases': '/api/cases',
+            'export': '/api/cases/export',
             'dashboard': '/api/dashboard'
         }
     }), 200
@@ -72,6 +327,67 @@ def health_check():
         }), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics of every worker in the Prometheus text exposition format"""
+    try:
+        counts = job_manager.status_counts()
+        for status in ('queued', 'running', 'done', 'failed'):
+            JOBS_BY_STATUS.set(counts.get(status, 0), status=status)
+    except Exception as e:
+        print(f"Job metrics unavailable: {e}")
+    return Response(REGISTRY.export(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/queries', methods=['GET'])
+@require_admin
+def get_query_stats():
+    """Statements with the most total (or sort=max_ms/avg_ms/count/slow_count) time, across workers"""
+    try:
+        if not QUERY_LOG.enabled:
+            raise ValueError('Statement tracking is off; set SLOW_QUERY_MS above 0')
+        limit = min(int(request.args.get('limit', 20)), 200)
+        statements = QUERY_LOG.top(limit, request.args.get('sort', 'total_ms'))
+        return jsonify({
+            'success': True,
+            'slow_query_ms': QUERY_LOG.threshold * 1000,
+            'statements': statements
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/admin/profile', methods=['GET'])
+@require_admin
+def profile_worker_stacks():
+    """
+    Sample the stacks of this worker's other threads for `seconds` (default 10)
+    Returns collapsed stacks for flame graphs, or a summary with format=json
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', PROFILE_INTERVAL * 1000)) / 1000
+        if seconds <= 0 or interval <= 0:
+            raise ValueError('seconds and interval_ms must be positive')
+        sampler = profile_worker(seconds, interval,
+                                 include_idle=request.args.get('idle', 'false').lower() in ('1', 'true', 'yes'))
+        if request.args.get('format', 'collapsed') == 'json':
+            return jsonify({'success': True, 'pid': os.getpid(), **sampler.summary()}), 200
+        return Response(sampler.collapsed(), mimetype='text/plain')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+@require_admin
+def get_request_profile(profile_id):
+    """Collapsed stacks of a request sent with X-Profile: 1 (its X-Profile-Id response header)"""
+    profile = load_profile(profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return Response(profile, mimetype='text/plain')
+
+
 @app.route('/api/hospitals', methods=['POST'])
 def add_hospital():
     """Add a new hospital to the system"""
@@ -164,8 +480,8 @@ def get_daily_statistics():
         disease_type = request.args.get('disease_type', 'Malaria')
         date = request.args.get('date', str(datetime.now().date()))
         
-        stats = analyzer.generate_daily_statistics(disease_type, date)
-        return jsonify({'success': True, 'statistics': stats}), 200
+        stats, freshness = serve_coalesced('daily_statistics', disease_type, {'date': date})
+        return jsonify({'success': True, 'statistics': stats, 'freshness': freshness}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -178,8 +494,9 @@ def get_monthly_statistics():
         month = int(request.args.get('month', datetime.now().month))
         year = int(request.args.get('year', datetime.now().year))
         
-        stats = analyzer.generate_monthly_statistics(disease_type, month, year)
-        return jsonify({'success': True, 'statistics': stats}), 200
+        stats, freshness = serve_coalesced('monthly_statistics', disease_type,
+                                           {'month': month, 'year': year})
+        return jsonify({'success': True, 'statistics': stats, 'freshness': freshness}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -193,21 +510,142 @@ def get_hotspots():
         end_date = request.args.get('end_date', str(datetime.now().date()))
         radius_km = float(request.args.get('radius_km', 5.0))
         min_cases = int(request.args.get('min_cases', 3))
+        bbox = request.args.get('bbox')
         
         if not start_date:
             # Default to last 30 days
             start_date = str(datetime.now().date() - timedelta(days=30))
         
-        hotspots = analyzer.detect_hotspots(disease_type, start_date, end_date, radius_km, min_cases)
+        if bbox:
+            hotspots, shared = analysis_flights.do(
+                ('hotspots', disease_type, start_date, end_date, radius_km, min_cases, bbox),
+                analyzer.detect_hotspots, disease_type, start_date, end_date, radius_km, min_cases,
+                bbox=parse_bbox(bbox)
+            )
+            freshness = {'source': 'live', 'staleness_seconds': 0, 'coalesced': shared}
+        else:
+            hotspots, freshness = serve_coalesced('hotspots', disease_type, {
+                'start_date': start_date, 'end_date': end_date,
+                'radius_km': radius_km, 'min_cases': min_cases
+            })
         return jsonify({
             'success': True,
             'hotspots': hotspots,
-            'count': len(hotspots)
+            'count': len(hotspots),
+            'freshness': freshness
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/heatmap', methods=['GET'])
+def get_heatmap():
+    """Get case counts aggregated into map cells for a zoom level and bounding box"""
+    try:
+        disease_type = request.args.get('disease_type', 'Malaria')
+        end_date = request.args.get('end_date', str(datetime.now().date()))
+        start_date = request.args.get('start_date', str(datetime.now().date() - timedelta(days=30)))
+        bbox = parse_bbox(request.args.get('bbox', NIGERIA_BBOX))
+        zoom = int(request.args.get('zoom', 6))
+        max_cells = min(int(request.args.get('max_cells', MAX_HEATMAP_CELLS)), MAX_HEATMAP_CELLS)
+        
+        heatmap = analyzer.get_heatmap(disease_type, start_date, end_date, bbox, zoom, max_cells)
+        return jsonify({'success': True, 'heatmap': heatmap}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/cube', methods=['GET'])
+def query_cube():
+    """Slice or roll up case counts by any combination of cube dimensions"""
+    try:
+        end_date = request.args.get('end_date', str(datetime.now().date()))
+        start_date = request.args.get('start_date', str(datetime.now().date() - timedelta(days=365)))
+        group_by = [d.strip() for d in request.args.get('group_by', '').split(',') if d.strip()]
+        cell_precision = int(request.args.get('cell_precision', CUBE_PRECISION))
+        
+        # Any other query argument naming a dimension filters on it
+        filters = {}
+        for dimension in CUBE_DIMENSIONS:
+            values = request.args.get(dimension)
+            if values:
+                filters[dimension] = [v.strip() for v in values.split(',')]
+        
+        rows = analyzer.query_cube(start_date, end_date, group_by, filters, cell_precision)
+        return jsonify({
+            'success': True,
+            'group_by': group_by,
+            'rows': rows,
+            'count': len(rows)
         }), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+@app.route('/api/hotspots/risk', methods=['GET'])
+def get_hotspot_risk():
+    """Score hotspot risk for every area with recent cases using the ML model"""
+    try:
+        disease_type = request.args.get('disease_type', 'Tuberculosis')
+        end_date = request.args.get('end_date', str(datetime.now().date()))
+        window_days = int(request.args.get('window_days', 30))
+        recent_days = int(request.args.get('recent_days', 7))
+        
+        areas, _ = analysis_flights.do(
+            ('area_risk', disease_type, end_date, window_days, recent_days),
+            analyzer.score_area_risk, disease_type, end_date, window_days, recent_days
+        )
+        return jsonify({
+            'success': True,
+            'areas': areas,
+            'count': len(areas)
+        }), 200
+    except ModelUnavailableError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/model/score', methods=['POST'])
+def score_features():
+    """Score a batch of feature rows with the hotspot model"""
+    try:
+        data = request.json
+        features = data.get('features')
+        
+        if not features:
+            return jsonify({
+                'success': False,
+                'error': f'features must be a list of rows: {FEATURE_COLUMNS}'
+            }), 400
+        
+        scores = analyzer.model.score(features)
+        return jsonify({'success': True, 'scores': scores.tolist()}), 200
+    except ModelUnavailableError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/forecast', methods=['GET'])
+def get_forecast():
+    """Forecast daily positive cases per disease and area"""
+    try:
+        disease_type = request.args.get('disease_type')
+        end_date = request.args.get('end_date', str(datetime.now().date()))
+        horizon = int(request.args.get('horizon', 7))
+        area_precision = int(request.args.get('area_precision', AREA_PRECISION))
+        method = request.args.get('method', 'poisson')
+        
+        forecast, _ = analysis_flights.do(
+            ('forecast', end_date, horizon, disease_type, area_precision, method),
+            analyzer.forecast_cases, end_date, horizon, disease_type, area_precision, method
+        )
+        return jsonify({'success': True, 'forecast': forecast}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
 @app.route('/api/outbreak/detect', methods=['GET'])
 def detect_outbreak():
     """Detect potential disease outbreak"""
@@ -216,26 +654,164 @@ def detect_outbreak():
         days_window = int(request.args.get('days_window', 7))
         threshold = float(request.args.get('threshold', 2.0))
         
-        result = analyzer.detect_outbreak(disease_type, days_window, threshold)
-        return jsonify({'success': True, 'outbreak_analysis': result}), 200
+        result, freshness = serve_coalesced('outbreak', disease_type, {
+            'date': str(datetime.now().date()), 'days_window': days_window, 'threshold': threshold
+        })
+        return jsonify({'success': True, 'outbreak_analysis': result, 'freshness': freshness}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
 @app.route('/api/cases', methods=['GET'])
 def get_cases():
-    """Get cases for a specific disease and time period"""
+    """Get a page of cases for a disease over a date range"""
     try:
         disease_type = request.args.get('disease_type', 'Malaria')
-        month = int(request.args.get('month', datetime.now().month))
-        year = int(request.args.get('year', datetime.now().year))
+        start_date, end_date = parse_case_date_range(request.args)
+        
+        fields = request.args.get('fields')
+        bbox = request.args.get('bbox')
+        hospital_id = request.args.get('hospital_id')
         
-        cases = ingestion.get_monthly_cases(disease_type, month, year)
+        page = ingestion.query_cases(
+            disease_type,
+            start_date,
+            end_date,
+            hospital_id=int(hospital_id) if hospital_id else None,
+            test_result=request.args.get('test_result'),
+            severity=request.args.get('severity'),
+            bbox=parse_bbox(bbox) if bbox else None,
+            fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None,
+            limit=int(request.args.get('limit', DEFAULT_PAGE_SIZE)),
+            cursor_token=request.args.get('cursor')
+        )
+        return jsonify({
+            'success': True,
+            'cases': page['cases'],
+            'count': len(page['cases']),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/cases/export', methods=['GET'])
+def export_cases():
+    """Export matching cases as streamed CSV/NDJSON (optionally gzipped) or columnar .npz"""
+    try:
+        diseases = request.args.get('disease_type', 'Malaria')
+        disease_types = [d.strip() for d in diseases.split(',') if d.strip()]
+        start_date, end_date = parse_case_date_range(request.args)
+        
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+        
+        fields = request.args.get('fields')
+        if export_format == 'npz':
+            # The columnar layout has a fixed set of typed columns
+            fields = COLUMNAR_FIELDS
+        else:
+            fields = validate_case_fields(
+                [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+            )
+        bbox = request.args.get('bbox')
+        hospital_id = request.args.get('hospital_id')
+        
+        rows = ingestion.iter_cases(
+            disease_types,
+            start_date,
+            end_date,
+            hospital_id=int(hospital_id) if hospital_id else None,
+            test_result=request.args.get('test_result'),
+            severity=request.args.get('severity'),
+            bbox=parse_bbox(bbox) if bbox else None,
+            fields=fields
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    filename = f"{'_'.join(disease_types)}_cases_{start_date}_{end_date}.{export_format}"
+    
+    if export_format == 'npz':
+        # Columns are built from the cursor stream, then spooled to disk
+        try:
+            columns = build_case_columns(rows)
+            spool = tempfile.TemporaryFile()
+            write_case_columns(columns, spool)
+            spool.seek(0)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        return send_file(spool, mimetype=EXPORT_FORMATS['npz'],
+                         as_attachment=True, download_name=filename)
+    
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(
+        export_stream(rows, fields, export_format, compress),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers=headers
+    )
+
+
+@app.route('/api/cases/nearby', methods=['GET'])
+def get_nearby_cases():
+    """Get positive cases within a radius of a point"""
+    try:
+        disease_type = request.args.get('disease_type', 'Malaria')
+        latitude = float(request.args['latitude'])
+        longitude = float(request.args['longitude'])
+        radius_km = float(request.args.get('radius_km', 5.0))
+        end_date = request.args.get('end_date', str(datetime.now().date()))
+        start_date = request.args.get('start_date', str(datetime.now().date() - timedelta(days=30)))
+        
+        cases = analyzer.find_cases_near(disease_type, start_date, end_date, latitude, longitude, radius_km)
         return jsonify({
             'success': True,
             'cases': cases,
             'count': len(cases)
         }), 200
+    except KeyError as e:
+        return jsonify({'success': False, 'error': f'Missing required parameter: {e.args[0]}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Submit a long-running analysis to the background worker pool"""
+    try:
+        data = request.json or {}
+        
+        if not data.get('analysis'):
+            return jsonify({'success': False, 'error': 'analysis is required'}), 400
+        
+        disease_types = data.get('disease_type', 'Malaria')
+        if isinstance(disease_types, str):
+            disease_types = [d.strip() for d in disease_types.split(',') if d.strip()]
+        
+        job = job_manager.submit(data['analysis'], disease_types, data.get('params'))
+        return jsonify({
+            'success': True,
+            'job': job,
+            'status_url': f"/api/jobs/{job['job_id']}"
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a background job for status, progress and result"""
+    try:
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+        return jsonify({'success': True, 'job': job}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -246,27 +822,26 @@ def get_dashboard_data():
     try:
         disease_type = request.args.get('disease_type', 'Malaria')
         
-        today = str(datetime.now().date())
-        month = datetime.now().month
-        year = datetime.now().year
-        
-        # Get various analytics
-        daily_stats = analyzer.generate_daily_statistics(disease_type, today)
-        monthly_stats = analyzer.generate_monthly_statistics(disease_type, month, year)
-        outbreak_status = analyzer.detect_outbreak(disease_type)
+        today = datetime.now().date()
         
-        start_date = str(datetime.now().date() - timedelta(days=30))
-        hotspots = analyzer.detect_hotspots(disease_type, start_date, today)
+        # Get various analytics, from the precompute store when fresh enough
+        results = {}
+        freshness = {}
+        for analysis in PRECOMPUTED_ANALYSES:
+            results[analysis], freshness[analysis] = serve_coalesced(
+                analysis, disease_type, analysis_params(analysis, today)
+            )
         
         return jsonify({
             'success': True,
             'dashboard': {
                 'disease_type': disease_type,
-                'date': today,
-                'daily_statistics': daily_stats,
-                'monthly_statistics': monthly_stats,
-                'outbreak_status': outbreak_status,
-                'hotspots': hotspots[:5]  # Top 5 hotspots
+                'date': str(today),
+                'daily_statistics': results['daily_statistics'],
+                'monthly_statistics': results['monthly_statistics'],
+                'outbreak_status': results['outbreak'],
+                'hotspots': results['hotspots'][:5],  # Top 5 hotspots
+                'freshness': freshness
             }
         }), 200
     except Exception as e:
@@ -304,6 +879,9 @@ if __name__ == '__main__':
     print("\n📚 Available Endpoints:")
     print("  GET    /              - API information")
     print("  GET    /health        - Health check")
+    print("  GET    /metrics       - Prometheus metrics")
+    print("  GET    /admin/queries - Slowest SQL statements (X-Admin-Token)")
+    print("  GET    /admin/profile - Sample this worker's stacks (X-Admin-Token)")
     print("  POST   /api/hospitals - Add hospital")
     print("  GET    /api/hospitals - Get all hospitals")
     print("  POST   /api/test-results - Add test result")
@@ -311,12 +889,21 @@ if __name__ == '__main__':
     print("  GET    /api/statistics/daily - Daily statistics")
     print("  GET    /api/statistics/monthly - Monthly statistics")
     print("  GET    /api/hotspots - Detect hotspots")
+    print("  GET    /api/heatmap - Heatmap cell counts")
+    print("  GET    /api/hotspots/risk - Model risk score per area")
+    print("  POST   /api/model/score - Batch model scoring")
+    print("  GET    /api/forecast - Case forecasts per disease and area")
+    print("  GET    /api/cube - Surveillance cube slices")
     print("  GET    /api/outbreak/detect - Detect outbreak")
-    print("  GET    /api/cases - Get cases")
+    print("  GET    /api/cases - Query cases (paginated)")
+    print("  GET    /api/cases/export - Export cases as CSV/NDJSON/NPZ")
+    print("  GET    /api/cases/nearby - Cases near a point")
+    print("  POST   /api/jobs - Submit background analysis")
+    print("  GET    /api/jobs/<id> - Background job status")
     print("  GET    /api/dashboard - Dashboard data")
     print("="*60)
     print("✅ Server ready!\n")
     
-    # Run the app
-    # Use debug=False for production on Render
+    # Development server; use `python serve.py` for multi-worker serving
+    start_background_services()
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -599,9 +599,9 @@ def view_cases():
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        month = st.selectbox("📅 Month", range(1, 13), index=datetime.now().month - 1)
+        start_date = st.date_input("📅 Start Date", datetime.now().date().replace(day=1))
     with col2:
-        year = st.number_input("📅 Year", min_value=2020, max_value=2030, value=datetime.now().year)
+        end_date = st.date_input("📅 End Date", datetime.now().date())
     with col3:
         st.write("")  # Spacing
         load_button = st.button("🔍 Load Cases", type="primary")
@@ -610,30 +610,43 @@ def view_cases():
     
     if load_button:
         try:
+            # The API returns cases a page at a time; follow next_cursor to the end
+            cases = []
+            params = {
+                "disease_type": disease_type,
+                "start_date": str(start_date),
+                "end_date": str(end_date),
+                "limit": 5000
+            }
             with st.spinner("Loading cases..."):
-                response = requests.get(f"{API_URL}/api/cases", params={
-                    "disease_type": disease_type,
-                    "month": month,
-                    "year": year
-                })
+                while True:
+                    response = requests.get(f"{API_URL}/api/cases", params=params)
+                    if response.status_code != 200:
+                        break
+                    payload = response.json()
+                    cases.extend(payload['cases'])
+                    if not payload.get('has_more') or not payload.get('next_cursor'):
+                        break
+                    params["cursor"] = payload['next_cursor']
             
-            if response.status_code == 200:
-                cases = response.json()['cases']
-                
+            if response.status_code != 200:
+                st.error(f"❌ Error: {response.json().get('error')}")
+            else:
                 if cases:
                     st.success(f"✅ Found {len(cases)} cases")
                     
                     df = pd.DataFrame(cases)
                     st.dataframe(df, use_container_width=True, height=400)
                     
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        "📥 Download CSV",
-                        csv,
-                        f"{disease_type}_cases_{year}_{month:02d}.csv",
-                        "text/csv",
-                        key='download-csv'
-                    )
+                    # The API streams the full export, so nothing is buffered here
+                    export_url = requests.Request("GET", f"{API_URL}/api/cases/export", params={
+                        "disease_type": disease_type,
+                        "start_date": str(start_date),
+                        "end_date": str(end_date),
+                        "format": "csv",
+                        "gzip": "true"
+                    }).prepare().url
+                    st.link_button("📥 Download CSV", export_url)
                 else:
                     st.info("ℹ️ No cases found for this period.")
         
@@ -0,0 +1,435 @@
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import date
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+from lookups import LOOKUPS, LookupCodes, TEST_RESULTS_TABLE, decoded_test_results_sql
+from timing import open_connection
+
+# Months of test results (including the current one) kept in the main database
+HOT_MONTHS = int(os.environ.get('ARCHIVE_HOT_MONTHS', 12))
+
+# Most archive files kept; older years are merged into one file beyond this.
+# A read over every year attaches them all, and SQLite allows 10 attachments
+# per connection by default.
+MAX_ARCHIVE_FILES = int(os.environ.get('ARCHIVE_MAX_FILES', 8))
+
+# Seconds an archive file replaced by a merge is kept for readers that had
+# already looked it up in the catalog
+TOMBSTONE_SECONDS = float(os.environ.get('ARCHIVE_TOMBSTONE_SECONDS', 3600))
+
+
+def archive_dir(db_path: str) -> str:
+    """Where archive files go: one per calendar year of test_date"""
+    return os.environ.get('ARCHIVE_DIR', os.path.splitext(db_path)[0] + '_archive')
+
+
+def hot_cutoff(today: Optional[date] = None, hot_months: int = HOT_MONTHS) -> str:
+    """First test_date kept in the main database: the start of the month hot_months - 1 back"""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - (hot_months - 1)
+    return str(date(months // 12, months % 12 + 1, 1))
+
+
+def latest_result_id(conn) -> int:
+    """
+    Highest result_id ever assigned, wherever that row now lives
+    MAX(result_id) on the main table misses recent ids of back-dated rows
+    that were archived; AUTOINCREMENT's counter does not
+    """
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (TEST_RESULTS_TABLE,)).fetchone()
+    if row is not None:
+        return row[0]
+    return conn.execute('SELECT MAX(result_id) FROM test_results').fetchone()[0] or 0
+
+
+class ArchiveRouter:
+    """
+    Routes reads of test_results across the main database and the yearly
+    archive files older rows have been moved to
+    connect(start_date, end_date) attaches only the archives whose rows
+    overlap that range and shadows test_results with a TEMP VIEW over them,
+    so existing queries read hot and archived rows alike without changes.
+    When no archive overlaps, the connection is a plain one on the main file.
+    Archives are attached read-only, so a file removed since the catalog was
+    read fails the query rather than being recreated empty.
+    archive_old_results keeps at most MAX_ARCHIVE_FILES files, so even an
+    unbounded range stays within SQLite's limit on attached databases.
+    """
+
+    def __init__(self, db_path='demicstech.db'):
+        self.db_path = db_path
+
+    def partitions(self, conn, start_date: Optional[str] = None,
+                   end_date: Optional[str] = None) -> List[Dict]:
+        """Catalogued archives overlapping start_date..end_date (either may be open)"""
+        try:
+            rows = conn.execute('''
+            SELECT period, path, min_date, max_date, row_count FROM archive_partitions
+            WHERE (? IS NULL OR max_date >= ?) AND (? IS NULL OR min_date <= ?)
+            ORDER BY period
+            ''', (start_date, start_date, end_date, end_date)).fetchall()
+        except sqlite3.OperationalError:
+            # Database predates archiving
+            return []
+        base = os.path.dirname(os.path.abspath(self.db_path))
+        return [
+            {'period': period, 'path': os.path.join(base, path), 'min_date': min_date,
+             'max_date': max_date, 'row_count': row_count}
+            for period, path, min_date, max_date, row_count in rows
+        ]
+
+    def connect(self, start_date: Optional[str] = None, end_date: Optional[str] = None, conn=None):
+        """Connection reading test_results across main and archives; conn: one to extend instead"""
+        if conn is None:
+            # uri=True so the read-only archive URIs below are honoured in ATTACH
+            conn = open_connection(f'file:{quote(os.path.abspath(self.db_path))}', uri=True)
+            conn.row_factory = sqlite3.Row
+
+        partitions = self.partitions(conn, start_date, end_date)
+        available = _attach_limit(conn) - (len(conn.execute('PRAGMA database_list').fetchall()) - 1)
+        if len(partitions) > available:
+            conn.close()
+            raise sqlite3.OperationalError(
+                f"Test results from {start_date or 'the start'} to {end_date or 'now'} span {len(partitions)} "
+                f"archive files, but only {available} more databases can be attached; "
+                f"run archive.py to merge old years (ARCHIVE_MAX_FILES={MAX_ARCHIVE_FILES})"
+            )
+        if partitions:
+            # Decoded per file, so filters on lookup values still use each file's indexes
+            selects = [decoded_test_results_sql(f'main.{TEST_RESULTS_TABLE}', 'main')]
+            for partition in partitions:
+                schema = f"archive_{partition['period']}"
+                conn.execute('ATTACH DATABASE ? AS ' + schema, (read_only_uri(partition['path']),))
+                selects.append(decoded_test_results_sql(f'{schema}.{TEST_RESULTS_TABLE}', 'main'))
+            # Unqualified names resolve to temp first, so this shadows main.test_results
+            conn.execute(f"CREATE TEMP VIEW test_results AS {' UNION ALL '.join(selects)}")
+        return conn
+
+
+def read_only_uri(path: str) -> str:
+    """URI opening path read-only; SQLite fails to open it instead of creating it if missing"""
+    return f'file:{quote(os.path.abspath(path))}?mode=ro'
+
+
+def _attach_limit(conn) -> int:
+    """Databases conn may attach besides main and temp"""
+    if hasattr(conn, 'getlimit'):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return 10
+
+
+def _archive_ddl(conn) -> List[str]:
+    """CREATE statements for the test results table and its indexes, for use in an archive file"""
+    rows = conn.execute('''
+    SELECT sql FROM main.sqlite_master
+    WHERE tbl_name = ? AND type IN ('table', 'index') AND sql IS NOT NULL
+    ORDER BY type DESC
+    ''', (TEST_RESULTS_TABLE,)).fetchall()
+    # Foreign keys point at main's patients/hospitals/lookups, which archives do not hold
+    return [re.sub(r',\s*FOREIGN KEY[^,]*REFERENCES[^,)]*\([^)]*\)', '', row[0]) for row in rows]
+
+
+def archive_old_results(db_path: str = 'demicstech.db', hot_months: int = HOT_MONTHS,
+                        today: Optional[date] = None) -> Dict[str, int]:
+    """
+    Move test results dated before the hot window into yearly archive files
+    Each year is copied and deleted in one transaction. Summary tables,
+    series and ids are unaffected; result_ids are never reused because
+    AUTOINCREMENT remembers the highest one. Returns rows moved per year.
+    """
+    cutoff = hot_cutoff(today, hot_months)
+    directory = archive_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.dirname(os.path.abspath(db_path))
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    moved = {}
+    try:
+        sweep_tombstones(db_path, conn)
+        retired = {os.path.abspath(path) for path in _read_tombstones(db_path)}
+        catalogued = {partition['period']: os.path.abspath(partition['path'])
+                      for partition in ArchiveRouter(db_path).partitions(conn)}
+        years = [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT substr(test_date, 1, 4) FROM main.{TEST_RESULTS_TABLE} WHERE test_date < ?
+        ''', (cutoff,))]
+        ddl = _archive_ddl(conn)
+
+        for year in years:
+            path = catalogued.get(year) or os.path.abspath(os.path.join(directory, f'test_results_{year}.db'))
+            if path in retired:
+                # Merged away but possibly still read; the year starts a new file
+                path = os.path.abspath(os.path.join(directory, f'test_results_{year}-{int(time.time())}.db'))
+            conn.execute('ATTACH DATABASE ? AS archive', (path,))
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for statement in ddl:
+                    statement = re.sub(r'^CREATE (UNIQUE )?(TABLE|INDEX)( IF NOT EXISTS)? ',
+                                       lambda m: f"CREATE {m.group(1) or ''}{m.group(2)} IF NOT EXISTS archive.",
+                                       statement)
+                    conn.execute(statement)
+
+                bounds = (f'{year}-01-01', min(f'{int(year) + 1}-01-01', cutoff))
+                conn.execute(f'''
+                INSERT INTO archive.{TEST_RESULTS_TABLE} SELECT * FROM main.{TEST_RESULTS_TABLE}
+                WHERE test_date >= ? AND test_date < ?
+                ''', bounds)
+                count = conn.execute(f'DELETE FROM main.{TEST_RESULTS_TABLE} WHERE test_date >= ? AND test_date < ?',
+                                     bounds).rowcount
+
+                min_date, max_date, total = conn.execute(
+                    f'SELECT MIN(test_date), MAX(test_date), COUNT(*) FROM archive.{TEST_RESULTS_TABLE}'
+                ).fetchone()
+                conn.execute('''
+                INSERT INTO main.archive_partitions (period, path, min_date, max_date, row_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(period) DO UPDATE SET
+                    path = excluded.path, min_date = excluded.min_date,
+                    max_date = excluded.max_date, row_count = excluded.row_count
+                ''', (year, os.path.relpath(path, base), min_date, max_date, total))
+                conn.execute('COMMIT')
+                moved[year] = count
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.execute('DETACH DATABASE archive')
+    finally:
+        conn.close()
+
+    compact_archives(db_path)
+    return moved
+
+
+def compact_archives(db_path: str = 'demicstech.db', max_files: int = MAX_ARCHIVE_FILES) -> Optional[str]:
+    """
+    Merge the oldest archive files into one, so at most max_files remain
+    The merged file is written in full before the catalog is switched to it
+    in one transaction. Readers that looked up the catalog just before may
+    still attach the old files, so they are kept as tombstones and deleted
+    by a later run once TOMBSTONE_SECONDS have passed. Returns the merged
+    period (e.g. '2012_2016'), or None if nothing was merged.
+    """
+    router = ArchiveRouter(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        sweep_tombstones(db_path, conn)
+        partitions = router.partitions(conn)
+        if len(partitions) <= max(max_files, 1):
+            return None
+        merged = partitions[:len(partitions) - max(max_files, 1) + 1]
+        period = f"{merged[0]['period'].split('_')[0]}_{merged[-1]['period'].split('_')[-1]}"
+        path = os.path.abspath(os.path.join(archive_dir(db_path), f'test_results_{period}.db'))
+        if any(os.path.abspath(partition['path']) == path for partition in partitions):
+            raise ValueError(f"Archive {path} is already catalogued")
+        # Left over from an interrupted merge, never catalogued
+        if os.path.exists(path):
+            os.remove(path)
+
+        # Copied one file at a time, since attaching is not allowed inside a transaction
+        conn.execute('ATTACH DATABASE ? AS merged', (path,))
+        try:
+            for statement in _archive_ddl(conn):
+                conn.execute(re.sub(r'^CREATE (UNIQUE )?(TABLE|INDEX)( IF NOT EXISTS)? ',
+                                    lambda m: f"CREATE {m.group(1) or ''}{m.group(2)} IF NOT EXISTS merged.",
+                                    statement))
+            for partition in merged:
+                conn.execute('ATTACH DATABASE ? AS source', (partition['path'],))
+                try:
+                    conn.execute(f'INSERT INTO merged.{TEST_RESULTS_TABLE} SELECT * FROM source.{TEST_RESULTS_TABLE}')
+                finally:
+                    conn.execute('DETACH DATABASE source')
+        except Exception:
+            conn.execute('DETACH DATABASE merged')
+            os.remove(path)
+            raise
+
+        # Listed before the switch, so a crash after it cannot leak them;
+        # sweeping skips any still catalogued
+        tombstones = _read_tombstones(db_path)
+        tombstones.update((partition['path'], time.time()) for partition in merged)
+        _write_tombstones(db_path, tombstones)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            min_date, max_date, total = conn.execute(
+                f'SELECT MIN(test_date), MAX(test_date), COUNT(*) FROM merged.{TEST_RESULTS_TABLE}'
+            ).fetchone()
+            conn.executemany('DELETE FROM main.archive_partitions WHERE period = ?',
+                             [(partition['period'],) for partition in merged])
+            conn.execute('''
+            INSERT INTO main.archive_partitions (period, path, min_date, max_date, row_count)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (period, os.path.relpath(path, os.path.dirname(os.path.abspath(db_path))),
+                  min_date, max_date, total))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.execute('DETACH DATABASE merged')
+    finally:
+        conn.close()
+    return period
+
+
+def _tombstones_path(db_path: str) -> str:
+    return os.path.join(archive_dir(db_path), 'tombstones.json')
+
+
+def _read_tombstones(db_path: str) -> Dict[str, float]:
+    """{path: time it was retired} of archive files waiting to be deleted"""
+    try:
+        with open(_tombstones_path(db_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_tombstones(db_path: str, tombstones: Dict[str, float]):
+    path = _tombstones_path(db_path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(tombstones, f)
+    os.replace(path + '.tmp', path)
+
+
+def sweep_tombstones(db_path: str, conn, max_age: float = TOMBSTONE_SECONDS) -> int:
+    """
+    Delete archive files retired by a compaction more than max_age seconds
+    ago; conn is on the main database. Returns how many were deleted.
+    """
+    tombstones = _read_tombstones(db_path)
+    if not tombstones:
+        return 0
+    catalogued = {os.path.abspath(partition['path']) for partition in ArchiveRouter(db_path).partitions(conn)}
+    kept, deleted = {}, 0
+    for path, retired_at in tombstones.items():
+        if os.path.abspath(path) in catalogued:
+            # The compaction that retired it never switched the catalog
+            continue
+        if time.time() - retired_at < max_age:
+            kept[path] = retired_at
+        elif os.path.exists(path):
+            os.remove(path)
+            deleted += 1
+    _write_tombstones(db_path, kept)
+    return deleted
+
+
+def pending_encoding_marker(db_path: str) -> str:
+    """File present while archives of db_path still have to be dictionary-encoded"""
+    return os.path.splitext(db_path)[0] + '_archive.encoding'
+
+
+def _is_legacy_archive(archive) -> bool:
+    return archive.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'test_results'"
+    ).fetchone() is not None
+
+
+def add_legacy_archive_codes(path: str, cursor, codes: Optional[LookupCodes] = None) -> Dict[str, Dict]:
+    """
+    Add the lookup values used in a not yet encoded archive to the main
+    database behind cursor (not committed); returns {column: {value: id}}
+    """
+    codes = codes or LookupCodes()
+    archive = sqlite3.connect(path)
+    try:
+        if not _is_legacy_archive(archive):
+            return {}
+        return {
+            column: {value: codes.column(cursor, column, value)
+                     for (value,) in archive.execute(
+                         f'SELECT DISTINCT {column} FROM test_results WHERE {column} IS NOT NULL')}
+            for column in LOOKUPS
+        }
+    finally:
+        archive.close()
+
+
+def encode_legacy_archive(path: str, conn) -> bool:
+    """
+    Convert an archive file written before test results were dictionary-encoded
+    conn is on the main database. Any lookup values the archive needs are
+    committed there first, so the archive never refers to ids main lacks.
+    Returns False if the file is already encoded.
+    """
+    ids = add_legacy_archive_codes(path, conn.cursor())
+    if not ids:
+        return False
+    conn.commit()
+
+    archive = sqlite3.connect(path)
+    try:
+        archive.execute('CREATE TEMP TABLE codes (kind TEXT, name TEXT, id INTEGER, PRIMARY KEY (kind, name))')
+        archive.executemany('INSERT INTO codes VALUES (?, ?, ?)',
+                            [(column, value, code) for column, values in ids.items()
+                             for value, code in values.items()])
+
+        table, *indexes = _archive_ddl(conn)
+        archive.execute(table)
+        archive.execute(f'''
+        INSERT INTO {TEST_RESULTS_TABLE}
+            (result_id, patient_id, hospital_id, disease_id, outcome_id, test_date, severity_id,
+             symptoms, notes, created_at)
+        SELECT t.result_id, t.patient_id, t.hospital_id, d.id, o.id, t.test_date, s.id,
+               t.symptoms, t.notes, t.created_at
+        FROM test_results t
+        JOIN codes d ON d.kind = 'disease_type' AND d.name = t.disease_type
+        JOIN codes o ON o.kind = 'test_result' AND o.name = t.test_result
+        LEFT JOIN codes s ON s.kind = 'severity' AND s.name = t.severity
+        ''')
+        archive.execute('DROP TABLE test_results')
+        for statement in indexes:
+            archive.execute(statement)
+        archive.commit()
+        return True
+    finally:
+        archive.close()
+
+
+def encode_pending_archives(db_path: str) -> int:
+    """
+    Encode the archives left legacy by the migration to encoded test results,
+    once that migration has committed; returns how many were converted
+    """
+    marker = pending_encoding_marker(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        if not conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (TEST_RESULTS_TABLE,)).fetchone():
+            # The migration has not committed yet
+            return 0
+        converted = sum(encode_legacy_archive(partition['path'], conn)
+                        for partition in ArchiveRouter(db_path).partitions(conn))
+    finally:
+        conn.close()
+    if os.path.exists(marker):
+        os.remove(marker)
+    return converted
+
+
+if __name__ == "__main__":
+    # Periodic maintenance: python archive.py [hot_months]
+    import sys
+    from create_db import ensure_database
+    from sharding import SHARDING
+
+    if SHARDING:
+        sys.exit("Archiving is not supported with SHARDING enabled: sharded reads do not include archives")
+
+    db_path = os.environ.get('DATABASE_PATH', 'demicstech.db')
+    hot_months = int(sys.argv[1]) if len(sys.argv) > 1 else HOT_MONTHS
+    ensure_database(db_path)
+
+    moved = archive_old_results(db_path, hot_months)
+    for year, count in moved.items():
+        print(f"🗄️ Archived {count} test results from {year}")
+    # archive_old_results compacts too; this also catches up after ARCHIVE_MAX_FILES is lowered
+    merged = compact_archives(db_path)
+    if merged:
+        print(f"🗜️ Merged the oldest archives into {merged}")
+    print(f"✅ Test results before {hot_cutoff(hot_months=hot_months)} are archived")
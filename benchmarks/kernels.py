@@ -0,0 +1,301 @@
+"""
+Micro-benchmarks of the analysis and ingestion kernels, with regression budgets
+
+    python benchmarks/kernels.py [--dataset small] [--repeat 5] [--only detect_hotspots]
+    python benchmarks/kernels.py --save-baseline     # record the current numbers as the baseline
+    python benchmarks/kernels.py --output run.json   # also write the results to a file
+
+Kernels run against a scratch copy of a named synthetic dataset (see
+synthetic_data.py), so what they write never reaches the dataset. It is built
+on first use and ends on BENCHMARK_END_DATE, and every date-relative kernel
+is given that date rather than today, so runs on different days measure
+the same work and the dataset is never rebuilt. Each kernel runs
+once to warm up, then --repeat times; its median is compared with the
+baseline recorded for the same dataset in benchmarks/baseline.json. A kernel
+more than --tolerance slower than its baseline (and by at least
+MIN_REGRESSION_MS) is reported as a regression and the exit status is 1.
+Baselines are machine specific: record one before comparing on new hardware.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Kernels are measured on their own, without per-statement tracking
+os.environ.setdefault('SLOW_QUERY_MS', '0')
+
+import numpy as np  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from analysis import DiseaseAnalyzer  # noqa: E402
+from data_ingestion import DataIngestion  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Last test date of the benchmark datasets, and the "today" kernels run as of
+BENCHMARK_END_DATE = synthetic_data.DATASET_END_DATE
+
+# Relative slowdown over the baseline median tolerated before a kernel is flagged
+DEFAULT_TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', 0.25))
+
+# Differences smaller than this are timer noise, whatever their ratio
+MIN_REGRESSION_MS = 1.0
+
+# Positive cases clustered by detect_hotspots, smallest first
+HOTSPOT_SIZES = (250, 1000, 4000, 16000)
+
+DISEASE = 'Malaria'
+
+BULK_RESULTS = 500
+DISTANCE_PAIRS = 100_000
+CONVERT_RECORDS = 5000
+
+
+def time_kernel(fn: Callable, repeat: int) -> Dict:
+    """Median and best wall time of fn over repeat runs, after one warm-up run"""
+    fn()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': round(statistics.median(runs), 3), 'min_ms': round(min(runs), 3), 'runs': repeat}
+
+
+def dataset_path(name: str) -> str:
+    """The named dataset, built on first use"""
+    return synthetic_data.build_benchmark_db(name, end_date=BENCHMARK_END_DATE)
+
+
+def hotspot_windows(db_path: str, sizes) -> Dict[int, tuple]:
+    """For each size, the shortest window ending on the last test date with at least that many located positive cases"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('''
+        SELECT test_date, COUNT(*) FROM test_results t
+        JOIN patients p ON t.patient_id = p.patient_id
+        WHERE t.disease_type = ? AND t.test_result = 'Positive' AND p.latitude IS NOT NULL
+        GROUP BY test_date ORDER BY test_date DESC
+    ''', (DISEASE,)).fetchall()
+    conn.close()
+
+    windows = {}
+    total = 0
+    pending = sorted(sizes)
+    for test_date, count in rows:
+        total += count
+        while pending and total >= pending[0]:
+            windows[pending.pop(0)] = (test_date, rows[0][0], total)
+    return windows
+
+
+def bulk_payload(count: int, seed: int, end_date=BENCHMARK_END_DATE) -> List[Dict]:
+    """Test results with coordinates already known, so ingestion never calls the geocoder"""
+    rng = random.Random(seed)
+    payload = []
+    for i in range(count):
+        city, lat, lon, _ = rng.choice(synthetic_data.CITIES)
+        payload.append({
+            'hospital_id': 1,
+            'disease_type': rng.choice(list(synthetic_data.DISEASES)),
+            'test_result': rng.choice(['Positive', 'Negative']),
+            'test_date': str(end_date - timedelta(days=rng.randint(0, 30))),
+            'severity': rng.choice(synthetic_data.SEVERITIES),
+            'symptoms': 'Fever, headache',
+            'patient_data': {
+                'hospital_id': 1,
+                'external_patient_id': f'BENCH-{seed}-{i:05d}',
+                'age': rng.randint(1, 80),
+                'gender': rng.choice(['Male', 'Female']),
+                'address': f'Area {rng.randint(1, 12)}, {city}',
+                'latitude': round(lat + rng.gauss(0, 0.02), 5),
+                'longitude': round(lon + rng.gauss(0, 0.02), 5),
+                'phone': f'+23480{rng.randint(10000000, 99999999)}'
+            }
+        })
+    return payload
+
+
+def convert_payload(count: int) -> Dict:
+    """An analysis result as the analyzer builds it from pandas: numpy scalars, strings and NaN"""
+    rng = np.random.default_rng(synthetic_data.DEFAULT_SEED)
+    return {
+        'disease_type': DISEASE,
+        'total': np.int64(count),
+        'rate': np.float64(0.42),
+        'daily': list(rng.integers(0, 100, size=365)),
+        'hotspots': [
+            {'location': f'Area {n % 12 + 1}, Abuja', 'latitude': np.float64(lat), 'longitude': np.float64(lon),
+             'case_count': np.int64(n), 'risk_score': np.float32(n / 100), 'severe': np.bool_(n > 150),
+             'trend': np.float64('nan') if n % 7 == 0 else np.float64(n / 200)}
+            for lat, lon, n in zip(rng.normal(9, 2, count), rng.normal(7, 2, count), rng.integers(1, 200, count))
+        ]
+    }
+
+
+def run(dataset: str, repeat: int, only: List[str] = None) -> Dict:
+    # Every kernel runs on a scratch copy: the analyzer writes what it computes
+    # (hotspot_analysis, daily_statistics) and ingestion adds rows, so the
+    # dataset stays as generated and each run starts from the same data
+    scratch = tempfile.mkdtemp(prefix='demicstech_bench_')
+    try:
+        db_path = os.path.join(scratch, f'{dataset}.db')
+        shutil.copyfile(dataset_path(dataset), db_path)
+        kernels = run_kernels(db_path, repeat, only)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        'dataset': dataset,
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'kernels': kernels
+    }
+
+
+def run_kernels(db_path: str, repeat: int, only: List[str] = None, today=BENCHMARK_END_DATE) -> Dict:
+    """Time each kernel on db_path as of today, the dataset's last test date"""
+    analyzer = DiseaseAnalyzer(db_path)
+    kernels = {}
+
+    def bench(name: str, fn: Callable, **details):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            return
+        print(f"  ⏱️ {name}", file=sys.stderr)
+        kernels[name] = {**time_kernel(fn, repeat), **details}
+
+    for size, (start, end, cases) in hotspot_windows(db_path, HOTSPOT_SIZES).items():
+        bench(f'detect_hotspots[n={size}]',
+              lambda start=start, end=end: analyzer.detect_hotspots(DISEASE, start, end), cases=cases)
+
+    bench('generate_daily_statistics', lambda: analyzer.generate_daily_statistics(DISEASE, str(today)))
+
+    last_month = today.replace(day=1) - timedelta(days=1)
+    bench('generate_monthly_statistics',
+          lambda: analyzer.generate_monthly_statistics(DISEASE, last_month.month, last_month.year))
+
+    bench('detect_outbreak', lambda: analyzer.detect_outbreak(DISEASE, analysis_date=str(today)))
+
+    if not only or any('bulk_add_test_results'.startswith(prefix) for prefix in only):
+        ingestion = DataIngestion(db_path)
+        # New patients every run, built before timing starts
+        batches = iter([bulk_payload(BULK_RESULTS, seed, today) for seed in range(repeat + 1)])
+        bench('bulk_add_test_results', lambda: ingestion.bulk_add_test_results(next(batches)),
+              results=BULK_RESULTS)
+
+    payload = convert_payload(CONVERT_RECORDS)
+    bench('_convert_to_native_types', lambda: analyzer._convert_to_native_types(payload),
+          records=CONVERT_RECORDS)
+
+    rng = random.Random(synthetic_data.DEFAULT_SEED)
+    pairs = [(rng.uniform(4, 14), rng.uniform(3, 14), rng.uniform(4, 14), rng.uniform(3, 14))
+             for _ in range(DISTANCE_PAIRS)]
+    distance = analyzer.calculate_distance
+    bench('calculate_distance', lambda: [distance(*pair) for pair in pairs], calls=DISTANCE_PAIRS)
+
+    return kernels
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_baseline(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict):
+    """Store results as the baseline of their dataset, keeping kernels not run this time"""
+    baseline = load_baseline(path)
+    previous = baseline.get(results['dataset'], {}).get('kernels', {})
+    baseline[results['dataset']] = {**results, 'kernels': {**previous, **results['kernels']}}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Every kernel with a baseline, its change in median, and whether that is a regression"""
+    recorded = baseline.get(results['dataset'], {}).get('kernels', {})
+    comparisons = []
+    for name, current in results['kernels'].items():
+        if name not in recorded:
+            continue
+        before, now = recorded[name]['median_ms'], current['median_ms']
+        change = (now - before) / before if before else 0.0
+        comparisons.append({
+            'kernel': name,
+            'baseline_ms': before,
+            'median_ms': now,
+            'change': round(change, 3),
+            'regression': change > tolerance and now - before >= MIN_REGRESSION_MS
+        })
+    return comparisons
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dataset', default='small', choices=sorted(synthetic_data.DATASETS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', help='run kernels whose name starts with this (repeatable)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown over the baseline median, e.g. 0.25 for 25%%')
+    parser.add_argument('--save-baseline', action='store_true', help='record these results as the baseline')
+    parser.add_argument('--output', help='also write the results and comparison to this JSON file')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.dataset, args.repeat, args.only)
+    comparisons = compare(results, load_baseline(args.baseline), args.tolerance)
+    regressions = [c for c in comparisons if c['regression']]
+    report = {**results, 'tolerance': args.tolerance, 'comparison': comparisons}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        changes = {c['kernel']: c for c in comparisons}
+        print(f"⏱️ Kernels on the {args.dataset} dataset, median of {args.repeat} runs")
+        for name, timing in results['kernels'].items():
+            line = f"  {name:<30} {timing['median_ms']:10.2f} ms (best {timing['min_ms']:.2f})"
+            if name in changes:
+                c = changes[name]
+                line += f"   {c['change']:+7.1%} vs {c['baseline_ms']:.2f} ms" + ('  ❌ REGRESSION' if c['regression'] else '')
+            print(line)
+        if args.save_baseline:
+            print(f"💾 Baseline for {args.dataset} saved to {args.baseline}")
+        elif not comparisons:
+            print(f"ℹ️ No baseline for {args.dataset} in {args.baseline}; run with --save-baseline to record one")
+        elif regressions:
+            print(f"❌ {len(regressions)} kernel(s) slower than baseline by more than {args.tolerance:.0%}")
+        else:
+            print(f"✅ No kernel slower than baseline by more than {args.tolerance:.0%}")
+
+    sys.exit(1 if regressions and not args.save_baseline else 0)
@@ -0,0 +1,100 @@
+"""
+Cold start harness: how long a fresh API process takes to answer /health
+
+    python benchmarks/startup.py [--runs 5] [--db demicstech.db]
+
+For each import mode (LAZY_IMPORTS=true/false) it starts `python api.py` on a
+free port, polls /health until it answers and records the elapsed wall time,
+along with the time `import api` alone takes in a fresh interpreter.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import api; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_import(env: dict) -> float:
+    """Seconds spent importing api in a fresh interpreter"""
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def time_first_health(env: dict, timeout: float = 60.0) -> float:
+    """Seconds from launching the server process to its first /health response"""
+    port = free_port()
+    env = {**env, 'PORT': str(port)}
+    url = f'http://127.0.0.1:{port}/health'
+
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, 'api.py'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError('API server exited before answering /health')
+                time.sleep(0.005)
+        raise RuntimeError(f'/health did not answer within {timeout}s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(runs: int, db_path: str) -> dict:
+    results = {}
+    for lazy in ('true', 'false'):
+        env = {**os.environ, 'LAZY_IMPORTS': lazy, 'DATABASE_PATH': db_path,
+               'PRECOMPUTE_IN_PROCESS': 'false'}
+        imports = [time_import(env) for _ in range(runs)]
+        health = [time_first_health(env) for _ in range(runs)]
+        results['lazy' if lazy == 'true' else 'eager'] = {
+            'import_median_s': round(statistics.median(imports), 4),
+            'first_health_median_s': round(statistics.median(health), 4),
+            'first_health_min_s': round(min(health), 4)
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'demicstech.db'))
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(os.path.join(ROOT, args.db))
+    results = measure(args.runs, db_path)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"⏱️ Cold start over {args.runs} runs ({db_path})")
+        for mode, timings in results.items():
+            print(f"  {mode:<6} import api {timings['import_median_s'] * 1000:7.1f} ms   "
+                  f"first /health {timings['first_health_median_s'] * 1000:7.1f} ms "
+                  f"(best {timings['first_health_min_s'] * 1000:.1f} ms)")
+        speedup = results['eager']['first_health_median_s'] / results['lazy']['first_health_median_s']
+        print(f"  lazy mode answers /health {speedup:.1f}x sooner")
@@ -0,0 +1,260 @@
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from lazy import lazy_import
+from lookups import PATIENTS_TABLE
+
+np = lazy_import('numpy')
+
+# Days of recent cases held in memory
+CASE_STORE_DAYS = int(os.environ.get('CASE_STORE_DAYS', 90))
+
+# test_results.test_result values; anything else is stored as OTHER
+NEGATIVE, POSITIVE, OTHER = 0, 1, 2
+RESULT_CODES = {'Negative': NEGATIVE, 'Positive': POSITIVE}
+
+
+def _ordinal(value) -> int:
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').date()
+    return value.toordinal()
+
+
+class _DiseaseColumns:
+    """One disease's recent cases as parallel arrays; replaced, never mutated"""
+
+    FIELDS = ('result_id', 'day', 'result', 'has_patient', 'patient_id', 'latitude', 'longitude', 'address',
+              'hospital_id')
+
+    def __init__(self, result_id, day, result, has_patient, patient_id, latitude, longitude, address, hospital_id):
+        self.result_id = result_id
+        self.day = day
+        self.result = result
+        self.has_patient = has_patient
+        self.patient_id = patient_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.address = address
+        self.hospital_id = hospital_id
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.int8), np.empty(0, bool),
+                   np.empty(0, np.int64), np.empty(0), np.empty(0), np.empty(0, np.int32), np.empty(0, np.int64))
+
+    def extend(self, other: '_DiseaseColumns') -> '_DiseaseColumns':
+        return _DiseaseColumns(*(np.concatenate([getattr(self, name), getattr(other, name)])
+                                 for name in self.FIELDS))
+
+    def take(self, mask) -> '_DiseaseColumns':
+        return _DiseaseColumns(*(getattr(self, name)[mask] for name in self.FIELDS))
+
+    def with_patients(self, patient_ids, latitude, longitude, address) -> '_DiseaseColumns':
+        """Copy with the location fields of the given (sorted) patient_ids replaced"""
+        rows = np.flatnonzero(np.isin(self.patient_id, patient_ids))
+        if not len(rows):
+            return self
+        index = np.searchsorted(patient_ids, self.patient_id[rows])
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        for name, values in (('latitude', latitude), ('longitude', longitude), ('address', address)):
+            fields[name] = fields[name].copy()
+            fields[name][rows] = values[index]
+        return _DiseaseColumns(**fields)
+
+    def __len__(self):
+        return len(self.result_id)
+
+
+class CaseStore:
+    """
+    Recent test results held in memory as NumPy columns, one set per disease
+    Refreshed incrementally: each read first loads only rows with a result_id
+    above the highest one already held, and drops rows that have aged out of
+    the window. test_results is append-only, but patients are updated when
+    resubmitted, so the location fields of patients whose updated_seq is
+    above the highest one seen are re-read as well.
+    Analyses whose date range falls inside the window run as vector
+    operations on these columns instead of SQL queries.
+    """
+
+    def __init__(self, db_path='demicstech.db', days: int = CASE_STORE_DAYS):
+        self.db_path = db_path
+        self.days = days
+        self.max_result_id = 0
+        self.max_patient_seq = 0
+        self.window_start = None
+        self._columns = {}
+        self._addresses = []
+        self._address_codes = {}
+        self._hospital_names = {}
+        self._lock = threading.Lock()
+
+    def covers(self, start_date) -> bool:
+        """True if every case dated start_date or later is held in memory"""
+        self.refresh()
+        return _ordinal(start_date) >= self.window_start
+
+    def refresh(self) -> int:
+        """Load new rows and age out old ones; returns how many rows were added"""
+        with self._lock:
+            window_start = date.today().toordinal() - self.days + 1
+            conn = sqlite3.connect(self.db_path)
+            try:
+                max_id = conn.execute('SELECT MAX(result_id) FROM test_results').fetchone()[0] or 0
+                max_seq = conn.execute(f'SELECT MAX(updated_seq) FROM {PATIENTS_TABLE}').fetchone()[0] or 0
+                if (max_id == self.max_result_id and max_seq == self.max_patient_seq
+                        and window_start == self.window_start):
+                    return 0
+                rows = conn.execute('''
+                SELECT tr.result_id, tr.disease_type, tr.test_date, tr.test_result,
+                       p.patient_id IS NOT NULL, p.patient_id, p.latitude, p.longitude, p.address, tr.hospital_id
+                FROM test_results tr
+                LEFT JOIN patients p ON tr.patient_id = p.patient_id
+                WHERE tr.result_id > ? AND tr.result_id <= ?
+                AND tr.test_date >= ?
+                ''', (self.max_result_id, max_id, str(date.fromordinal(window_start)))).fetchall()
+                if rows:
+                    self._hospital_names = dict(conn.execute(
+                        'SELECT hospital_id, hospital_name FROM hospitals').fetchall())
+                updated = []
+                if max_seq > self.max_patient_seq and self._columns:
+                    updated = conn.execute(f'''
+                    SELECT patient_id, latitude, longitude, address FROM patients
+                    WHERE patient_id IN (SELECT patient_id FROM {PATIENTS_TABLE} WHERE updated_seq > ?)
+                    ORDER BY patient_id
+                    ''', (self.max_patient_seq,)).fetchall()
+            finally:
+                conn.close()
+
+            columns = dict(self._columns)
+            if updated:
+                # Rows already held carry the patients' old location
+                patient_ids, lat, lon, address = zip(*updated)
+                patient_ids = np.array(patient_ids, np.int64)
+                lat = np.array([np.nan if v is None else v for v in lat], np.float64)
+                lon = np.array([np.nan if v is None else v for v in lon], np.float64)
+                address = np.array([self._address_code(v) for v in address], np.int32)
+                columns = {disease_type: c.with_patients(patient_ids, lat, lon, address)
+                           for disease_type, c in columns.items()}
+            for disease_type, new in self._build(rows).items():
+                columns[disease_type] = columns.get(disease_type, _DiseaseColumns.empty()).extend(new)
+            if window_start != self.window_start:
+                columns = {disease_type: c.take(c.day >= window_start) for disease_type, c in columns.items()}
+
+            self._columns = columns
+            self.max_result_id = max_id
+            self.max_patient_seq = max_seq
+            self.window_start = window_start
+            return len(rows)
+
+    def _address_code(self, address: Optional[str]) -> int:
+        if address is None:
+            return -1
+        code = self._address_codes.get(address)
+        if code is None:
+            code = self._address_codes[address] = len(self._addresses)
+            self._addresses.append(address)
+        return code
+
+    def _build(self, rows) -> Dict[str, _DiseaseColumns]:
+        grouped = {}
+        for (result_id, disease_type, test_date, test_result, has_patient, patient_id,
+             lat, lon, address, hospital_id) in rows:
+            try:
+                day = _ordinal(test_date)
+            except (TypeError, ValueError):
+                continue
+            grouped.setdefault(disease_type, []).append((
+                result_id, day, RESULT_CODES.get(test_result, OTHER), has_patient,
+                -1 if patient_id is None else patient_id, np.nan if lat is None else lat, np.nan if lon is None else lon,
+                self._address_code(address), -1 if hospital_id is None else hospital_id
+            ))
+
+        built = {}
+        for disease_type, values in grouped.items():
+            result_id, day, result, has_patient, patient_id, lat, lon, address, hospital_id = zip(*values)
+            built[disease_type] = _DiseaseColumns(
+                np.array(result_id, np.int64), np.array(day, np.int32), np.array(result, np.int8),
+                np.array(has_patient, bool), np.array(patient_id, np.int64),
+                np.array(lat, np.float64), np.array(lon, np.float64),
+                np.array(address, np.int32), np.array(hospital_id, np.int64)
+            )
+        return built
+
+    def cases(self, disease_type: str, start_date, end_date) -> _DiseaseColumns:
+        """Cases of one disease dated start_date to end_date inclusive"""
+        columns = self._columns.get(disease_type) or _DiseaseColumns.empty()
+        return columns.take((columns.day >= _ordinal(start_date)) & (columns.day <= _ordinal(end_date)))
+
+    def address(self, code: int) -> Optional[str]:
+        return self._addresses[code] if code >= 0 else None
+
+    def daily_statistics(self, disease_type: str, day) -> Dict:
+        """Same figures as the daily statistics SQL, for one day"""
+        cases = self.cases(disease_type, day, day)
+        cases = cases.take(cases.has_patient)
+        total = len(cases)
+
+        located = ~(np.isnan(cases.latitude) | np.isnan(cases.longitude))
+        unique_locations = len(np.unique(np.column_stack([cases.latitude, cases.longitude])[located], axis=0))
+
+        codes, inverse = np.unique(cases.address, return_inverse=True)
+        case_counts = np.bincount(inverse, minlength=len(codes))
+        positive_counts = np.bincount(inverse, weights=cases.result == POSITIVE, minlength=len(codes))
+        order = np.argsort(-positive_counts, kind='stable')
+
+        return {
+            # SUM over no rows is NULL in SQL
+            'total_tests': total,
+            'positive_cases': int((cases.result == POSITIVE).sum()) if total else None,
+            'negative_cases': int((cases.result == NEGATIVE).sum()) if total else None,
+            'unique_locations': unique_locations,
+            'locations': [
+                {'address': self.address(int(codes[i])), 'case_count': int(case_counts[i]),
+                 'positive_count': int(positive_counts[i])}
+                for i in order
+            ]
+        }
+
+    def daily_breakdown(self, disease_type: str, start_date, end_date) -> List[Dict]:
+        """Tests, positives and negatives per test date, in date order"""
+        cases = self.cases(disease_type, start_date, end_date)
+        days, inverse = np.unique(cases.day, return_inverse=True)
+        totals = np.bincount(inverse, minlength=len(days))
+        positives = np.bincount(inverse, weights=cases.result == POSITIVE, minlength=len(days))
+        negatives = np.bincount(inverse, weights=cases.result == NEGATIVE, minlength=len(days))
+        return [
+            {'test_date': str(date.fromordinal(int(day))), 'total_tests': int(totals[i]),
+             'positive_cases': int(positives[i]), 'negative_cases': int(negatives[i])}
+            for i, day in enumerate(days)
+        ]
+
+    def count_positive(self, disease_type: str, start_date, end_date) -> int:
+        return int((self.cases(disease_type, start_date, end_date).result == POSITIVE).sum())
+
+    def positive_cases(self, disease_type: str, start_date, end_date, bbox: tuple = None) -> List[Dict]:
+        """Positive, geocoded cases at known hospitals, ordered by test date then result_id"""
+        cases = self.cases(disease_type, start_date, end_date)
+        mask = ((cases.result == POSITIVE) & ~np.isnan(cases.latitude) & ~np.isnan(cases.longitude)
+                & np.isin(cases.hospital_id, list(self._hospital_names)))
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            mask &= ((cases.latitude >= min_lat) & (cases.latitude <= max_lat)
+                     & (cases.longitude >= min_lon) & (cases.longitude <= max_lon))
+        cases = cases.take(mask)
+        cases = cases.take(np.lexsort((cases.result_id, cases.day)))
+
+        return [
+            {
+                'result_id': int(cases.result_id[i]),
+                'test_date': str(date.fromordinal(int(cases.day[i]))),
+                'address': self.address(int(cases.address[i])),
+                'latitude': float(cases.latitude[i]),
+                'longitude': float(cases.longitude[i]),
+                'hospital_name': self._hospital_names[int(cases.hospital_id[i])]
+            }
+            for i in range(len(cases))
+        ]
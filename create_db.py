@@ -2,19 +2,15 @@ import sqlite3
 from datetime import datetime
 import os
 
-def create_database(db_path='demicstech.db'):
-    """Create the DemicsTech surveillance database with all necessary tables"""
-    
-    # Create directory if it doesn't exist
-    db_dir = os.path.dirname(db_path)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir)
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    print("🔧 Creating database tables...")
-    
+from geo import encode as encode_geohash
+from aggregates import create_cell_count_table, create_cube_table, rebuild_cell_counts, rebuild_cube
+from archive import add_legacy_archive_codes, encode_pending_archives, pending_encoding_marker
+from lookups import (
+    CODED_INDEXES, CODED_TABLES, COMPATIBILITY_VIEWS, LOOKUPS, PATIENTS_TABLE, TEST_RESULTS_TABLE
+)
+
+def _create_case_tables(cursor):
+    """Hospitals, patients and test results, the tables every database and shard holds"""
     # Hospitals/Data Sources Table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS hospitals (
@@ -66,6 +62,43 @@ def create_database(db_path='demicstech.db'):
     )
     ''')
     
+    if cursor.execute('PRAGMA user_version').fetchone()[0] == 0:
+        # Later schema versions replace these tables with views, which cannot be indexed
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_date ON test_results(test_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_disease_type ON test_results(disease_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patient_hospital ON patients(hospital_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_result ON test_results(test_result)')
+
+
+def create_shard_database(db_path):
+    """
+    Create a zone shard (see sharding.py): the case tables at the current
+    schema, without the main database's analysis, job and archive tables
+    or its default hospital
+    """
+    conn = sqlite3.connect(db_path)
+    _create_case_tables(conn.cursor())
+    conn.commit()
+    apply_migrations(conn, shard=True)
+    conn.close()
+    print(f"✅ Shard created: {db_path}")
+
+
+def create_database(db_path='demicstech.db'):
+    """Create the DemicsTech surveillance database with all necessary tables"""
+    
+    # Create directory if it doesn't exist
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    print("🔧 Creating database tables...")
+    
+    _create_case_tables(cursor)
+    
     # Hotspot Analysis Table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS hotspot_analysis (
@@ -116,14 +149,13 @@ def create_database(db_path='demicstech.db'):
     ''')
     
     # Create indexes for better query performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_date ON test_results(test_date)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_disease_type ON test_results(disease_type)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_patient_hospital ON patients(hospital_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_date ON outbreak_alerts(alert_date)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_result ON test_results(test_result)')
     
     conn.commit()
     
+    # Bring the new schema up to the current version
+    apply_migrations(conn)
+    
     # Check if we need to add sample hospital
     cursor.execute('SELECT COUNT(*) as count FROM hospitals')
     hospital_count = cursor.fetchone()[0]
@@ -150,6 +182,265 @@ def create_database(db_path='demicstech.db'):
     
     return True
 
+def _add_case_query_index(cursor):
+    """Index backing date-range and keyset-paginated case queries"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_disease_date ON test_results(disease_type, test_date)')
+
+
+def _add_patient_geohash(cursor):
+    """Store a geohash per geocoded patient so spatial filters can use an index"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(patients)')]
+    if 'geohash' not in columns:
+        cursor.execute('ALTER TABLE patients ADD COLUMN geohash TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_patient_geohash ON patients(geohash)')
+    
+    # Backfill patients geocoded before the column existed
+    cursor.execute('''
+    SELECT patient_id, latitude, longitude FROM patients
+    WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    updates = [(encode_geohash(lat, lon), patient_id) for patient_id, lat, lon in cursor.fetchall()]
+    cursor.executemany('UPDATE patients SET geohash = ? WHERE patient_id = ?', updates)
+
+
+def _add_cell_counts(cursor):
+    """Per-day, per-cell case counts used for map heatmaps"""
+    create_cell_count_table(cursor)
+    rebuild_cell_counts(cursor)
+
+
+def _add_surveillance_cube(cursor):
+    """Case counts by disease, day, cell, hospital, age band, gender and result"""
+    create_cube_table(cursor)
+    rebuild_cube(cursor)
+
+
+def _add_precomputed_results(cursor):
+    """Timestamped analysis results written by the precompute scheduler"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS precomputed_results (
+        result_key TEXT PRIMARY KEY,
+        analysis TEXT NOT NULL,
+        disease_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        computed_at REAL NOT NULL
+    )
+    ''')
+
+
+def _add_analysis_jobs(cursor):
+    """Background analysis jobs submitted through the job API"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        job_id TEXT PRIMARY KEY,
+        job_key TEXT NOT NULL,
+        analysis TEXT NOT NULL,
+        request_data TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        expires_at REAL
+    )
+    ''')
+    # At most one in-flight job per distinct request, across all web workers
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_inflight ON analysis_jobs(job_key)
+    WHERE status IN ('queued', 'running')
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_key ON analysis_jobs(job_key, status)')
+
+
+def _add_archive_partitions(cursor):
+    """Catalog of yearly archive files holding test results moved out of this database"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_partitions (
+        period TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        min_date DATE NOT NULL,
+        max_date DATE NOT NULL,
+        row_count INTEGER NOT NULL
+    )
+    ''')
+
+
+def _add_hospital_shards(cursor):
+    """Zone shard each hospital's patients and results are written to (NULL: this database)"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(hospitals)')]
+    if 'shard' not in columns:
+        cursor.execute('ALTER TABLE hospitals ADD COLUMN shard TEXT')
+
+
+def _encode_categorical_columns(cursor):
+    """
+    Store disease, result and severity as ids into lookup tables, and patient
+    addresses as ids into a locations table, behind test_results and patients
+    views that keep the original columns
+    """
+    if cursor.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (TEST_RESULTS_TABLE,)).fetchone():
+        return
+    for statement in CODED_TABLES:
+        cursor.execute(statement)
+
+    for column, (table, _) in LOOKUPS.items():
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO {table} (name)
+        SELECT DISTINCT {column} FROM test_results WHERE {column} IS NOT NULL ORDER BY {column}
+        ''')
+    cursor.execute('''
+    INSERT OR IGNORE INTO locations (address)
+    SELECT trim(address) FROM patients WHERE address IS NOT NULL ORDER BY patient_id
+    ''')
+
+    cursor.execute(f'''
+    INSERT INTO {PATIENTS_TABLE}
+        (patient_id, hospital_id, external_patient_id, age, gender, location_id,
+         latitude, longitude, phone, created_at, geohash)
+    SELECT p.patient_id, p.hospital_id, p.external_patient_id, p.age, p.gender, l.location_id,
+           p.latitude, p.longitude, p.phone, p.created_at, p.geohash
+    FROM patients p
+    LEFT JOIN locations l ON l.address = trim(p.address)
+    ''')
+    cursor.execute(f'''
+    INSERT INTO {TEST_RESULTS_TABLE}
+        (result_id, patient_id, hospital_id, disease_id, outcome_id, test_date, severity_id,
+         symptoms, notes, created_at)
+    SELECT t.result_id, t.patient_id, t.hospital_id, d.disease_id, o.outcome_id, t.test_date,
+           s.severity_id, t.symptoms, t.notes, t.created_at
+    FROM test_results t
+    JOIN diseases d ON d.name = t.disease_type
+    JOIN test_outcomes o ON o.name = t.test_result
+    LEFT JOIN severities s ON s.name = t.severity
+    ''')
+
+    # Carry AUTOINCREMENT counters over, including ids of rows already archived
+    for old, new in (('patients', PATIENTS_TABLE), ('test_results', TEST_RESULTS_TABLE)):
+        previous = cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (old,)).fetchone()
+        if previous is None:
+            continue
+        if cursor.execute('SELECT 1 FROM sqlite_sequence WHERE name = ?', (new,)).fetchone():
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (previous[0], new))
+        else:
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (new, previous[0]))
+
+    cursor.execute('DROP TABLE test_results')
+    cursor.execute('DROP TABLE patients')
+    for statement in CODED_INDEXES + COMPATIBILITY_VIEWS:
+        cursor.execute(statement)
+
+    # Archived years get the same encoding so they can still be read alongside.
+    # Their lookup values are added in this transaction, but the files are only
+    # rewritten once it has committed: a failed migration must leave them as they were.
+    db_file = cursor.execute('PRAGMA database_list').fetchone()[2]
+    paths = []
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'archive_partitions'").fetchone():
+        # Shards have no archives
+        paths = [os.path.join(os.path.dirname(db_file), path)
+                 for (path,) in cursor.execute('SELECT path FROM archive_partitions').fetchall()]
+    for path in paths:
+        add_legacy_archive_codes(path, cursor)
+    if paths:
+        # Until removed, ensure_database finishes encoding after a crash
+        open(pending_encoding_marker(db_file), 'w').close()
+        return [lambda: encode_pending_archives(db_file)]
+
+
+def _track_patient_updates(cursor):
+    """
+    Number patient location changes in updated_seq, so in-memory copies of
+    patient fields (case_store) can find the patients changed since they loaded
+    """
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({PATIENTS_TABLE})')]
+    if 'updated_seq' not in columns:
+        cursor.execute(f'ALTER TABLE {PATIENTS_TABLE} ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_patient_updated ON {PATIENTS_TABLE}(updated_seq)')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS patients_location_updated
+    AFTER UPDATE OF location_id, latitude, longitude ON {PATIENTS_TABLE}
+    WHEN OLD.location_id IS NOT NEW.location_id OR OLD.latitude IS NOT NEW.latitude
+      OR OLD.longitude IS NOT NEW.longitude
+    BEGIN
+        UPDATE {PATIENTS_TABLE} SET updated_seq = (SELECT MAX(updated_seq) FROM {PATIENTS_TABLE}) + 1
+        WHERE patient_id = NEW.patient_id;
+    END
+    ''')
+
+
+def _add_job_owner(cursor):
+    """Record which process runs each job, so jobs it took down with it can be failed"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(analysis_jobs)')]
+    if 'owner_pid' not in columns:
+        cursor.execute('ALTER TABLE analysis_jobs ADD COLUMN owner_pid INTEGER')
+
+
+# Schema upgrades in the order they were introduced. PRAGMA user_version
+# records how many of them have been applied to a database file.
+MIGRATIONS = [
+    _add_case_query_index,
+    _add_patient_geohash,
+    _add_cell_counts,
+    _add_surveillance_cube,
+    _add_precomputed_results,
+    _add_analysis_jobs,
+    _add_archive_partitions,
+    _add_hospital_shards,
+    _encode_categorical_columns,
+    _track_patient_updates,
+    _add_job_owner,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Migrations for tables only the main database has; shards skip them
+MAIN_ONLY_MIGRATIONS = {_add_precomputed_results, _add_analysis_jobs, _add_archive_partitions, _add_job_owner}
+
+
+def apply_migrations(conn, shard: bool = False):
+    """
+    Apply any migrations the connected database (or shard) has not seen yet
+    A migration may return steps to run once its changes are committed,
+    for files outside this database.
+    """
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    
+    # Explicit, because sqlite3 would otherwise commit each CREATE/ALTER/DROP on
+    # its own and a failed migration would leave part of its schema behind
+    if not conn.in_transaction:
+        cursor.execute('BEGIN')
+    after_commit = []
+    try:
+        for migration in MIGRATIONS[version:]:
+            if shard and migration in MAIN_ONLY_MIGRATIONS:
+                continue
+            after_commit.extend(migration(cursor) or [])
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    for step in after_commit:
+        step()
+    return version
+
+
+def migrate_database(db_path='demicstech.db', shard: bool = False):
+    """Upgrade an existing database to the current schema version"""
+    conn = sqlite3.connect(db_path)
+    previous = apply_migrations(conn, shard)
+    conn.close()
+    
+    if previous < SCHEMA_VERSION:
+        print(f"🔧 Database migrated from schema v{previous} to v{SCHEMA_VERSION}")
+    return previous
+
+
 def view_database_stats(db_path='demicstech.db'):
     """View current database statistics"""
     if not os.path.exists(db_path):
@@ -189,6 +480,56 @@ def check_database_exists(db_path='demicstech.db'):
     except Exception:
         return False
 
+def use_wal(db_path: str):
+    """
+    Put the database in WAL mode (a setting stored in the file). Readers,
+    such as a read replica's backup copy, then read a snapshot without
+    blocking ingest commits, and commits never wait for them.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError as e:
+        # Another process holds it open mid-transaction; it is retried next start
+        print(f"⚠️  Could not switch {db_path} to WAL mode: {e}")
+    finally:
+        conn.close()
+
+
+def ensure_database(db_path='demicstech.db', shard: bool = False) -> bool:
+    """
+    Create or upgrade the database only if needed, and make sure it is in
+    WAL mode. A database already at SCHEMA_VERSION costs a couple of PRAGMAs,
+    so this is cheap to run on every start. shard=True creates or upgrades a
+    zone shard instead.
+    Returns True if the database was created or migrated.
+    """
+    changed = _ensure_schema(db_path, shard)
+    use_wal(db_path)
+    return changed
+
+
+def _ensure_schema(db_path: str, shard: bool) -> bool:
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        if version == SCHEMA_VERSION:
+            if os.path.exists(pending_encoding_marker(db_path)):
+                # Interrupted after the encoding migration committed
+                encode_pending_archives(db_path)
+                return True
+            return False
+
+    if check_database_exists(db_path):
+        migrate_database(db_path, shard)
+    elif shard:
+        create_shard_database(db_path)
+    else:
+        print("📦 Database not found. Creating new database...")
+        create_database(db_path)
+    return True
+
 if __name__ == "__main__":
     create_database()
     view_database_stats()
\ No newline at end of file
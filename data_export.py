@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import struct
+import zipfile
+import zlib
+from array import array
+from datetime import date
+from typing import Dict, Iterable, Iterator, List
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Rows are buffered into chunks of roughly this many bytes before being
+# handed to the web server, so each write is large enough to be efficient
+CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'npz': 'application/octet-stream'
+}
+
+# Case fields written by the columnar export, in query order. Numeric
+# columns get a fixed dtype; categorical ones are dictionary-encoded.
+COLUMNAR_NUMERIC = {
+    'result_id': 'q',
+    'hospital_id': 'i',
+    'age': 'h',
+    'latitude': 'd',
+    'longitude': 'd'
+}
+COLUMNAR_CATEGORICAL = ['disease_type', 'test_result', 'severity', 'gender']
+COLUMNAR_FIELDS = ['test_date'] + list(COLUMNAR_NUMERIC) + COLUMNAR_CATEGORICAL
+
+# Sentinels for missing values in integer columns (floats use NaN)
+MISSING_INT = -1
+EPOCH = date(1970, 1, 1)
+
+
+def stream_csv(rows: Iterable[tuple], fields: List[str]) -> Iterator[str]:
+    """Encode rows as CSV text, yielding one chunk at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows: Iterable[tuple], fields: List[str]) -> Iterator[str]:
+    """Encode rows as newline-delimited JSON objects, yielding one chunk at a time"""
+    lines = []
+    size = 0
+
+    for row in rows:
+        line = json.dumps(dict(zip(fields, row)), default=str)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+            size = 0
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def gzip_stream(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """Gzip-compress a stream of text chunks on the fly"""
+    # wbits=31 selects the gzip container rather than raw zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def export_stream(rows: Iterable[tuple], fields: List[str], export_format: str,
+                  compress: bool = False) -> Iterator:
+    """Build the byte/text stream for an export in the requested format"""
+    if export_format == 'csv':
+        chunks = stream_csv(rows, fields)
+    elif export_format == 'ndjson':
+        chunks = stream_ndjson(rows, fields)
+    else:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    return gzip_stream(chunks) if compress else chunks
+
+
+def build_case_columns(rows: Iterable[tuple]) -> Dict[str, np.ndarray]:
+    """
+    Turn rows of COLUMNAR_FIELDS (sorted by test_date) into typed column arrays
+    Dates become int32 day numbers since 1970-01-01, categorical columns become
+    int16 codes into a matching '<name>_categories' array, and a date index
+    plus per-day, per-disease counts are added alongside
+    """
+    numeric = {name: array(code) for name, code in COLUMNAR_NUMERIC.items()}
+    codes = {name: array('h') for name in COLUMNAR_CATEGORICAL}
+    categories = {name: {} for name in COLUMNAR_CATEGORICAL}
+    days = array('i')
+    day_numbers = {}
+    nan = float('nan')
+
+    for row in rows:
+        values = dict(zip(COLUMNAR_FIELDS, row))
+
+        test_date = values['test_date']
+        day = day_numbers.get(test_date)
+        if day is None:
+            day = (date.fromisoformat(test_date) - EPOCH).days
+            day_numbers[test_date] = day
+        days.append(day)
+
+        for name, column in numeric.items():
+            value = values[name]
+            if value is None:
+                value = nan if column.typecode == 'd' else MISSING_INT
+            column.append(value)
+
+        for name in COLUMNAR_CATEGORICAL:
+            value = values[name]
+            if value is None:
+                codes[name].append(MISSING_INT)
+            else:
+                codes[name].append(categories[name].setdefault(value, len(categories[name])))
+
+    columns = {'test_date': np.frombuffer(days, dtype=np.int32)}
+    for name, column in numeric.items():
+        columns[name] = np.frombuffer(column, dtype=np.dtype(column.typecode))
+    for name in COLUMNAR_CATEGORICAL:
+        columns[name] = np.frombuffer(codes[name], dtype=np.int16)
+        columns[f'{name}_categories'] = np.array(list(categories[name]), dtype=str)
+
+    # Rows arrive in date order, so each day is one contiguous slice
+    index_days, index_offsets, index_counts = np.unique(
+        columns['test_date'], return_index=True, return_counts=True
+    )
+    columns['date_index_days'] = index_days.astype(np.int32)
+    columns['date_index_offsets'] = index_offsets.astype(np.int64)
+    columns['date_index_counts'] = index_counts.astype(np.int64)
+
+    # Daily aggregates: one row per indexed day, one column per disease
+    day_slot = np.repeat(np.arange(len(index_days)), index_counts)
+    disease_codes = columns['disease_type']
+    n_diseases = len(categories['disease_type'])
+    positive_code = categories['test_result'].get('Positive', -2)
+    columns['daily_total'] = np.zeros((len(index_days), n_diseases), dtype=np.int32)
+    columns['daily_positive'] = np.zeros((len(index_days), n_diseases), dtype=np.int32)
+    np.add.at(columns['daily_total'], (day_slot, disease_codes), 1)
+    positive = columns['test_result'] == positive_code
+    np.add.at(columns['daily_positive'], (day_slot[positive], disease_codes[positive]), 1)
+
+    return columns
+
+
+def write_case_columns(columns: Dict[str, np.ndarray], fileobj):
+    """Write column arrays as an uncompressed .npz so members can be memory-mapped"""
+    np.savez(fileobj, **columns)
+
+
+def load_case_columns(path: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Load a columnar export written by write_case_columns
+    With mmap=True each array is mapped straight from the file instead of
+    being read into memory, so opening a large extract is nearly free
+    """
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as raw:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    columns[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # Skip the zip local file header to reach the .npy payload
+            raw.seek(info.header_offset)
+            header = raw.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            raw.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(raw)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+
+            if 0 in shape:
+                columns[name] = np.empty(shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=raw.tell(),
+                                          shape=shape, order='F' if fortran_order else 'C')
+    return columns
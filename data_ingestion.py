@@ -1,33 +1,155 @@
 import sqlite3
 from datetime import datetime, date
 from typing import Dict, List, Optional
+import base64
 import json
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+import os
+import time
+
+from geo import bbox_conditions, encode as encode_geohash
+from aggregates import move_patient_cases, record_case
+from archive import ArchiveRouter
+from sharding import shard_router
+from lookups import PATIENTS_TABLE, TEST_RESULTS_TABLE, LookupCodes
+from timing import open_connection, timed
+from metrics import GEOCODER_CALLS, INGESTED_ROWS, SQLITE_BUSY, SQLITE_RETRIES
+
+# Columns that can be requested from query_cases, keyed by output name
+CASE_FIELDS = {
+    'result_id': 'tr.result_id',
+    'disease_type': 'tr.disease_type',
+    'test_result': 'tr.test_result',
+    'test_date': 'tr.test_date',
+    'severity': 'tr.severity',
+    'hospital_id': 'tr.hospital_id',
+    'hospital_name': 'h.hospital_name',
+    'age': 'p.age',
+    'gender': 'p.gender',
+    'address': 'p.address',
+    'latitude': 'p.latitude',
+    'longitude': 'p.longitude'
+}
+
+DEFAULT_CASE_FIELDS = [
+    'result_id', 'disease_type', 'test_result', 'test_date', 'severity',
+    'age', 'gender', 'address', 'latitude', 'longitude', 'hospital_name'
+]
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Times a test result is retried when the database stays locked past sqlite's own timeout
+WRITE_RETRIES = int(os.environ.get('WRITE_RETRIES', 3))
+WRITE_RETRY_DELAY = 0.1
+
+
+def validate_case_fields(fields: Optional[List[str]]) -> List[str]:
+    """Return the requested case fields, or the defaults, rejecting unknown names"""
+    fields = fields or DEFAULT_CASE_FIELDS
+    unknown = [f for f in fields if f not in CASE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def is_busy_error(error: Exception) -> bool:
+    """Whether a sqlite3 error means another connection held the lock too long"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def month_date_range(month: int, year: int) -> tuple:
+    """Return the first day of the month and the first day of the next month"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return str(start), str(end)
+
+
+def encode_cursor(test_date: str, result_id: int) -> str:
+    """Encode a (test_date, result_id) keyset position as an opaque token"""
+    raw = json.dumps([test_date, result_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    """Decode a token produced by encode_cursor"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        test_date, result_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(test_date), int(result_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
 
 class DataIngestion:
-    def __init__(self, db_path='demicstech.db'):
+    def __init__(self, db_path='demicstech.db', series_store=None, shards=None):
         self.db_path = db_path
-        self.geolocator = Nominatim(user_agent="demicstech_surveillance")
+        self.archive = ArchiveRouter(db_path)
+        # ShardRouter when SHARDING is enabled; patients and results go to their hospital's zone
+        self.shards = shards if shards is not None else shard_router(db_path)
+        # Optional DailySeriesStore kept current as results arrive
+        self.series_store = series_store
+        self._geolocator = None
+        # LookupCodes per database file written to
+        self._codes = {}
+    
+    @property
+    def geolocator(self):
+        # geopy is only needed when an address has to be geocoded
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent="demicstech_surveillance")
+        return self._geolocator
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def get_connection(self, date_range: tuple = None):
+        """
+        Pass the (start, end) test dates a read covers to include archived
+        test results in that range; writes always use the plain connection
+        When sharded, reads with a date range cover every shard instead
+        """
+        if date_range is not None:
+            if self.shards is not None:
+                return self.shards.connect()
+            return self.archive.connect(*date_range)
+        conn = open_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _write_path(self, hospital_id: int) -> str:
+        """Database file a hospital's patients and results belong in"""
+        if self.shards is not None:
+            return self.shards.write_path(hospital_id)
+        return self.db_path
+    
+    def _write_connection(self, hospital_id: int):
+        conn = open_connection(self._write_path(hospital_id))
         conn.row_factory = sqlite3.Row
         return conn
     
+    def _lookup_codes(self, hospital_id: int) -> LookupCodes:
+        return self._codes.setdefault(self._write_path(hospital_id), LookupCodes())
+    
+    @timed('geocode')
     def geocode_address(self, address: str) -> tuple:
         """Convert address to latitude and longitude"""
+        from geopy.exc import GeocoderTimedOut
+        
         try:
             location = self.geolocator.geocode(address + ", Nigeria", timeout=10)
             if location:
+                GEOCODER_CALLS.inc(outcome='found')
                 return location.latitude, location.longitude
+            GEOCODER_CALLS.inc(outcome='not_found')
             return None, None
         except GeocoderTimedOut:
+            GEOCODER_CALLS.inc(outcome='timeout')
             return None, None
         except Exception as e:
+            GEOCODER_CALLS.inc(outcome='error')
             print(f"Geocoding error: {e}")
             return None, None
     
+    @timed('ingestion.add_hospital')
     def add_hospital(self, hospital_data: Dict) -> int:
         """Add a new hospital to the system"""
         conn = self.get_connection()
@@ -51,24 +173,30 @@ class DataIngestion:
         ))
         
         hospital_id = cursor.lastrowid
+        if self.shards is not None:
+            self.shards.register_hospital(conn, hospital_id, hospital_data)
         conn.commit()
         conn.close()
+        INGESTED_ROWS.inc(table='hospitals')
         
         return hospital_id
     
+    @timed('ingestion.add_patient')
     def add_patient(self, patient_data: Dict) -> int:
         """Add or update patient information"""
-        conn = self.get_connection()
+        conn = self._write_connection(patient_data['hospital_id'])
         cursor = conn.cursor()
         
         # Geocode patient address
         lat, lon = patient_data.get('latitude'), patient_data.get('longitude')
         if not lat or not lon:
             lat, lon = self.geocode_address(patient_data['address'])
+        geohash = encode_geohash(lat, lon)
+        location_id = self._lookup_codes(patient_data['hospital_id']).location(cursor, patient_data['address'])
         
         # Check if patient already exists
-        cursor.execute('''
-        SELECT patient_id FROM patients 
+        cursor.execute(f'''
+        SELECT patient_id, geohash, age, gender FROM {PATIENTS_TABLE} 
         WHERE hospital_id = ? AND external_patient_id = ?
         ''', (patient_data['hospital_id'], patient_data['external_patient_id']))
         
@@ -76,69 +204,109 @@ class DataIngestion:
         
         if existing:
             # Update existing patient
-            cursor.execute('''
-            UPDATE patients 
-            SET age = ?, gender = ?, address = ?, latitude = ?, longitude = ?, phone = ?
+            cursor.execute(f'''
+            UPDATE {PATIENTS_TABLE} 
+            SET age = ?, gender = ?, location_id = ?, latitude = ?, longitude = ?, geohash = ?, phone = ?
             WHERE patient_id = ?
             ''', (
                 patient_data.get('age'),
                 patient_data.get('gender'),
-                patient_data['address'],
-                lat, lon,
+                location_id,
+                lat, lon, geohash,
                 patient_data.get('phone'),
                 existing['patient_id']
             ))
             patient_id = existing['patient_id']
+            # Their results move with them in the summary tables
+            move_patient_cases(cursor, patient_id, existing, {
+                'geohash': geohash,
+                'age': patient_data.get('age'),
+                'gender': patient_data.get('gender')
+            })
         else:
             # Insert new patient
-            cursor.execute('''
-            INSERT INTO patients (hospital_id, external_patient_id, age, gender, address, latitude, longitude, phone)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            cursor.execute(f'''
+            INSERT INTO {PATIENTS_TABLE} (hospital_id, external_patient_id, age, gender, location_id, latitude, longitude, geohash, phone)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 patient_data['hospital_id'],
                 patient_data['external_patient_id'],
                 patient_data.get('age'),
                 patient_data.get('gender'),
-                patient_data['address'],
-                lat, lon,
+                location_id,
+                lat, lon, geohash,
                 patient_data.get('phone')
             ))
             patient_id = cursor.lastrowid
         
         conn.commit()
         conn.close()
+        INGESTED_ROWS.inc(table='patients')
         
         return patient_id
     
+    @timed('ingestion.add_test_result')
     def add_test_result(self, test_data: Dict) -> int:
         """Add a disease test result"""
-        conn = self.get_connection()
+        return self._retry_busy(self._add_test_result, test_data)
+    
+    def _retry_busy(self, write, *args):
+        """
+        write(*args), run again (after a short, growing pause) up to
+        WRITE_RETRIES times while it fails because the database is locked
+        An attempt that fails is rolled back when its connection is released.
+        """
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                return write(*args)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                SQLITE_BUSY.inc()
+                if attempt == WRITE_RETRIES:
+                    raise
+                SQLITE_RETRIES.inc()
+            time.sleep(WRITE_RETRY_DELAY * 2 ** attempt)
+    
+    def _add_test_result(self, test_data: Dict) -> int:
+        conn = self._write_connection(test_data['hospital_id'])
         cursor = conn.cursor()
         
         # First, ensure patient exists
         patient_id = self.add_patient(test_data['patient_data'])
         
-        # Add test result
-        cursor.execute('''
-        INSERT INTO test_results (patient_id, hospital_id, disease_type, test_result, test_date, severity, symptoms, notes)
+        # Add test result, with categorical values stored as lookup ids
+        codes = self._lookup_codes(test_data['hospital_id'])
+        cursor.execute(f'''
+        INSERT INTO {TEST_RESULTS_TABLE} (patient_id, hospital_id, disease_id, outcome_id, test_date, severity_id, symptoms, notes)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             patient_id,
             test_data['hospital_id'],
-            test_data['disease_type'],
-            test_data['test_result'],
+            codes.column(cursor, 'disease_type', test_data['disease_type']),
+            codes.column(cursor, 'test_result', test_data['test_result']),
             test_data['test_date'],
-            test_data.get('severity'),
+            codes.column(cursor, 'severity', test_data.get('severity')),
             test_data.get('symptoms'),
             test_data.get('notes')
         ))
         
         result_id = cursor.lastrowid
+        
+        # Keep the summary tables in step with the new row
+        cursor.execute('SELECT geohash, age, gender FROM patients WHERE patient_id = ?', (patient_id,))
+        record_case(cursor, test_data, cursor.fetchone())
+        
         conn.commit()
         conn.close()
+        INGESTED_ROWS.inc(table='test_results')
+        
+        if self.series_store is not None:
+            self.series_store.sync()
         
         return result_id
     
+    @timed('ingestion.bulk_add_test_results')
     def bulk_add_test_results(self, test_results: List[Dict]) -> int:
         """Add multiple test results at once"""
         count = 0
@@ -152,6 +320,7 @@ class DataIngestion:
         
         return count
     
+    @timed('ingestion.fetch_from_hospital_api')
     def fetch_from_hospital_api(self, hospital_id: int, disease_type: str, start_date: str, end_date: str):
         """
         Fetch data from hospital API endpoint
@@ -177,9 +346,12 @@ class DataIngestion:
             'hospital_id': hospital_id
         }
     
+    @timed('ingestion.get_monthly_cases')
     def get_monthly_cases(self, disease_type: str, month: int, year: int) -> List[Dict]:
         """Get all cases for a specific disease in a given month"""
-        conn = self.get_connection()
+        start_date, end_date = month_date_range(month, year)
+        
+        conn = self.get_connection((start_date, end_date))
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -199,15 +371,138 @@ class DataIngestion:
         JOIN patients p ON tr.patient_id = p.patient_id
         JOIN hospitals h ON tr.hospital_id = h.hospital_id
         WHERE tr.disease_type = ?
-        AND strftime('%m', tr.test_date) = ?
-        AND strftime('%Y', tr.test_date) = ?
+        AND tr.test_date >= ?
+        AND tr.test_date < ?
         ORDER BY tr.test_date
-        ''', (disease_type, f'{month:02d}', str(year)))
+        ''', (disease_type, start_date, end_date))
         
         results = [dict(row) for row in cursor.fetchall()]
         conn.close()
         
         return results
+    
+    def _case_filters(self, disease_types: List[str], start_date: str, end_date: str,
+                      hospital_id: Optional[int] = None, test_result: Optional[str] = None,
+                      severity: Optional[str] = None, bbox: Optional[tuple] = None) -> tuple:
+        """Build the WHERE conditions and parameters shared by the case queries"""
+        placeholders = ', '.join('?' for _ in disease_types)
+        conditions = [f'tr.disease_type IN ({placeholders})', 'tr.test_date BETWEEN ? AND ?']
+        params = list(disease_types) + [start_date, end_date]
+        
+        if hospital_id is not None:
+            conditions.append('tr.hospital_id = ?')
+            params.append(hospital_id)
+        if test_result:
+            conditions.append('tr.test_result = ?')
+            params.append(test_result)
+        if severity:
+            conditions.append('tr.severity = ?')
+            params.append(severity)
+        if bbox:
+            spatial_sql, spatial_params = bbox_conditions(bbox)
+            conditions.append(spatial_sql)
+            params.extend(spatial_params)
+        
+        return conditions, params
+    
+    @timed('ingestion.query_cases')
+    def query_cases(self, disease_type: str, start_date: str, end_date: str,
+                    hospital_id: Optional[int] = None, test_result: Optional[str] = None,
+                    severity: Optional[str] = None, bbox: Optional[tuple] = None,
+                    fields: Optional[List[str]] = None, limit: int = DEFAULT_PAGE_SIZE,
+                    cursor_token: Optional[str] = None) -> Dict:
+        """
+        Get one page of cases between start_date and end_date (inclusive)
+        Pages are keyed on (test_date, result_id); pass the returned
+        next_cursor back in to continue where the previous page stopped
+        """
+        fields = validate_case_fields(fields)
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        
+        conditions, params = self._case_filters(
+            [disease_type], start_date, end_date, hospital_id, test_result, severity, bbox
+        )
+        if cursor_token:
+            last_date, last_id = decode_cursor(cursor_token)
+            conditions.append('(tr.test_date, tr.result_id) > (?, ?)')
+            params.extend([last_date, last_id])
+        
+        # Keyset columns are always selected so the next cursor can be built
+        columns = [f'{CASE_FIELDS[f]} AS {f}' for f in fields]
+        columns += ['tr.test_date AS _page_date', 'tr.result_id AS _page_id']
+        
+        conn = self.get_connection((start_date, end_date))
+        cursor = conn.cursor()
+        cursor.execute(f'''
+        SELECT {', '.join(columns)}
+        FROM test_results tr
+        JOIN patients p ON tr.patient_id = p.patient_id
+        JOIN hospitals h ON tr.hospital_id = h.hospital_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY tr.test_date, tr.result_id
+        LIMIT ?
+        ''', params + [limit + 1])
+        
+        rows = cursor.fetchmany(limit + 1)
+        conn.close()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(rows[-1]['_page_date'], rows[-1]['_page_id'])
+        
+        return {
+            'cases': [{f: row[f] for f in fields} for row in rows],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+    
+    def iter_cases(self, disease_types: List[str], start_date: str, end_date: str,
+                   hospital_id: Optional[int] = None, test_result: Optional[str] = None,
+                   severity: Optional[str] = None, bbox: Optional[tuple] = None,
+                   fields: Optional[List[str]] = None, batch_size: int = 1000):
+        """
+        Iterate over every matching case as a tuple of field values, in
+        (test_date, result_id) order, reading batch_size rows at a time
+        The arguments are checked and the query started before this returns,
+        so bad input raises here rather than partway through a streamed response.
+        """
+        fields = validate_case_fields(fields)
+        if not disease_types:
+            raise ValueError("At least one disease_type is required")
+        conditions, params = self._case_filters(
+            disease_types, start_date, end_date, hospital_id, test_result, severity, bbox
+        )
+        columns = [f'{CASE_FIELDS[f]} AS {f}' for f in fields]
+        
+        conn = self.get_connection((start_date, end_date))
+        conn.row_factory = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            SELECT {', '.join(columns)}
+            FROM test_results tr
+            JOIN patients p ON tr.patient_id = p.patient_id
+            JOIN hospitals h ON tr.hospital_id = h.hospital_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY tr.test_date, tr.result_id
+            ''', params)
+        except Exception:
+            conn.close()
+            raise
+        return self._stream_rows(conn, cursor, batch_size)
+    
+    @staticmethod
+    def _stream_rows(conn, cursor, batch_size: int):
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
 
 
 # Example usage functions
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from lazy import lazy_import
+from series_store import AREA_PRECISION as SERIES_AREA_PRECISION, POSITIVE, UNLOCATED
+
+np = lazy_import('numpy')
+
+# Days of history each series is fitted on
+HISTORY_DAYS = 56
+
+# Geohash precision used as the forecast area (~39km x 19km, roughly LGA sized)
+AREA_PRECISION = 4
+
+MAX_HORIZON = 14
+
+# IRLS iterations for a cold fit and for a warm-started refit
+COLD_ITERATIONS = 25
+WARM_ITERATIONS = 4
+
+# Ridge penalty on the trend and weekday terms. Its weight is small next to
+# the information in a busy series but shrinks sparse ones to a flat rate.
+RIDGE = 1.0
+
+# Small penalty on the intercept keeping all-zero series solvable
+INTERCEPT_RIDGE = 1e-3
+
+
+def design_matrix(days: List[date], origin: date) -> np.ndarray:
+    """
+    Poisson regression design: intercept, linear trend (in weeks) and
+    day-of-week indicators with Monday as the baseline
+    """
+    offsets = np.array([(d - origin).days for d in days], dtype=np.float64)
+    weekdays = np.array([d.weekday() for d in days])
+    dow = (weekdays[:, None] == np.arange(1, 7)[None, :]).astype(np.float64)
+    return np.column_stack([np.ones(len(days)), offsets / 7.0, dow])
+
+
+def fit_poisson(X: np.ndarray, Y: np.ndarray, beta: Optional[np.ndarray] = None,
+                iterations: int = COLD_ITERATIONS) -> np.ndarray:
+    """
+    Fit one Poisson GLM per row of Y (n_series, n_days) against the shared
+    design X (n_days, n_features) by IRLS, solving every series in one
+    batched linear solve per iteration. Returns (n_series, n_features).
+    """
+    n_series, n_features = Y.shape[0], X.shape[1]
+    if beta is None:
+        beta = np.zeros((n_series, n_features))
+        beta[:, 0] = np.log(Y.mean(axis=1) + 0.1)
+
+    ridge = np.diag([INTERCEPT_RIDGE] + [RIDGE] * (n_features - 1))
+    for _ in range(iterations):
+        eta = np.clip(beta @ X.T, -20, 20)
+        mu = np.exp(eta)
+        z = eta + (Y - mu) / mu
+        XtWX = np.einsum('dk,sd,dl->skl', X, mu, X) + ridge
+        XtWz = np.einsum('dk,sd->sk', X, mu * z)
+        beta = np.linalg.solve(XtWX, XtWz[..., None])[..., 0]
+
+    return beta
+
+
+class CaseForecaster:
+    """
+    Short-term positive case forecasts for every disease x area series
+    Fitted coefficients are cached per series together with the data version
+    they were fitted on; when new data arrives the fit is warm-started from
+    the cached coefficients, which converges in a few iterations
+    """
+
+    def __init__(self, history_days: int = HISTORY_DAYS, series_store=None):
+        self.history_days = history_days
+        # Optional DailySeriesStore read instead of the surveillance cube
+        self.series_store = series_store
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _data_version(self, cursor) -> tuple:
+        """Identify the current state of test_results cheaply"""
+        cursor.execute('SELECT MAX(result_id) FROM test_results')
+        return (cursor.fetchone()[0] or 0,)
+
+    def _load_stored_series(self, start: date, end: date, disease_type: Optional[str]) -> tuple:
+        """Read the same dense matrix as _load_series from the series store's area files"""
+        keys, rows = [], []
+        for disease in ([disease_type] if disease_type else self.series_store.diseases()):
+            areas = self.series_store.areas_for(disease)
+            # A stable order: unlocated cases first, then areas by geohash
+            for area in sorted(areas, key=lambda a: (a != UNLOCATED, a)):
+                positives = self.series_store.window(disease, start, end, area)[POSITIVE]
+                if positives.any():
+                    keys.append((disease, None if area == UNLOCATED else area))
+                    rows.append(positives)
+
+        Y = np.array(rows, dtype=np.float64) if rows else np.zeros((0, (end - start).days + 1))
+        return keys, Y
+
+    def _load_series(self, cursor, start: date, end: date, disease_type: Optional[str],
+                     area_precision: int) -> tuple:
+        """Read daily positive counts for every series into a dense matrix"""
+        query = '''
+        SELECT
+            disease_type,
+            substr(cell, 1, ?) as area,
+            stat_date,
+            SUM(case_count) as positive_cases
+        FROM surveillance_cube
+        WHERE test_result = 'Positive'
+        AND stat_date BETWEEN ? AND ?
+        '''
+        params = [area_precision, str(start), str(end)]
+        if disease_type:
+            query += ' AND disease_type = ?'
+            params.append(disease_type)
+        query += ' GROUP BY disease_type, area, stat_date'
+        cursor.execute(query, params)
+
+        series_index = {}
+        cells = []
+        for row in cursor.fetchall():
+            key = (row['disease_type'], row['area'] or None)
+            slot = series_index.setdefault(key, len(series_index))
+            day = (datetime.strptime(row['stat_date'], '%Y-%m-%d').date() - start).days
+            cells.append((slot, day, row['positive_cases']))
+
+        Y = np.zeros((len(series_index), (end - start).days + 1))
+        if cells:
+            slots, days, counts = np.array(cells).T
+            Y[slots.astype(int), days.astype(int)] = counts
+        return list(series_index), Y
+
+    def forecast(self, conn, end_date: str, horizon: int = 7, disease_type: Optional[str] = None,
+                 area_precision: int = AREA_PRECISION, method: str = 'poisson') -> Dict:
+        """Forecast daily positive cases for the horizon days after end_date"""
+        horizon = max(1, min(int(horizon), MAX_HORIZON))
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        start = end - timedelta(days=self.history_days - 1)
+
+        cursor = conn.cursor()
+        if (self.series_store is not None and area_precision == SERIES_AREA_PRECISION
+                and self.series_store.covers(start, end)):
+            self.series_store.sync()
+            version = (self.series_store.version,)
+            keys, Y = self._load_stored_series(start, end, disease_type)
+        else:
+            version = self._data_version(cursor)
+            keys, Y = self._load_series(cursor, start, end, disease_type, area_precision)
+
+        history_days = [start + timedelta(days=i) for i in range(self.history_days)]
+        future_days = [end + timedelta(days=i) for i in range(1, horizon + 1)]
+
+        if not keys:
+            predictions = np.zeros((0, horizon))
+        elif method == 'seasonal_naive':
+            # Repeat the value from the same weekday of the last observed week
+            last_week = Y[:, -7:]
+            predictions = last_week[:, [i % 7 for i in range(horizon)]]
+        elif method == 'poisson':
+            X = design_matrix(history_days, start)
+            cache_keys = [(disease, area, area_precision) for disease, area in keys]
+            beta = self._fit(cache_keys, X, Y, (end, version))
+            predictions = np.exp(np.clip(beta @ design_matrix(future_days, start).T, -20, 20))
+        else:
+            raise ValueError(f"Unknown forecast method: {method}")
+
+        return {
+            'method': method,
+            'end_date': str(end),
+            'dates': [str(d) for d in future_days],
+            'series': [
+                {
+                    'disease_type': disease,
+                    'area': area,
+                    'recent_daily_avg': float(Y[i, -7:].mean()),
+                    'forecast': [round(float(v), 3) for v in predictions[i]]
+                }
+                for i, (disease, area) in enumerate(keys)
+            ]
+        }
+
+    def _fit(self, keys: List[tuple], X: np.ndarray, Y: np.ndarray, version: tuple) -> np.ndarray:
+        """
+        Fit every series, reusing cached coefficients where possible
+        keys identify each row of Y; version is (end date, data version)
+        """
+        with self._lock:
+            cached = [self._cache.get(key) for key in keys]
+
+        fresh = [i for i, entry in enumerate(cached) if entry is None or entry[0] != version]
+        beta = np.array([entry[1] if entry else np.zeros(X.shape[1]) for entry in cached])
+        if not fresh:
+            return beta
+
+        # Series seen before are warm-started; only brand new ones fit from scratch
+        warm = [i for i in fresh if cached[i] is not None]
+        cold = [i for i in fresh if cached[i] is None]
+        if warm:
+            beta[warm] = fit_poisson(X, Y[warm], beta[warm], WARM_ITERATIONS)
+        if cold:
+            beta[cold] = fit_poisson(X, Y[cold])
+
+        with self._lock:
+            for i in fresh:
+                self._cache[keys[i]] = (version, beta[i])
+        return beta
@@ -0,0 +1,169 @@
+import math
+from typing import List, Optional, Tuple
+
+# Geohash alphabet; every character sorts below '~', which makes
+# "geohash >= prefix AND geohash < prefix || '~'" an index range scan
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision stored on patients (~38m x 19m cells)
+GEOHASH_PRECISION = 8
+
+# Upper bound on how many prefix ranges a spatial prefilter expands to
+MAX_PREFILTER_CELLS = 32
+
+EARTH_RADIUS_KM = 6371
+
+
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> Optional[str]:
+    """Encode a coordinate as a geohash string"""
+    if latitude is None or longitude is None:
+        return None
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def decode(geohash: str) -> Tuple[float, float, float, float]:
+    """Return the (min_lat, min_lon, max_lat, max_lon) bounds of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even = not even
+
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Return the (lat, lon) size in degrees of a cell at the given precision"""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _cell_index_span(bbox: tuple, precision: int) -> Tuple[int, int, int, int]:
+    """Return the first and last lat/lon cell indexes a bounding box touches"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lat_size, lon_size = cell_size(precision)
+    return (math.floor((min_lat + 90) / lat_size), math.floor((max_lat + 90) / lat_size),
+            math.floor((min_lon + 180) / lon_size), math.floor((max_lon + 180) / lon_size))
+
+
+def count_cells(bbox: tuple, precision: int) -> int:
+    """Count the geohash cells at a precision needed to cover a bounding box"""
+    lat_start, lat_end, lon_start, lon_end = _cell_index_span(bbox, precision)
+    return (lat_end - lat_start + 1) * (lon_end - lon_start + 1)
+
+
+def cover_bbox(bbox: tuple, max_cells: int = MAX_PREFILTER_CELLS,
+               max_precision: int = GEOHASH_PRECISION) -> Tuple[int, List[str]]:
+    """
+    Find geohash cells covering a (min_lat, min_lon, max_lat, max_lon) box
+    Uses the finest precision whose cover needs at most max_cells cells
+    """
+    best = (0, [''])
+
+    for precision in range(1, max_precision + 1):
+        if count_cells(bbox, precision) > max_cells:
+            break
+
+        lat_size, lon_size = cell_size(precision)
+        lat_start, lat_end, lon_start, lon_end = _cell_index_span(bbox, precision)
+        cells = []
+        for lat_index in range(lat_start, lat_end + 1):
+            lat = -90 + (lat_index + 0.5) * lat_size
+            for lon_index in range(lon_start, lon_end + 1):
+                lon = -180 + (lon_index + 0.5) * lon_size
+                cells.append(encode(lat, lon, precision))
+        best = (precision, cells)
+
+    return best
+
+
+def radius_bbox(latitude: float, longitude: float, radius_km: float) -> tuple:
+    """Return a bounding box that fully contains a circle around a point"""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    return (latitude - lat_delta, longitude - lon_delta,
+            latitude + lat_delta, longitude + lon_delta)
+
+
+def bbox_conditions(bbox: tuple, geohash_column: str = 'p.geohash',
+                    lat_column: str = 'p.latitude', lon_column: str = 'p.longitude') -> Tuple[str, list]:
+    """
+    Build a SQL condition selecting rows inside bbox
+    Geohash prefix ranges let SQLite use the geohash index to fetch nearby
+    candidates; the exact lat/lon test then trims the cell edges
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    precision, cells = cover_bbox(bbox)
+
+    conditions = [f'{lat_column} BETWEEN ? AND ?', f'{lon_column} BETWEEN ? AND ?']
+    params = [min_lat, max_lat, min_lon, max_lon]
+
+    if precision:
+        prefix_sql, prefix_params = prefix_conditions(cells, geohash_column)
+        conditions.insert(0, prefix_sql)
+        params = prefix_params + params
+
+    return ' AND '.join(conditions), params
+
+
+def prefix_conditions(cells: List[str], geohash_column: str) -> Tuple[str, list]:
+    """Build a SQL condition matching geohashes that start with any of the given cells"""
+    if not cells:
+        # An empty cover (e.g. an inverted box) matches nothing
+        return '0', []
+    ranges = ' OR '.join(f'({geohash_column} >= ? AND {geohash_column} < ?)' for _ in cells)
+    params = []
+    for cell in cells:
+        params.extend([cell, cell + '~'])
+    return f'({ranges})', params
+
+
+def intersects(cell: str, bbox: tuple) -> bool:
+    """Check whether a geohash cell overlaps a bounding box"""
+    cell_min_lat, cell_min_lon, cell_max_lat, cell_max_lon = decode(cell)
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return (cell_min_lat <= max_lat and cell_max_lat >= min_lat and
+            cell_min_lon <= max_lon and cell_max_lon >= min_lon)
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from precompute import analysis_params
+
+# Analyses that can be submitted as jobs
+JOB_ANALYSES = ['daily_statistics', 'monthly_statistics', 'outbreak', 'hotspots', 'forecast']
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Seconds a finished job's result is kept and reused for identical requests
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+
+# Running jobs older than this are presumed lost (e.g. their worker died)
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 1800))
+
+# Seconds between the job runner's checks for queued jobs
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+
+# Seconds between the job runner's purges of expired and lost jobs
+JOB_PURGE_INTERVAL = float(os.environ.get('JOB_PURGE_INTERVAL', 60))
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Someone else's process now has the pid
+        return True
+    return True
+
+
+def job_params(analysis: str, params: Optional[Dict], today) -> Dict:
+    """
+    The analysis' default parameters overridden by params, each converted to
+    its default's type, so equal requests (5 and 5.0) share a job key
+    """
+    merged = analysis_params(analysis, today)
+    for name, value in (params or {}).items():
+        if name not in merged:
+            raise ValueError(f"Unknown parameter for {analysis}: {name}")
+        default = merged[name]
+        try:
+            if isinstance(default, float):
+                value = float(value)
+            elif isinstance(default, int):
+                number = float(value)
+                if not number.is_integer():
+                    raise ValueError
+                value = int(number)
+            else:
+                value = datetime.strptime(str(value), '%Y-%m-%d').date().isoformat()
+        except (TypeError, ValueError):
+            expected = 'a date (YYYY-MM-DD)' if isinstance(default, str) else type(default).__name__
+            raise ValueError(f"{name} must be {expected}")
+        merged[name] = value
+    return merged
+
+
+def _connect(db_path: str):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _update_job(db_path: str, job_id: str, **fields):
+    conn = _connect(db_path)
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn.execute(f'UPDATE analysis_jobs SET {assignments} WHERE job_id = ?',
+                 list(fields.values()) + [job_id])
+    conn.commit()
+    conn.close()
+
+
+def execute_job(db_path: str, job_id: str, analysis: str, disease_types: List[str],
+                params: Dict, result_ttl: int):
+    """
+    Run a job inside a pool worker process, recording progress and the
+    outcome in analysis_jobs as each disease finishes
+    """
+    from analysis import DiseaseAnalyzer
+    from precompute import run_analysis
+
+    _update_job(db_path, job_id, status='running', started_at=time.time())
+    try:
+        analyzer = DiseaseAnalyzer(db_path=db_path)
+        results = {}
+        for done, disease_type in enumerate(disease_types, start=1):
+            results[disease_type] = run_analysis(analyzer, analysis, disease_type, params)
+            _update_job(db_path, job_id, progress=done / len(disease_types))
+
+        finished = time.time()
+        _update_job(db_path, job_id, status='done', progress=1.0, result=json.dumps(results),
+                    finished_at=finished, expires_at=finished + result_ttl)
+    except Exception as e:
+        finished = time.time()
+        _update_job(db_path, job_id, status='failed', error=str(e),
+                    finished_at=finished, expires_at=finished + result_ttl)
+
+
+class JobManager:
+    """
+    Queues long-running analyses in the analysis_jobs table and reports on
+    them, so any web worker can report on any job; a JobRunner in the
+    background process runs them
+    """
+
+    def __init__(self, db_path='demicstech.db'):
+        self.db_path = db_path
+
+    @staticmethod
+    def job_key(analysis: str, disease_types: List[str], params: Dict) -> str:
+        raw = json.dumps([analysis, sorted(disease_types), params], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def submit(self, analysis: str, disease_types: List[str], params: Optional[Dict] = None) -> Dict:
+        """
+        Queue an analysis for one or more diseases
+        Identical requests share one job: an in-flight or unexpired job with
+        the same analysis, diseases and parameters is returned instead
+        """
+        if analysis not in JOB_ANALYSES:
+            raise ValueError(f"analysis must be one of: {', '.join(JOB_ANALYSES)}")
+        if not disease_types:
+            raise ValueError("At least one disease_type is required")
+
+        disease_types = sorted(set(disease_types))
+        merged = job_params(analysis, params, datetime.now().date())
+        key = self.job_key(analysis, disease_types, merged)
+
+        conn = _connect(self.db_path)
+        try:
+            # A second pass only if the job that beat us to the insert has already failed
+            for attempt in range(2):
+                existing = self._find(conn, key)
+                if existing:
+                    return {'job_id': existing['job_id'], 'status': existing['status'], 'deduplicated': True}
+
+                job_id = uuid.uuid4().hex
+                try:
+                    conn.execute('''
+                    INSERT INTO analysis_jobs (job_id, job_key, analysis, request_data, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ''', (job_id, key, analysis,
+                          json.dumps({'disease_types': disease_types, 'params': merged}), time.time()))
+                    conn.commit()
+                    return {'job_id': job_id, 'status': 'queued', 'deduplicated': False}
+                except sqlite3.IntegrityError:
+                    # Another web worker queued the same request a moment ago
+                    conn.rollback()
+            raise RuntimeError("The same job was queued and failed concurrently; submit it again")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _find(conn, key: str):
+        """Newest job for key that has not failed or expired"""
+        return conn.execute('''
+        SELECT job_id, status FROM analysis_jobs
+        WHERE job_key = ? AND status != 'failed' AND (expires_at IS NULL OR expires_at >= ?)
+        ORDER BY created_at DESC LIMIT 1
+        ''', (key, time.time())).fetchone()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return a job's status, progress and (once done) its result"""
+        conn = _connect(self.db_path)
+        try:
+            # Expired rows are left for the runner's purge, so polling never writes
+            row = conn.execute('''
+            SELECT * FROM analysis_jobs
+            WHERE job_id = ? AND (expires_at IS NULL OR expires_at >= ?)
+            ''', (job_id, time.time())).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+
+        request_data = json.loads(row['request_data'])
+        job = {
+            'job_id': row['job_id'],
+            'analysis': row['analysis'],
+            'disease_types': request_data['disease_types'],
+            'params': request_data['params'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'expires_at': row['expires_at']
+        }
+        if row['status'] == 'done':
+            job['result'] = json.loads(row['result'])
+        if row['status'] == 'failed':
+            job['error'] = row['error']
+        return job
+
+    def status_counts(self) -> Dict[str, int]:
+        """Number of jobs in each status, across every web worker"""
+        conn = _connect(self.db_path)
+        rows = conn.execute('SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status').fetchall()
+        conn.close()
+        return {status: count for status, count in rows}
+
+
+class JobRunner:
+    """
+    Claims queued jobs and runs them in a process pool. It lives in the one
+    long-lived background process (precompute.py, which serve.py starts),
+    not in web workers that gunicorn recycles. Runners claim jobs atomically,
+    so more than one may share a database.
+    """
+
+    def __init__(self, db_path='demicstech.db', max_workers: int = JOB_WORKERS,
+                 result_ttl: int = JOB_RESULT_TTL, poll_interval: float = JOB_POLL_INTERVAL):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.purged_at = 0.0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Jobs handed to the pool that have not finished yet
+        self.pending = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created on first use, in the process that runs jobs
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def purge(self, conn):
+        """
+        Drop expired results and fail unfinished jobs that are lost: those
+        whose runner process has exited (its pool went with it) and those
+        older than JOB_TIMEOUT
+        """
+        now = time.time()
+        conn.execute('DELETE FROM analysis_jobs WHERE expires_at IS NOT NULL AND expires_at < ?', (now,))
+        conn.execute('''
+        UPDATE analysis_jobs SET status = 'failed', error = 'Job timed out',
+            finished_at = ?, expires_at = ?
+        WHERE status IN ('queued', 'running') AND created_at < ?
+        ''', (now, now + self.result_ttl, now - JOB_TIMEOUT))
+
+        owners = conn.execute('''
+        SELECT DISTINCT owner_pid FROM analysis_jobs
+        WHERE status = 'running' AND owner_pid IS NOT NULL
+        ''').fetchall()
+        for (pid,) in owners:
+            if not _process_alive(pid):
+                conn.execute('''
+                UPDATE analysis_jobs SET status = 'failed', error = 'Job lost: the process running it exited',
+                    finished_at = ?, expires_at = ?
+                WHERE status = 'running' AND owner_pid = ?
+                ''', (now, now + self.result_ttl, pid))
+        conn.commit()
+        self.purged_at = now
+
+    def run_once(self) -> int:
+        """Purge when due and start queued jobs while the pool has room; returns how many started"""
+        conn = _connect(self.db_path)
+        try:
+            if time.time() - self.purged_at >= JOB_PURGE_INTERVAL:
+                self.purge(conn)
+            # Claimed only as the pool frees up, so waiting jobs stay queued for any runner
+            room = self.max_workers - self.pending
+            if room <= 0:
+                return 0
+            queued = conn.execute('''
+            SELECT job_id, analysis, request_data FROM analysis_jobs
+            WHERE status = 'queued' ORDER BY created_at LIMIT ?
+            ''', (room,)).fetchall()
+
+            started = 0
+            for row in queued:
+                claimed = conn.execute('''
+                UPDATE analysis_jobs SET status = 'running', owner_pid = ?, started_at = ?
+                WHERE job_id = ? AND status = 'queued'
+                ''', (os.getpid(), time.time(), row['job_id'])).rowcount
+                conn.commit()
+                if claimed:
+                    request_data = json.loads(row['request_data'])
+                    self._start(row['job_id'], row['analysis'], request_data['disease_types'],
+                                request_data['params'])
+                    started += 1
+            return started
+        finally:
+            conn.close()
+
+    def _start(self, job_id: str, analysis: str, disease_types: List[str], params: Dict):
+        try:
+            future = self.executor.submit(execute_job, self.db_path, job_id, analysis,
+                                          disease_types, params, self.result_ttl)
+        except BrokenProcessPool:
+            # A worker died and took the pool with it; start a fresh one
+            self._reset_executor()
+            future = self.executor.submit(execute_job, self.db_path, job_id, analysis,
+                                          disease_types, params, self.result_ttl)
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(lambda f: self._job_finished(job_id, f))
+
+    def _job_finished(self, job_id: str, future):
+        """Record jobs whose worker crashed before it could report back"""
+        with self._lock:
+            self.pending -= 1
+        error = future.exception()
+        if error is None:
+            return
+        finished = time.time()
+        _update_job(self.db_path, job_id, status='failed', error=f'Worker failed: {error}',
+                    finished_at=finished, expires_at=finished + self.result_ttl)
+        if isinstance(error, BrokenProcessPool):
+            self._reset_executor()
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Job runner error: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Run in a daemon thread inside the current process"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='job-runner', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,42 @@
+import importlib
+import importlib.util
+import os
+import sys
+
+# Set LAZY_IMPORTS=false to import heavy modules up front instead
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Modules handed out by lazy_import, in the order they were requested
+_lazy_modules = []
+
+
+def lazy_import(name: str):
+    """
+    Return module `name` without running it yet; it is executed the first time
+    one of its attributes is used. Saves startup time for heavy libraries
+    (pandas, numpy) that requests like /health never touch.
+    """
+    if name in sys.modules:
+        # Returned as is: importing it again would force a pending lazy load
+        return sys.modules[name]
+    if not LAZY_IMPORTS:
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    _lazy_modules.append(name)
+    return module
+
+
+def load_lazy_modules() -> list:
+    """Finish loading every lazily imported module, e.g. before forking workers"""
+    for name in _lazy_modules:
+        # Any attribute access triggers the deferred import
+        getattr(sys.modules[name], '__file__', None)
+    return list(_lazy_modules)
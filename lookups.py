@@ -0,0 +1,198 @@
+from typing import Dict, Optional
+
+# Physical tables behind the test_results and patients compatibility views
+TEST_RESULTS_TABLE = 'test_results_coded'
+PATIENTS_TABLE = 'patients_coded'
+
+# Categorical test_results columns stored as ids: column -> (lookup table, id column)
+LOOKUPS = {
+    'disease_type': ('diseases', 'disease_id'),
+    'test_result': ('test_outcomes', 'outcome_id'),
+    'severity': ('severities', 'severity_id'),
+}
+
+# Patient addresses are interned into this table
+LOCATIONS = ('locations', 'location_id')
+
+CODED_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS diseases (
+        disease_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS test_outcomes (
+        outcome_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS severities (
+        severity_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''',
+    # Addresses match case-insensitively, keeping the first spelling seen
+    '''
+    CREATE TABLE IF NOT EXISTS locations (
+        location_id INTEGER PRIMARY KEY,
+        address TEXT NOT NULL UNIQUE COLLATE NOCASE
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS {PATIENTS_TABLE} (
+        patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hospital_id INTEGER,
+        external_patient_id TEXT,
+        age INTEGER,
+        gender TEXT,
+        location_id INTEGER,
+        latitude REAL,
+        longitude REAL,
+        phone TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        geohash TEXT,
+        FOREIGN KEY (hospital_id) REFERENCES hospitals(hospital_id),
+        FOREIGN KEY (location_id) REFERENCES locations(location_id),
+        UNIQUE(hospital_id, external_patient_id)
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS {TEST_RESULTS_TABLE} (
+        result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        hospital_id INTEGER,
+        disease_id INTEGER NOT NULL,
+        outcome_id INTEGER NOT NULL,
+        test_date DATE NOT NULL,
+        severity_id INTEGER,
+        symptoms TEXT,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES {PATIENTS_TABLE}(patient_id),
+        FOREIGN KEY (hospital_id) REFERENCES hospitals(hospital_id),
+        FOREIGN KEY (disease_id) REFERENCES diseases(disease_id),
+        FOREIGN KEY (outcome_id) REFERENCES test_outcomes(outcome_id),
+        FOREIGN KEY (severity_id) REFERENCES severities(severity_id)
+    )
+    ''',
+]
+
+CODED_INDEXES = [
+    f'CREATE INDEX IF NOT EXISTS idx_patient_hospital ON {PATIENTS_TABLE}(hospital_id)',
+    f'CREATE INDEX IF NOT EXISTS idx_patient_geohash ON {PATIENTS_TABLE}(geohash)',
+    f'CREATE INDEX IF NOT EXISTS idx_test_date ON {TEST_RESULTS_TABLE}(test_date)',
+    f'CREATE INDEX IF NOT EXISTS idx_disease_date ON {TEST_RESULTS_TABLE}(disease_id, test_date)',
+    f'CREATE INDEX IF NOT EXISTS idx_test_result ON {TEST_RESULTS_TABLE}(outcome_id)',
+]
+
+
+def decoded_test_results_sql(source: str = TEST_RESULTS_TABLE, lookup_schema: Optional[str] = None) -> str:
+    """
+    SELECT giving coded rows in source the original test_results columns, in
+    their original order; lookup_schema qualifies the lookup tables
+    Every lookup is a LEFT JOIN on its primary key: SQLite drops joins whose
+    columns a query does not use (so MAX(result_id) stays an index lookup) and
+    turns them into inner joins when the query filters on them.
+    """
+    prefix = f'{lookup_schema}.' if lookup_schema else ''
+    return f'''
+    SELECT c.result_id, c.patient_id, c.hospital_id, d.name AS disease_type, o.name AS test_result,
+           c.test_date, s.name AS severity, c.symptoms, c.notes, c.created_at
+    FROM {source} c
+    LEFT JOIN {prefix}diseases d ON d.disease_id = c.disease_id
+    LEFT JOIN {prefix}test_outcomes o ON o.outcome_id = c.outcome_id
+    LEFT JOIN {prefix}severities s ON s.severity_id = c.severity_id
+    '''
+
+
+# Compatibility views: existing SQL reads test_results and patients unchanged.
+# Inserts through them work too, but cursor.lastrowid is not the new row's id
+# after an INSTEAD OF trigger, so DataIngestion writes the coded tables directly.
+COMPATIBILITY_VIEWS = [
+    f'CREATE VIEW IF NOT EXISTS test_results AS {decoded_test_results_sql()}',
+    f'''
+    CREATE VIEW IF NOT EXISTS patients AS
+    SELECT p.patient_id, p.hospital_id, p.external_patient_id, p.age, p.gender, l.address,
+           p.latitude, p.longitude, p.phone, p.created_at, p.geohash, p.location_id
+    FROM {PATIENTS_TABLE} p
+    LEFT JOIN locations l ON l.location_id = p.location_id
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS test_results_insert INSTEAD OF INSERT ON test_results
+    BEGIN
+        INSERT OR IGNORE INTO diseases (name) VALUES (NEW.disease_type);
+        INSERT OR IGNORE INTO test_outcomes (name) VALUES (NEW.test_result);
+        INSERT OR IGNORE INTO severities (name) SELECT NEW.severity WHERE NEW.severity IS NOT NULL;
+        INSERT INTO {TEST_RESULTS_TABLE}
+            (result_id, patient_id, hospital_id, disease_id, outcome_id, test_date, severity_id,
+             symptoms, notes, created_at)
+        VALUES (
+            NEW.result_id, NEW.patient_id, NEW.hospital_id,
+            (SELECT disease_id FROM diseases WHERE name = NEW.disease_type),
+            (SELECT outcome_id FROM test_outcomes WHERE name = NEW.test_result),
+            NEW.test_date,
+            (SELECT severity_id FROM severities WHERE name = NEW.severity),
+            NEW.symptoms, NEW.notes, COALESCE(NEW.created_at, CURRENT_TIMESTAMP)
+        );
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS patients_insert INSTEAD OF INSERT ON patients
+    BEGIN
+        INSERT OR IGNORE INTO locations (address) SELECT trim(NEW.address) WHERE NEW.address IS NOT NULL;
+        INSERT INTO {PATIENTS_TABLE}
+            (patient_id, hospital_id, external_patient_id, age, gender, location_id,
+             latitude, longitude, phone, created_at, geohash)
+        VALUES (
+            NEW.patient_id, NEW.hospital_id, NEW.external_patient_id, NEW.age, NEW.gender,
+            (SELECT location_id FROM locations WHERE address = trim(NEW.address)),
+            NEW.latitude, NEW.longitude, NEW.phone, COALESCE(NEW.created_at, CURRENT_TIMESTAMP), NEW.geohash
+        );
+    END
+    ''',
+]
+
+
+def normalize_address(address: Optional[str]) -> Optional[str]:
+    """Canonical form an address is interned under; matches trim() in the triggers"""
+    return address.strip(' ') if address is not None else None
+
+
+class LookupCodes:
+    """
+    Ids of lookup values in one database file, added on first use
+    Lookup rows are never changed or removed, so ids are cached for the life
+    of the process. Only ids that were already present are cached: a value
+    added in a transaction that is later rolled back must be looked up again.
+    """
+
+    def __init__(self):
+        self._codes: Dict[tuple, int] = {}
+
+    def code(self, cursor, table: str, id_column: str, value, name_column: str = 'name') -> Optional[int]:
+        if value is None:
+            return None
+        key = (table, value)
+        code = self._codes.get(key)
+        if code is not None:
+            return code
+
+        select = f'SELECT {id_column} FROM {table} WHERE {name_column} = ?'
+        row = cursor.execute(select, (value,)).fetchone()
+        if row is not None:
+            self._codes[key] = row[0]
+            return row[0]
+        # Another connection may add the same value between the SELECT and this
+        cursor.execute(f'INSERT OR IGNORE INTO {table} ({name_column}) VALUES (?)', (value,))
+        return cursor.execute(select, (value,)).fetchone()[0]
+
+    def column(self, cursor, column: str, value) -> Optional[int]:
+        """Id for a test_results column value, e.g. column('disease_type', 'Malaria')"""
+        table, id_column = LOOKUPS[column]
+        return self.code(cursor, table, id_column, value)
+
+    def location(self, cursor, address: Optional[str]) -> Optional[int]:
+        table, id_column = LOCATIONS
+        return self.code(cursor, table, id_column, normalize_address(address), name_column='address')
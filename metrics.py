@@ -0,0 +1,373 @@
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single development process, nothing to lock against
+    fcntl = None
+
+# Where each process writes its metrics for /metrics to merge. The default is
+# computed once in the process that imports this module, so workers forked
+# from one master share it.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(),
+                                                         f'demicstech_metrics_{os.getpid()}'))
+
+# Seconds between a process's metric snapshots; /metrics lags other workers by at most this
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Counters and histograms of exited workers, summed, so merged totals never go down
+DEAD_WORKERS_FILE = 'dead.json'
+
+# Upper bounds (seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    """
+    A named metric with one value per combination of label values
+    shared metrics are summed over every process when exported; others are
+    reported by the exporting process alone (e.g. a queue depth it reads
+    from the database, which every worker would otherwise count again).
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), shared: bool = True):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.shared = shared
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[list]:
+        """[[label values, value], ...], in a JSON-friendly form"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down; function, if given, is read at every snapshot"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), shared: bool = True,
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames, shared)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[list]:
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                print(f"Metric {self.name} unavailable: {e}")
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets; each value is [bucket counts..., sum, count]"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+
+class Registry:
+    """
+    The metrics of this process, and their export across worker processes
+    Every process keeps its metrics in memory and periodically writes a
+    snapshot to METRICS_DIR/<pid>.json. export() merges the snapshots of the
+    live processes (its own taken fresh) by summing values per label set.
+    Counters and histograms must never go down across the server, even as
+    gunicorn recycles workers, or Prometheus would read a counter reset and
+    rate() would spike. So an exiting worker folds its final values into
+    DEAD_WORKERS_FILE (retire()), and export() does the same with the last
+    snapshot of any worker that died without retiring. Gauges of exited
+    workers are dropped.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, Metric] = {}
+        self._flush_hooks: List[Callable[[], None]] = []
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = (), shared: bool = True,
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, shared, function))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def on_flush(self, hook: Callable[[], None]):
+        """Also call hook on every flush, e.g. to snapshot other per-process statistics"""
+        self._flush_hooks.append(hook)
+
+    def reset(self):
+        """Forget every value, e.g. in a freshly forked worker"""
+        for metric in self._metrics.values():
+            metric.reset()
+        self._flushed_at = 0.0
+
+    def snapshot(self, shared_only: bool = False) -> Dict[str, List]:
+        return {name: metric.samples() for name, metric in self._metrics.items()
+                if metric.shared or not shared_only}
+
+    def flush(self):
+        """Write this process's shared metrics for other workers to export"""
+        write_snapshot(self.directory, self.snapshot(shared_only=True))
+        for hook in self._flush_hooks:
+            hook()
+        self._flushed_at = time.time()
+
+    def maybe_flush(self):
+        """flush() if the last one was more than flush_interval ago; cheap enough to call per request"""
+        if time.time() - self._flushed_at < self.flush_interval:
+            return
+        with self._lock:
+            if time.time() - self._flushed_at >= self.flush_interval:
+                try:
+                    self.flush()
+                except OSError as e:
+                    self._flushed_at = time.time()
+                    print(f"Metrics flush failed: {e}")
+
+    def _accumulates(self, name: str) -> bool:
+        return isinstance(self._metrics.get(name), (Counter, Histogram))
+
+    def _fold_dead(self, snapshots: List[Dict]):
+        """Add exited workers' counters and histograms to DEAD_WORKERS_FILE; call under _directory_lock"""
+        path = os.path.join(self.directory, DEAD_WORKERS_FILE)
+        dead = {}
+        for snapshot in [_read_json(path) or {}] + snapshots:
+            merge_snapshot(dead, {name: samples for name, samples in snapshot.items() if self._accumulates(name)})
+        write_json(path, {name: [[list(key), value] for key, value in values.items()]
+                          for name, values in dead.items()})
+
+    def retire(self):
+        """Fold this process's final values into the exited workers' totals, e.g. in gunicorn's worker_exit"""
+        with _directory_lock(self.directory):
+            self._fold_dead([self.snapshot(shared_only=True)])
+            try:
+                os.remove(os.path.join(self.directory, f'{os.getpid()}.json'))
+            except FileNotFoundError:
+                pass
+
+    def export(self) -> str:
+        """Every process's metrics, merged, in the Prometheus text exposition format"""
+        with _directory_lock(self.directory):
+            dead_snapshots = []
+            live_snapshots = read_worker_snapshots(self.directory, dead_snapshots)
+            if dead_snapshots:
+                self._fold_dead(dead_snapshots)
+            dead = _read_json(os.path.join(self.directory, DEAD_WORKERS_FILE))
+
+        merged = {}
+        for snapshot in [self.snapshot()] + live_snapshots + ([dead] if dead else []):
+            merge_snapshot(merged, snapshot)
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            values = merged.get(name, {})
+            if not values and not metric.labelnames and isinstance(metric, Counter):
+                # Present from the start, so rate() has a baseline before the first event
+                values = {(): 0}
+            for key, value in sorted(values.items()):
+                labels = list(zip(metric.labelnames, key))
+                if isinstance(metric, Histogram):
+                    cumulative = value[:len(metric.buckets)] + [value[-1]]
+                    bounds = [_number(bound) for bound in metric.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, cumulative):
+                        lines.append(f"{name}_bucket{_labels(labels + [('le', bound)])} {_number(count)}")
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+                    lines.append(f'{name}_count{_labels(labels)} {_number(value[-1])}')
+                else:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge_snapshot(merged: Dict[str, Dict], snapshot: Dict[str, List]):
+    """Sum snapshot's samples into merged ({name: {label values: value}})"""
+    for name, samples in snapshot.items():
+        values = merged.setdefault(name, {})
+        for labels, value in samples:
+            key = tuple(labels)
+            if key not in values:
+                values[key] = value
+            elif isinstance(value, list):
+                values[key] = [a + b for a, b in zip(values[key], value)]
+            else:
+                values[key] += value
+
+
+def write_json(path: str, data):
+    """Atomically replace path with data as JSON"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def write_snapshot(directory: str, data):
+    """Atomically write this process's snapshot to directory/<pid>.json"""
+    os.makedirs(directory, exist_ok=True)
+    write_json(os.path.join(directory, f'{os.getpid()}.json'), data)
+
+
+def read_worker_snapshots(directory: str, dead: Optional[List] = None) -> List:
+    """
+    Snapshots of the other live processes in directory. Those of exited
+    ones are removed, after being appended to dead if it is given.
+    """
+    snapshots = []
+    if not os.path.isdir(directory):
+        return snapshots
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json') or not filename[:-5].isdigit():
+            continue
+        pid = int(filename[:-5])
+        path = os.path.join(directory, filename)
+        if pid == os.getpid():
+            continue
+        if not _alive(pid):
+            if dead is not None:
+                snapshot = _read_json(path)
+                if snapshot is not None:
+                    dead.append(snapshot)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Missing, or exited while being replaced
+        return None
+
+
+@contextlib.contextmanager
+def _directory_lock(directory: str):
+    """Exclusive lock over directory's snapshots, so exited workers are folded in exactly once"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels: List[tuple]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+# Values inherited from the parent would be counted again by every worker
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+REQUESTS = REGISTRY.counter('demicstech_http_requests_total', 'HTTP requests handled',
+                            ('method', 'route', 'status'))
+ERRORS = REGISTRY.counter('demicstech_http_errors_total', 'HTTP requests answered with a 4xx or 5xx status',
+                          ('method', 'route'))
+REQUEST_SECONDS = REGISTRY.histogram('demicstech_http_request_duration_seconds', 'HTTP request latency',
+                                     ('method', 'route'))
+SECTION_SECONDS = REGISTRY.histogram('demicstech_section_duration_seconds',
+                                     'Time spent in analyzer, ingestion and geocoding calls', ('section',))
+INGESTED_ROWS = REGISTRY.counter('demicstech_ingested_rows_total',
+                                 'Rows written by ingestion; rate() gives rows per second', ('table',))
+GEOCODER_CALLS = REGISTRY.counter('demicstech_geocoder_calls_total', 'Geocoder lookups by outcome',
+                                  ('outcome',))
+CACHE_REQUESTS = REGISTRY.counter('demicstech_cache_requests_total',
+                                  'Lookups answered (hit) or not (miss) by each cache', ('cache', 'result'))
+SQLITE_BUSY = REGISTRY.counter('demicstech_sqlite_busy_total',
+                               'Writes that failed because the database was locked')
+SQLITE_RETRIES = REGISTRY.counter('demicstech_sqlite_retries_total', 'Writes retried after the database was locked')
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Dict, List
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+joblib = lazy_import('joblib')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get('HOTSPOT_MODEL_PATH', os.path.join(BASE_DIR, 'tb_hotspot_model.pkl'))
+SCALER_PATH = os.environ.get('HOTSPOT_SCALER_PATH', os.path.join(BASE_DIR, 'scaler.pkl'))
+
+# Per-area features in the column order the model is assumed to take. The
+# shipped .pkl files are empty placeholders, so this schema is not checked
+# against a trained model; a real one must be trained on these columns.
+FEATURE_COLUMNS = [
+    'positive_cases',
+    'total_tests',
+    'positivity_rate',
+    'recent_positive',
+    'previous_positive',
+    'growth_ratio',
+    'active_days'
+]
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised when the model or scaler files are missing or cannot be loaded"""
+
+
+def _load_artifact(path: str):
+    """Load a pickled artifact, memory-mapping its arrays"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        raise ModelUnavailableError(f"Model artifact not found or empty: {path}")
+
+    try:
+        # Arrays in joblib dumps are mapped read-only instead of copied,
+        # so forked workers share one copy of the model in memory; plain
+        # pickles load too
+        return joblib.load(path, mmap_mode='r')
+    except Exception as e:
+        raise ModelUnavailableError(f"Could not load {path}: {e}")
+
+
+class HotspotModel:
+    """Lazily loaded hotspot risk model and its feature scaler"""
+
+    def __init__(self, model_path: str = MODEL_PATH, scaler_path: str = SCALER_PATH):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self._model = None
+        self._scaler = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the model and scaler on first use; later calls are free"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    scaler = _load_artifact(self.scaler_path)
+                    self._model = _load_artifact(self.model_path)
+                    self._scaler = scaler
+        return self._model, self._scaler
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def score(self, features: np.ndarray) -> np.ndarray:
+        """Score a (n_areas, n_features) matrix in one batch, returning risk per row"""
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim != 2 or features.shape[1] != len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected a matrix with {len(FEATURE_COLUMNS)} feature columns")
+        if len(features) == 0:
+            return np.empty(0)
+
+        model, scaler = self.load()
+        scaled = scaler.transform(features)
+        if hasattr(model, 'predict_proba'):
+            # Probability of the positive (hotspot) class
+            return model.predict_proba(scaled)[:, -1]
+        return np.asarray(model.predict(scaled), dtype=np.float64)
+
+
+def build_area_features(rows: List[Dict]) -> np.ndarray:
+    """Turn per-area aggregate rows into the model's feature matrix"""
+    if not rows:
+        return np.empty((0, len(FEATURE_COLUMNS)))
+
+    raw = np.array([[row[c] or 0 for c in ('positive_cases', 'total_tests', 'recent_positive',
+                                           'previous_positive', 'active_days')] for row in rows],
+                   dtype=np.float64)
+    positive, total, recent, previous, active_days = raw.T
+
+    positivity = np.divide(positive, total, out=np.zeros_like(positive), where=total > 0)
+    growth = np.divide(recent, previous, out=recent.copy(), where=previous > 0)
+
+    return np.column_stack([positive, total, positivity, recent, previous, growth, active_days])
+
+
+# One model per process, shared by every request
+hotspot_model = HotspotModel()
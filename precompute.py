@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from analysis import DiseaseAnalyzer
+from timing import open_connection
+from metrics import CACHE_REQUESTS
+
+# Seconds between precomputation runs
+PRECOMPUTE_INTERVAL = int(os.environ.get('PRECOMPUTE_INTERVAL', 300))
+
+# Stored results older than this are ignored and recomputed on request
+MAX_STALENESS = int(os.environ.get('PRECOMPUTE_MAX_STALENESS', PRECOMPUTE_INTERVAL * 2))
+
+
+def analysis_params(analysis: str, today) -> Dict:
+    """Default parameters each precomputed analysis is run with"""
+    if analysis == 'daily_statistics':
+        return {'date': str(today)}
+    if analysis == 'monthly_statistics':
+        return {'month': today.month, 'year': today.year}
+    if analysis == 'outbreak':
+        # Dated, so a result stored yesterday is not served as today's
+        return {'date': str(today), 'days_window': 7, 'threshold': 2.0}
+    if analysis == 'hotspots':
+        return {'start_date': str(today - timedelta(days=30)), 'end_date': str(today),
+                'radius_km': 5.0, 'min_cases': 3}
+    if analysis == 'forecast':
+        return {'end_date': str(today), 'horizon': 7}
+    raise ValueError(f"Unknown analysis: {analysis}")
+
+
+def run_analysis(analyzer: DiseaseAnalyzer, analysis: str, disease_type: str, params: Dict,
+                 record: bool = True):
+    """
+    Run one analysis with the given parameters
+    record=False leaves hotspot_analysis alone, for callers keeping the result elsewhere
+    """
+    if analysis == 'daily_statistics':
+        return analyzer.generate_daily_statistics(disease_type, params['date'])
+    if analysis == 'monthly_statistics':
+        return analyzer.generate_monthly_statistics(disease_type, params['month'], params['year'])
+    if analysis == 'outbreak':
+        return analyzer.detect_outbreak(disease_type, params['days_window'], params['threshold'],
+                                        params['date'])
+    if analysis == 'hotspots':
+        return analyzer.detect_hotspots(disease_type, params['start_date'], params['end_date'],
+                                        params['radius_km'], params['min_cases'], save=record)
+    if analysis == 'forecast':
+        return analyzer.forecast_cases(params['end_date'], params['horizon'], disease_type)
+    raise ValueError(f"Unknown analysis: {analysis}")
+
+
+PRECOMPUTED_ANALYSES = ['daily_statistics', 'monthly_statistics', 'outbreak', 'hotspots']
+
+
+class ResultStore:
+    """Timestamped analysis results kept in the precomputed_results table"""
+
+    def __init__(self, db_path='demicstech.db'):
+        self.db_path = db_path
+
+    def get_connection(self):
+        conn = open_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def result_key(analysis: str, disease_type: str, params: Dict) -> str:
+        return f"{analysis}:{disease_type}:{json.dumps(params, sort_keys=True)}"
+
+    def save(self, analysis: str, disease_type: str, params: Dict, payload, computed_at: float = None):
+        conn = self.get_connection()
+        conn.execute('''
+        INSERT OR REPLACE INTO precomputed_results
+        (result_key, analysis, disease_type, payload, computed_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (
+            self.result_key(analysis, disease_type, params),
+            analysis,
+            disease_type,
+            json.dumps(payload),
+            computed_at or time.time()
+        ))
+        conn.commit()
+        conn.close()
+
+    def read(self, analysis: str, disease_type: str, params: Dict,
+             max_age: float = MAX_STALENESS) -> Optional[Dict]:
+        """Return {'payload', 'computed_at', 'staleness_seconds'}, or None if missing or too old"""
+        conn = self.get_connection()
+        row = conn.execute(
+            'SELECT payload, computed_at FROM precomputed_results WHERE result_key = ?',
+            (self.result_key(analysis, disease_type, params),)
+        ).fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+        staleness = time.time() - row['computed_at']
+        if staleness > max_age:
+            return None
+        return {
+            'payload': json.loads(row['payload']),
+            'computed_at': row['computed_at'],
+            'staleness_seconds': round(staleness, 1)
+        }
+
+
+class PrecomputeScheduler:
+    """
+    Recomputes the default dashboard analyses for every disease on a fixed
+    cadence and saves them to the ResultStore, so API reads never wait on them
+    """
+
+    def __init__(self, db_path='demicstech.db', interval: int = PRECOMPUTE_INTERVAL,
+                 diseases: Optional[List[str]] = None):
+        self.db_path = db_path
+        self.interval = interval
+        self.diseases = diseases
+        self.analyzer = DiseaseAnalyzer(db_path=db_path)
+        self.store = ResultStore(db_path)
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_diseases(self) -> List[str]:
+        if self.diseases:
+            return self.diseases
+        conn = self.analyzer.get_connection()
+        rows = conn.execute('SELECT DISTINCT disease_type FROM test_results').fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+    def run_once(self) -> int:
+        """Precompute every analysis for every disease; returns how many were stored"""
+        today = datetime.now().date()
+        stored = 0
+
+        for disease_type in self.get_diseases():
+            for analysis in PRECOMPUTED_ANALYSES:
+                params = analysis_params(analysis, today)
+                try:
+                    # Kept in the ResultStore, so repeated runs do not pile up in hotspot_analysis
+                    payload = run_analysis(self.analyzer, analysis, disease_type, params, record=False)
+                    self.store.save(analysis, disease_type, params, payload)
+                    stored += 1
+                except Exception as e:
+                    print(f"Precompute error ({analysis}, {disease_type}): {e}")
+
+        self.last_run = time.time()
+        return stored
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.time()
+            self.run_once()
+            self._stop.wait(max(0, self.interval - (time.time() - started)))
+
+    def start(self):
+        """Run in a daemon thread inside the current process"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='precompute', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def serve_analysis(store: ResultStore, analyzer: DiseaseAnalyzer, analysis: str,
+                   disease_type: str, params: Dict) -> tuple:
+    """
+    Return (result, freshness) for an analysis, preferring a precomputed result
+    within the staleness bound and computing it live otherwise
+    """
+    stored = store.read(analysis, disease_type, params)
+    CACHE_REQUESTS.inc(cache='precomputed', result='miss' if stored is None else 'hit')
+    if stored is not None:
+        return stored['payload'], {
+            'source': 'precomputed',
+            'computed_at': datetime.fromtimestamp(stored['computed_at']).isoformat(timespec='seconds'),
+            'staleness_seconds': stored['staleness_seconds'],
+            'max_staleness_seconds': MAX_STALENESS
+        }
+
+    result = run_analysis(analyzer, analysis, disease_type, params)
+    return result, {
+        'source': 'live',
+        'computed_at': datetime.now().isoformat(timespec='seconds'),
+        'staleness_seconds': 0,
+        'max_staleness_seconds': MAX_STALENESS
+    }
+
+
+def run_worker(db_path: str, precompute: bool = True):
+    """
+    Dedicated background process: make sure the schema is current, then run
+    queued analysis jobs and, unless precompute is False, the precompute loop
+    """
+    from create_db import ensure_database
+    from jobs import JobRunner
+
+    ensure_database(db_path)
+    runner = JobRunner(db_path=db_path)
+
+    try:
+        if precompute:
+            scheduler = PrecomputeScheduler(db_path=db_path)
+            print(f"⏱️ Precomputing analytics every {scheduler.interval}s for {db_path}")
+            runner.start()
+            scheduler.run_forever()
+        else:
+            print(f"⏱️ Running analysis jobs for {db_path}")
+            runner.run_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Precompute worker stopped")
+    finally:
+        runner.stop(wait=False)
+
+
+if __name__ == "__main__":
+    # Standalone worker: python precompute.py [--jobs-only]
+    import sys
+
+    run_worker(os.environ.get('DATABASE_PATH', 'demicstech.db'), precompute='--jobs-only' not in sys.argv[1:])
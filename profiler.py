@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from metrics import METRICS_DIR
+
+# Seconds between stack samples of a whole worker
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+
+# Seconds between samples of a single profiled request, which is usually short
+REQUEST_PROFILE_INTERVAL = 0.001
+
+# Longest a worker may be profiled in one go
+MAX_PROFILE_SECONDS = 60
+
+# Where per-request profiles are kept, shared by every worker
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(METRICS_DIR, 'profiles'))
+PROFILES_KEPT = 50
+
+# Innermost Python functions of threads that are waiting rather than working
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'accept', 'sleep', '_wait_for_tstate_lock', 'readinto'}
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of running threads from a background thread
+    Each sample reads every thread's current frame (sys._current_frames) and
+    counts its call stack, so the profiled code runs unmodified; the cost is
+    one stack walk per thread per interval, all in the sampler. Threads
+    whose innermost function is a wait (IDLE_FUNCTIONS) are skipped unless
+    include_idle is set. collapsed() gives 'outer;...;inner count' lines,
+    the input of flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, thread_ids: Optional[Iterable[int]] = None,
+                 include_idle: bool = False, exclude: Iterable[int] = ()):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.include_idle = include_idle
+        self.exclude = set(exclude)
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'StackSampler':
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='stack-sampler')
+        self._thread.start()
+        return self
+
+    def stop(self) -> 'StackSampler':
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self._sample(own)
+
+    def _sample(self, own: int):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or thread_id in self.exclude:
+                continue
+            if self.thread_ids is not None and thread_id not in self.thread_ids:
+                continue
+            if not self.include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            # Code objects are counted as is; names are only built once, in collapsed()
+            self._stacks[tuple(reversed(codes))] += 1
+        self.samples += 1
+
+    def stacks(self) -> Counter:
+        """Sample count per stack, as 'outer;...;inner' strings"""
+        collapsed = Counter()
+        for codes, count in self._stacks.items():
+            collapsed[';'.join(_frame_name(code) for code in codes)] += count
+        return collapsed
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks().most_common())
+
+    def summary(self, top: int = 20) -> dict:
+        """Profile as JSON: the busiest stacks and the functions most often running (self samples)"""
+        stacks = self.stacks()
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            'duration_seconds': round(self.duration, 3),
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'top_functions': [{'function': name, 'samples': count} for name, count in leaves.most_common(top)],
+            'top_stacks': [{'stack': stack, 'samples': count} for stack, count in stacks.most_common(top)]
+        }
+
+
+def profile_worker(seconds: float, interval: float = PROFILE_INTERVAL, include_idle: bool = False) -> StackSampler:
+    """Sample every other thread of this process for seconds, blocking the caller meanwhile"""
+    seconds = min(float(seconds), MAX_PROFILE_SECONDS)
+    sampler = StackSampler(interval, include_idle=include_idle, exclude=[threading.get_ident()]).start()
+    time.sleep(seconds)
+    return sampler.stop()
+
+
+def save_profile(profile_id: str, collapsed: str):
+    """Keep a request's profile for any worker to serve, dropping the oldest beyond PROFILES_KEPT"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded'), 'w') as f:
+        f.write(collapsed)
+
+    profiles = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.folded')),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-PROFILES_KEPT]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def load_profile(profile_id: str) -> Optional[str]:
+    if not profile_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded')) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib.parse import quote
+
+from metrics import REGISTRY
+from timing import open_connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single development process, nothing to lock against
+    fcntl = None
+
+# Where analytics read from: 'off' (the primary database), 'file' (one copy
+# shared by every worker; 'on' means this too) or 'memory' (a copy per process)
+READ_REPLICA = os.environ.get('READ_REPLICA', 'off').lower()
+
+# Seconds a replica may trail the primary before a read refreshes it first
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 60))
+
+REPLICA_REFRESH_FAILURES = REGISTRY.counter('demicstech_replica_refresh_failures_total',
+                                            'Read replica refreshes that failed')
+REPLICA_FALLBACKS = REGISTRY.counter('demicstech_replica_fallback_reads_total',
+                                     'Reads sent to the primary because the replica was stale')
+
+
+def default_replica_path(db_path: str) -> str:
+    return os.environ.get('REPLICA_PATH', os.path.splitext(db_path)[0] + '_replica.db')
+
+
+class ReadReplica:
+    """
+    Point-in-time copy of the primary database for long analytical reads
+    Each refresh copies the primary with SQLite's online backup API in a
+    single step (a stepped copy restarts whenever the primary is written to,
+    so under steady ingest it may never finish) into a new generation: a
+    file that atomically replaces the previous one, or a fresh shared
+    in-memory database. The primary is in WAL mode (ensure_database), so
+    the copy reads a snapshot and ingest keeps committing while it runs.
+    Connections opened earlier keep reading the generation they started
+    on, so every read sees one consistent snapshot.
+
+    The file is shared by every worker and only one process copies at a
+    time; memory mode holds a full copy in each process, so it suits a
+    single process only. Only a background thread copies, every
+    max_lag / 2, so requests never wait for one; a read that finds the
+    replica older than max_lag reads the primary rather than a stale copy.
+    """
+
+    def __init__(self, db_path='demicstech.db', mode: str = 'file', max_lag: float = REPLICA_MAX_LAG,
+                 path: Optional[str] = None):
+        if mode not in ('memory', 'file'):
+            raise ValueError(f"Unknown replica mode: {mode}")
+        self.db_path = db_path
+        self.mode = mode
+        self.max_lag = max_lag
+        self.path = path or default_replica_path(db_path)
+        self.refreshed_at = 0.0
+        self.last_error = None
+        self._generation = 0
+        self._uri = None
+        # Keeps the current in-memory generation alive between reads
+        self._anchor = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def lag(self) -> float:
+        """Seconds since the current replica was copied"""
+        if self.mode == 'file':
+            # Shared by every process using this file; refresh() stamps the copy time
+            try:
+                return time.time() - os.path.getmtime(self.path)
+            except OSError:
+                return float('inf')
+        return time.time() - self.refreshed_at
+
+    def refresh(self) -> float:
+        """Copy the primary into a new replica generation; returns seconds taken"""
+        started = time.time()
+        try:
+            if self.mode == 'memory':
+                self._refresh_memory()
+            else:
+                self._refresh_file(started)
+        except Exception as e:
+            self.last_error = f'{type(e).__name__}: {e}'
+            REPLICA_REFRESH_FAILURES.inc()
+            raise
+        self.last_error = None
+        self.refreshed_at = started
+        return time.time() - started
+
+    def _refresh_memory(self):
+        self._generation += 1
+        uri = f'file:replica_{os.getpid()}_{id(self)}_{self._generation}?mode=memory&cache=shared'
+        target = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(self.db_path)
+        try:
+            source.backup(target)
+        except Exception:
+            target.close()
+            raise
+        finally:
+            source.close()
+        previous, self._anchor, self._uri = self._anchor, target, uri
+        if previous is not None:
+            # Freed once the last reader of that generation closes
+            previous.close()
+
+    def _refresh_file(self, started: float):
+        with open(f'{self.path}.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have copied while this one waited
+            if time.time() - self.lag >= started:
+                return
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            source = sqlite3.connect(self.db_path)
+            target = sqlite3.connect(tmp)
+            try:
+                source.backup(target)
+                # The copy carries the primary's WAL flag; a read-only file needs none
+                target.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                target.close()
+                source.close()
+            os.utime(tmp, (started, started))
+            os.replace(tmp, self.path)
+
+    def connect(self):
+        """Read-only connection to a replica no older than max_lag"""
+        self._start_refresher()
+        if self.lag > self.max_lag:
+            # The refresher is behind or failing; it, not this request, copies
+            REPLICA_FALLBACKS.inc()
+            conn = open_connection(self.db_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        if self.mode == 'memory':
+            conn = open_connection(self._uri, uri=True)
+        else:
+            conn = open_connection(f'file:{quote(os.path.abspath(self.path))}?mode=ro', uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _start_refresher(self):
+        # Also restarts it in a forked worker, where the parent's thread does not exist
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._refresh_forever, daemon=True,
+                                                name='replica-refresh')
+                self._thread.start()
+
+    def _refresh_forever(self):
+        while not self._stop.wait(self.max_lag / 2):
+            try:
+                with self._lock:
+                    if self.lag > self.max_lag / 2:
+                        self.refresh()
+            except Exception as e:
+                print(f"Replica refresh error: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def read_replica(db_path: str) -> Optional[ReadReplica]:
+    """The ReadReplica configured by READ_REPLICA, or None when it is off"""
+    if READ_REPLICA in ('', 'off', 'false', 'none'):
+        return None
+    return ReadReplica(db_path, mode='file' if READ_REPLICA in ('on', 'true') else READ_REPLICA)
@@ -0,0 +1,325 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+
+from archive import ArchiveRouter, latest_result_id
+from lookups import PATIENTS_TABLE
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+try:
+    import fcntl
+except ImportError:  # Windows; only one writer process is expected there
+    fcntl = None
+
+# Day 0 of every series and the number of days each file holds (2000-2049)
+EPOCH = date(2000, 1, 1)
+CAPACITY_DAYS = (date(2050, 1, 1) - EPOCH).days
+
+# Rows of each series file
+TOTAL, POSITIVE, NEGATIVE = 0, 1, 2
+SERIES_ROWS = 3
+
+# Per-area series use geohash cells at the forecasting area precision
+# (forecasting.AREA_PRECISION)
+AREA_PRECISION = 4
+
+# Area name used for cases whose patient has no coordinates
+UNLOCATED = '_'
+
+SYNC_BATCH = 5000
+
+
+def default_series_dir(db_path: str) -> str:
+    return os.environ.get('SERIES_STORE_DIR', os.path.splitext(db_path)[0] + '_series')
+
+
+def latest_patient_seq(conn) -> int:
+    """Highest patients updated_seq, bumped whenever a patient's location changes"""
+    return conn.execute(f'SELECT MAX(updated_seq) FROM {PATIENTS_TABLE}').fetchone()[0] or 0
+
+
+def day_offset(value) -> int:
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').date()
+    return (value - EPOCH).days
+
+
+class _FileLock:
+    """Exclusive lock shared by every process writing to one series directory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        # A fresh descriptor each time, so threads of one process exclude each other too
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class DailySeriesStore:
+    """
+    Dense daily total/positive/negative test counts, one fixed-width .npy file
+    per disease and per disease x area, indexed by days since EPOCH
+    Files are memory-mapped, so readers get zero-copy views and every
+    process sees writes as soon as they land. The store tracks the highest
+    result_id it has counted; sync() counts anything newer, so rows written
+    by any path (the API, scripts, bulk loads) are picked up. Each sync
+    records the range it is counting before it starts, so one interrupted
+    partway is recounted on the next sync instead of counted twice.
+    Patients whose location changed since the last sync have the days of
+    their counted results recounted, moving those results to their new area.
+    """
+
+    def __init__(self, db_path='demicstech.db', directory: Optional[str] = None,
+                 areas: bool = True):
+        self.db_path = db_path
+        self.directory = directory or default_series_dir(db_path)
+        self.areas = areas
+        self._maps = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # Layout
+
+    def _path(self, disease_type: str, area: Optional[str] = None) -> str:
+        name = quote(disease_type, safe='')
+        if area is None:
+            return os.path.join(self.directory, f'{name}.npy')
+        return os.path.join(self.directory, name, f'{area}.npy')
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, 'meta.json')
+
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'max_result_id': 0}
+
+    def _write_meta(self, meta: Dict):
+        tmp = self._meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+    @property
+    def version(self) -> int:
+        """Highest result_id counted so far"""
+        return self._read_meta()['max_result_id']
+
+    def _open(self, path: str, create: bool = False):
+        """Memory-map a series file, creating it (sparse, all zeros) if asked"""
+        with self._lock:
+            series = self._maps.get(path)
+            if series is not None:
+                return series
+            if not os.path.exists(path):
+                if not create:
+                    return None
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.lib.format.open_memmap(path, mode='w+', dtype=np.int32,
+                                          shape=(SERIES_ROWS, CAPACITY_DAYS)).flush()
+            series = self._maps[path] = np.load(path, mmap_mode='r+')
+            return series
+
+    # Writing
+
+    def sync(self) -> int:
+        """Count test results added since the last sync; returns how many"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            latest = latest_result_id(conn)
+            patient_seq = latest_patient_seq(conn)
+            meta = self._read_meta()
+            if latest <= meta['max_result_id'] and patient_seq <= meta.get('patient_seq', 0):
+                return 0
+
+            with _FileLock(os.path.join(self.directory, '.lock')):
+                # Another process may have synced while we waited for the lock
+                meta = self._read_meta()
+                # Routed, so rows archived before this sync are still counted
+                routed = ArchiveRouter(self.db_path).connect()
+                counted = 0
+                try:
+                    pending = meta.pop('pending', None)
+                    if pending:
+                        # An earlier sync stopped partway through this range
+                        self._recount(routed, *pending)
+                        meta['max_result_id'] = pending[1]
+                    if patient_seq > meta.get('patient_seq', 0):
+                        # Recounting is idempotent, so a crash here just repeats it
+                        self._recount_moved(routed, meta.get('patient_seq', 0), meta['max_result_id'])
+                        meta['patient_seq'] = patient_seq
+                    if latest <= meta['max_result_id']:
+                        self._write_meta(meta)
+                        return 0
+
+                    # Recorded before counting, so a crash leaves a range to recount
+                    meta['pending'] = [meta['max_result_id'], latest]
+                    self._write_meta(meta)
+                    counted = self._count(routed, meta['max_result_id'], latest)
+                finally:
+                    routed.close()
+
+                del meta['pending']
+                meta['max_result_id'] = latest
+                self._write_meta(meta)
+                return counted
+        finally:
+            conn.close()
+
+    def _count(self, routed, low: int, high: int, where: str = '', params=()) -> int:
+        """Add results with low < result_id <= high (and matching where) to the series"""
+        cursor = routed.execute(f'''
+        SELECT tr.result_id, tr.disease_type, tr.test_date, tr.test_result,
+               substr(p.geohash, 1, ?)
+        FROM test_results tr
+        LEFT JOIN patients p ON tr.patient_id = p.patient_id
+        WHERE tr.result_id > ? AND tr.result_id <= ? {where}
+        ''', (AREA_PRECISION, low, high, *params))
+
+        counted = 0
+        while True:
+            rows = cursor.fetchmany(SYNC_BATCH)
+            if not rows:
+                return counted
+            counted += self._add(rows)
+
+    def _recount(self, routed, low: int, high: int):
+        """
+        Recount from scratch every day that results low < result_id <= high
+        fall on, up to high; an interrupted sync may have added some of them
+        """
+        self._recount_days(routed, routed.execute(
+            'SELECT DISTINCT disease_type, test_date FROM test_results '
+            'WHERE result_id > ? AND result_id <= ?', (low, high)), high)
+
+    def _recount_moved(self, routed, seq: int, high: int):
+        """
+        Recount, up to high, every day with a result of a patient whose
+        location changed after updated_seq seq
+        """
+        self._recount_days(routed, routed.execute(f'''
+        SELECT DISTINCT disease_type, test_date FROM test_results
+        WHERE result_id <= ?
+          AND patient_id IN (SELECT patient_id FROM {PATIENTS_TABLE} WHERE updated_seq > ?)
+        ''', (high, seq)), high)
+
+    def _recount_days(self, routed, pairs, high: int):
+        """Zero and recount, from results up to high, each (disease_type, test_date)"""
+        days = {}
+        for disease_type, test_date in pairs:
+            try:
+                day = day_offset(test_date)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= day < CAPACITY_DAYS:
+                days.setdefault(disease_type, {}).setdefault(day, []).append(test_date)
+
+        for disease_type, dates in days.items():
+            index = np.array(sorted(dates), dtype=np.intp)
+            paths = [self._path(disease_type)]
+            if self.areas:
+                paths += [self._path(disease_type, area) for area in self.areas_for(disease_type)]
+            for path in paths:
+                series = self._open(path)
+                if series is not None:
+                    series[:, index] = 0
+                    series.flush()
+
+            values = [value for values in dates.values() for value in values]
+            for start in range(0, len(values), SYNC_BATCH):
+                batch = values[start:start + SYNC_BATCH]
+                self._count(routed, 0, high,
+                            f"AND tr.disease_type = ? AND tr.test_date IN ({', '.join('?' * len(batch))})",
+                            (disease_type, *batch))
+
+    def _add(self, rows) -> int:
+        """Add (result_id, disease_type, test_date, test_result, area) rows to the series"""
+        grouped = {}
+        for _, disease_type, test_date, test_result, area in rows:
+            try:
+                day = day_offset(test_date)
+            except (TypeError, ValueError):
+                continue
+            if not 0 <= day < CAPACITY_DAYS:
+                continue
+            row = POSITIVE if test_result == 'Positive' else NEGATIVE if test_result == 'Negative' else None
+            keys = [(disease_type, None)]
+            if self.areas:
+                keys.append((disease_type, area or UNLOCATED))
+            for key in keys:
+                grouped.setdefault(key, []).append((day, row))
+
+        for (disease_type, area), entries in grouped.items():
+            series = self._open(self._path(disease_type, area), create=True)
+            for row, days in ((TOTAL, [day for day, _ in entries]),
+                              (POSITIVE, [day for day, r in entries if r == POSITIVE]),
+                              (NEGATIVE, [day for day, r in entries if r == NEGATIVE])):
+                np.add.at(series[row], np.array(days, dtype=np.intp), 1)
+            series.flush()
+        return len(rows)
+
+    def rebuild(self) -> int:
+        """Recount every series from test_results"""
+        with _FileLock(os.path.join(self.directory, '.lock')):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith('.npy'):
+                        # Zeroed in place so readers' existing maps stay valid
+                        self._open(os.path.join(root, name))[:] = 0
+            self._write_meta({'max_result_id': 0})
+        return self.sync()
+
+    # Reading
+
+    def series(self, disease_type: str, area: Optional[str] = None):
+        """Read-only (SERIES_ROWS, CAPACITY_DAYS) view of one series, or None if it has no data"""
+        series = self._open(self._path(disease_type, area))
+        if series is None:
+            return None
+        view = series.view()
+        view.flags.writeable = False
+        return view
+
+    def window(self, disease_type: str, start_date, end_date, area: Optional[str] = None):
+        """(SERIES_ROWS, days) counts for start_date..end_date inclusive, zero-copy when possible"""
+        start, end = day_offset(start_date), day_offset(end_date)
+        if start < 0 or end >= CAPACITY_DAYS:
+            raise ValueError(f"Dates must fall between {EPOCH} and {EPOCH + timedelta(days=CAPACITY_DAYS - 1)}")
+        series = self.series(disease_type, area)
+        if series is None:
+            return np.zeros((SERIES_ROWS, max(0, end - start + 1)), dtype=np.int32)
+        return series[:, start:end + 1]
+
+    def areas_for(self, disease_type: str) -> List[str]:
+        folder = os.path.join(self.directory, quote(disease_type, safe=''))
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.npy'))
+
+    def diseases(self) -> List[str]:
+        return sorted(unquote(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.npy'))
+
+    def covers(self, start_date, end_date) -> bool:
+        try:
+            return day_offset(start_date) >= 0 and day_offset(end_date) < CAPACITY_DAYS
+        except (TypeError, ValueError):
+            return False
@@ -0,0 +1,180 @@
+"""
+Production server for the DemicsTech API
+
+    python serve.py
+
+Runs api.app under gunicorn with several worker processes, each with a
+thread pool. The app (pandas, numpy, geopy, the model and the warmed caches)
+is loaded once in the master before forking, so workers share that memory
+copy-on-write instead of each importing it again.
+
+Environment:
+    PORT                   port to bind (default 5000)
+    WEB_CONCURRENCY        worker processes (default: as many as fit in memory, at most
+                           one per available core; see default_workers)
+    WEB_WORKER_MEMORY_MB   memory budgeted per worker for that default (default 256)
+    WEB_THREADS            threads per worker (default 4)
+    WEB_TIMEOUT            seconds before a silent worker is restarted (default 120)
+    WEB_GRACEFUL_TIMEOUT   seconds in-flight requests get on shutdown (default 30)
+    WEB_MAX_REQUESTS       recycle a worker after this many requests, 0 = never (default 1000)
+    PRECOMPUTE_IN_PROCESS  also run the precompute scheduler in the background process
+
+Background analysis jobs are run by one dedicated background process
+(precompute.py), which also runs the precompute scheduler when asked to.
+"""
+import gc
+import os
+import shutil
+import subprocess
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # e.g. on Windows; fall back to the development server
+    BaseApplication = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Memory each worker is assumed to need on top of what it shares with the master
+WORKER_MEMORY_MB = int(os.environ.get('WEB_WORKER_MEMORY_MB', 256))
+
+# Workers started when the memory available cannot be determined
+FALLBACK_WORKERS = 2
+
+
+def available_cores() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_mb() -> int:
+    """Memory this process may use: its cgroup limit if it has one, else physical memory; 0 if unknown"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # 'max', or a huge number in cgroup v1, means no limit
+        if limit.isdigit() and int(limit) < 1 << 60:
+            return int(limit) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def default_workers() -> int:
+    """
+    Workers that fit in memory alongside the master (which is budgeted as one
+    more), capped at one per core, so a small instance is not forked into
+    running out of memory
+    """
+    memory = available_memory_mb()
+    if not memory:
+        return min(FALLBACK_WORKERS, available_cores())
+    return max(1, min(memory // WORKER_MEMORY_MB - 1, available_cores()))
+
+
+def server_options() -> dict:
+    threads = int(os.environ.get('WEB_THREADS', 4))
+    return {
+        'bind': f"0.0.0.0:{os.environ.get('PORT', 5000)}",
+        'workers': int(os.environ.get('WEB_CONCURRENCY') or default_workers()),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'timeout': int(os.environ.get('WEB_TIMEOUT', 120)),
+        'graceful_timeout': int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)),
+        'keepalive': 5,
+        'max_requests': int(os.environ.get('WEB_MAX_REQUESTS', 1000)),
+        'max_requests_jitter': 100,
+        'preload_app': True,
+        'accesslog': '-',
+        'when_ready': when_ready,
+        'worker_exit': worker_exit,
+        'on_exit': on_exit,
+    }
+
+
+# Dedicated background process (jobs and precompute), owned by the gunicorn master
+_precompute_process = None
+
+
+def when_ready(server):
+    """Master is bound and about to fork workers"""
+    global _precompute_process
+    import api
+
+    # One job runner and scheduler for the whole server rather than one per
+    # worker, run as the standalone precompute worker so it shares nothing
+    # with the master and outlives worker recycling
+    command = [sys.executable, os.path.join(BASE_DIR, 'precompute.py')]
+    if not api.PRECOMPUTE_IN_PROCESS:
+        command.append('--jobs-only')
+    _precompute_process = subprocess.Popen(command, env={**os.environ, 'DATABASE_PATH': api.DB_PATH})
+    server.log.info("Background process started (pid %s)", _precompute_process.pid)
+
+
+def worker_exit(server, worker):
+    import metrics
+    # Keep this worker's counts in the server's totals after it is gone
+    metrics.REGISTRY.retire()
+
+
+def on_exit(server):
+    import metrics
+    # Per-worker metric snapshots are only meaningful while this server runs
+    shutil.rmtree(metrics.METRICS_DIR, ignore_errors=True)
+
+    if _precompute_process is not None and _precompute_process.poll() is None:
+        _precompute_process.terminate()
+        try:
+            _precompute_process.wait(5)
+        except subprocess.TimeoutExpired:
+            _precompute_process.kill()
+
+
+if BaseApplication is not None:
+    class DemicsTechServer(BaseApplication):
+        """gunicorn application serving an already imported Flask app"""
+
+        def __init__(self, application, options: dict):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main():
+    import api
+
+    api.warm_up()
+
+    if BaseApplication is None:
+        print("⚠️ gunicorn is not installed; falling back to the single-process development server")
+        api.start_background_services()
+        api.app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), threaded=True)
+        return
+
+    options = server_options()
+    print(f"🚀 Serving on {options['bind']} with {options['workers']} workers x "
+          f"{options['threads']} threads")
+
+    # Move everything loaded so far out of the collector's reach, so that
+    # collections in the workers do not touch (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    DemicsTechServer(api.app, options).run()
+
+
+if __name__ == '__main__':
+    main()
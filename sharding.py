@@ -0,0 +1,232 @@
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from archive import ArchiveRouter
+from lookups import PATIENTS_TABLE, TEST_RESULTS_TABLE
+from timing import open_connection
+
+# Set SHARDING=true to store each region's patients and test results in its own file
+SHARDING = os.environ.get('SHARDING', 'false').lower() in ('1', 'true', 'yes')
+
+# Threads used to query shards in parallel
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 8))
+
+# Row ids handed out per shard: shard n numbers its rows from n * SHARD_ID_SPAN + 1,
+# so patient and result ids stay unique across every file
+SHARD_ID_SPAN = 10 ** 12
+
+# Shards, one per geopolitical zone. Hospitals whose state cannot be
+# determined stay in the main database, which is also read as a shard.
+ZONES = ['north_central', 'north_east', 'north_west', 'south_east', 'south_south', 'south_west']
+
+STATE_ZONES = {
+    'Benue': 'north_central', 'FCT': 'north_central', 'Kogi': 'north_central', 'Kwara': 'north_central',
+    'Nasarawa': 'north_central', 'Niger': 'north_central', 'Plateau': 'north_central',
+    'Adamawa': 'north_east', 'Bauchi': 'north_east', 'Borno': 'north_east', 'Gombe': 'north_east',
+    'Taraba': 'north_east', 'Yobe': 'north_east',
+    'Jigawa': 'north_west', 'Kaduna': 'north_west', 'Kano': 'north_west', 'Katsina': 'north_west',
+    'Kebbi': 'north_west', 'Sokoto': 'north_west', 'Zamfara': 'north_west',
+    'Abia': 'south_east', 'Anambra': 'south_east', 'Ebonyi': 'south_east', 'Enugu': 'south_east',
+    'Imo': 'south_east',
+    'Akwa Ibom': 'south_south', 'Bayelsa': 'south_south', 'Cross River': 'south_south',
+    'Delta': 'south_south', 'Edo': 'south_south', 'Rivers': 'south_south',
+    'Ekiti': 'south_west', 'Lagos': 'south_west', 'Ogun': 'south_west', 'Ondo': 'south_west',
+    'Osun': 'south_west', 'Oyo': 'south_west'
+}
+
+# Cities commonly given instead of a state, mostly state capitals
+CITY_STATES = {
+    'Abuja': 'FCT', 'Federal Capital Territory': 'FCT', 'Makurdi': 'Benue', 'Lokoja': 'Kogi',
+    'Ilorin': 'Kwara', 'Lafia': 'Nasarawa', 'Minna': 'Niger', 'Jos': 'Plateau',
+    'Yola': 'Adamawa', 'Maiduguri': 'Borno', 'Jalingo': 'Taraba', 'Damaturu': 'Yobe',
+    'Dutse': 'Jigawa', 'Birnin Kebbi': 'Kebbi', 'Gusau': 'Zamfara',
+    'Umuahia': 'Abia', 'Awka': 'Anambra', 'Onitsha': 'Anambra', 'Abakaliki': 'Ebonyi', 'Owerri': 'Imo',
+    'Uyo': 'Akwa Ibom', 'Yenagoa': 'Bayelsa', 'Calabar': 'Cross River', 'Asaba': 'Delta',
+    'Warri': 'Delta', 'Benin City': 'Edo', 'Port Harcourt': 'Rivers',
+    'Ado-Ekiti': 'Ekiti', 'Ikeja': 'Lagos', 'Abeokuta': 'Ogun', 'Akure': 'Ondo', 'Osogbo': 'Osun',
+    'Ibadan': 'Oyo'
+}
+
+# Longest names first, so 'Cross River' wins over 'Rivers' and 'Birnin Kebbi' over 'Kebbi'
+_PLACE_PATTERN = re.compile(
+    r'\b(' + '|'.join(re.escape(name) for name in sorted({**STATE_ZONES, **CITY_STATES}, key=len, reverse=True))
+    + r')\b', re.IGNORECASE
+)
+_PLACE_STATES = {name.lower(): CITY_STATES.get(name, name) for name in {**STATE_ZONES, **CITY_STATES}}
+
+# Tables written per shard; analytical connections read them as one
+SHARDED_TABLES = ['patients', 'test_results', 'case_cell_counts', 'surveillance_cube']
+
+
+def default_shard_dir(db_path: str) -> str:
+    return os.environ.get('SHARD_DIR', os.path.splitext(db_path)[0] + '_shards')
+
+
+def state_for(location: Optional[str]) -> Optional[str]:
+    """Nigerian state named in a free-text location, e.g. 'Wuse 2, Abuja' -> 'FCT'"""
+    if not location:
+        return None
+    match = _PLACE_PATTERN.search(location)
+    return _PLACE_STATES[match.group(1).lower()] if match else None
+
+
+def zone_for(hospital_data: Dict) -> Optional[str]:
+    """Shard for a hospital: an explicit 'state', else the state found in its location"""
+    state = state_for(hospital_data.get('state')) or state_for(hospital_data.get('location'))
+    return STATE_ZONES.get(state)
+
+
+class ShardRouter:
+    """
+    Spreads patients and test results over one SQLite file per zone
+    Hospitals are catalogued in the main database, each with the zone it
+    writes to; every shard keeps a copy of its own hospitals so joins stay
+    local. Writes for different zones go to different files and never wait
+    on each other. Reads either fan out over every shard in a thread pool
+    (sqlite3 releases the GIL while a query runs) and merge the partial
+    results, or use connect(), which attaches all shards and shadows the
+    sharded tables with TEMP VIEWs over their union.
+    """
+
+    def __init__(self, db_path='demicstech.db', directory: Optional[str] = None,
+                 workers: int = SHARD_WORKERS):
+        self.db_path = db_path
+        self.directory = directory or default_shard_dir(db_path)
+        self.workers = workers
+        self._hospital_zones = {}
+        self._ready = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, zone: Optional[str]) -> str:
+        """File holding a zone's rows; None is the main database"""
+        if zone is None:
+            return self.db_path
+        return os.path.join(self.directory, f'{zone}.db')
+
+    def paths(self) -> List[str]:
+        """The main database followed by every shard created so far"""
+        return [self.db_path] + [self.path(zone) for zone in ZONES if os.path.exists(self.path(zone))]
+
+    # Writing
+
+    def _prepare(self, zone: str) -> str:
+        """Create a zone's file on first use, with its own id range"""
+        path = self.path(zone)
+        with self._lock:
+            if path in self._ready:
+                return path
+            from create_db import ensure_database
+            ensure_database(path, shard=True)
+
+            conn = sqlite3.connect(path)
+            offset = (ZONES.index(zone) + 1) * SHARD_ID_SPAN
+            for table in (PATIENTS_TABLE, TEST_RESULTS_TABLE):
+                # Creating the schema may already have added a zero counter
+                if conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?',
+                                (offset, table)).rowcount == 0:
+                    conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, offset))
+            conn.commit()
+            conn.close()
+            self._ready.add(path)
+            return path
+
+    def register_hospital(self, conn, hospital_id: int, hospital_data: Dict) -> Optional[str]:
+        """
+        Record a new hospital's zone in the main database (through conn, inside
+        the caller's transaction) and copy it into that zone's shard
+        """
+        zone = zone_for(hospital_data)
+        conn.execute('UPDATE hospitals SET shard = ? WHERE hospital_id = ?', (zone, hospital_id))
+        if zone is not None:
+            row = conn.execute('SELECT * FROM hospitals WHERE hospital_id = ?', (hospital_id,)).fetchone()
+            shard = sqlite3.connect(self._prepare(zone))
+            shard.execute(f"INSERT OR REPLACE INTO hospitals ({', '.join(row.keys())}) "
+                          f"VALUES ({', '.join('?' for _ in row)})", tuple(row))
+            shard.commit()
+            shard.close()
+        self._hospital_zones[hospital_id] = zone
+        return zone
+
+    def zone_of(self, hospital_id: int) -> Optional[str]:
+        if hospital_id not in self._hospital_zones:
+            conn = sqlite3.connect(self.db_path)
+            row = conn.execute('SELECT shard FROM hospitals WHERE hospital_id = ?', (hospital_id,)).fetchone()
+            conn.close()
+            self._hospital_zones[hospital_id] = row[0] if row else None
+        return self._hospital_zones[hospital_id]
+
+    def write_path(self, hospital_id: int) -> str:
+        """File a hospital's patients and results are written to"""
+        zone = self.zone_of(hospital_id)
+        return self._prepare(zone) if zone else self.db_path
+
+    # Reading
+
+    def fan_out(self, query: Callable) -> List:
+        """Run query(conn) against every shard in parallel; returns each shard's result"""
+        def run(path):
+            conn = open_connection(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                return query(conn)
+            finally:
+                conn.close()
+
+        paths = self.paths()
+        if len(paths) == 1:
+            return [run(paths[0])]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='shard')
+        # Each query runs in a copy of the caller's context, so it is timed as part of the request
+        contexts = [contextvars.copy_context() for _ in paths]
+        return list(self._executor.map(lambda context, path: context.run(run, path), contexts, paths))
+
+    def connect(self):
+        """Connection to the main database that reads the sharded tables across all shards"""
+        conn = open_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+
+        shards = self.paths()[1:]
+        for path in shards:
+            conn.execute(f'ATTACH DATABASE ? AS shard_{os.path.basename(path)[:-3]}', (path,))
+        if shards:
+            for table in SHARDED_TABLES:
+                # Explicit columns: migrated and freshly created files may order them differently
+                columns = ', '.join(row[1] for row in conn.execute(f'PRAGMA main.table_info({table})'))
+                selects = [f'SELECT {columns} FROM main.{table}']
+                selects += [f'SELECT {columns} FROM shard_{os.path.basename(path)[:-3]}.{table}' for path in shards]
+                conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+        return conn
+
+
+def check_unarchived(db_path: str):
+    """
+    Refuse to shard a database with archived test results: sharded reads
+    span the shard files only, so archived years would silently go missing
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        archived = ArchiveRouter(db_path).partitions(conn)
+    finally:
+        conn.close()
+    if archived:
+        raise RuntimeError(
+            f"SHARDING cannot be enabled for {db_path}: test results up to "
+            f"{max(partition['max_date'] for partition in archived)} are archived, "
+            f"and sharded reads do not include archives"
+        )
+
+
+def shard_router(db_path: str) -> Optional[ShardRouter]:
+    """The ShardRouter for db_path when SHARDING is enabled, else None"""
+    return ShardRouter(db_path) if SHARDING else None
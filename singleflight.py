@@ -0,0 +1,57 @@
+import threading
+from typing import Any, Callable, Hashable, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function and every caller that arrives while it is running waits for and
+    receives the same result (or exception). Nothing is kept once the call
+    finishes, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """Run fn(*args, **kwargs) once per in-flight key; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, call.waiters > 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from metrics import METRICS_DIR, REGISTRY, read_worker_snapshots, write_snapshot
+
+# Statements taking longer than this many milliseconds (execution plus fetching
+# their rows) are logged with their query plan; 0 turns statement tracking off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+# Distinct statements tracked per process; further ones are only checked for slowness
+MAX_TRACKED_STATEMENTS = 1000
+
+SLOW_QUERIES = REGISTRY.counter('demicstech_slow_queries_total', 'Statements slower than SLOW_QUERY_MS')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    One line per statement shape: literals become ?, placeholder lists ?+
+    e.g. "WHERE disease_type IN (?, ?) AND age > 5" -> "WHERE disease_type IN (?+) AND age > ?"
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('?+', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def parameters_shape(parameters, many: bool = False) -> str:
+    """Types of the bound parameters, never their values (which may identify patients)"""
+    if many:
+        return 'executemany'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {type(value).__name__}' for name, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters or ()) + ')'
+
+
+def explain(conn, sql: str, parameters) -> List[str]:
+    """EXPLAIN QUERY PLAN of sql as indented lines; unbound parameters are explained as NULL"""
+    if parameters is None:
+        parameters = (None,) * sql.count('?')
+    # A plain cursor, so explaining is not itself timed and logged
+    rows = conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append('  ' * (depth[node_id] - 1) + detail)
+    return lines
+
+
+class SlowQueryLog:
+    """
+    Per-statement timing statistics and a log of statements over threshold_ms
+    Every statement run through a timing.TimedCursor is counted under its
+    normalized SQL. A slow one is printed as a JSON line with its duration,
+    parameter types and EXPLAIN QUERY PLAN (full table scans are listed
+    separately) and its plan is kept with the statistics. Statistics are
+    per process; flush() snapshots them so top() can merge every worker's.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, directory: Optional[str] = None):
+        self.threshold = threshold_ms / 1000
+        self.directory = directory or os.path.join(METRICS_DIR, 'queries')
+        self._stats: Dict[str, Dict] = {}
+        self._normalized: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _normalize(self, sql: str) -> str:
+        # Statements are mostly the same few string constants, so normalize each once
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = normalize_sql(sql)
+            if len(self._normalized) < MAX_TRACKED_STATEMENTS * 4:
+                self._normalized[sql] = normalized
+        return normalized
+
+    def record(self, conn, sql: str, parameters, seconds: float, many: bool = False):
+        """Count one finished statement; conn (still open) is used to explain it if it was slow"""
+        normalized = self._normalize(sql)
+        slow = seconds >= self.threshold
+
+        entry = None
+        if slow:
+            entry = {'sql': normalized, 'ms': round(seconds * 1000, 3),
+                     'parameters': parameters_shape(parameters, many)}
+            try:
+                entry['plan'] = explain(conn, sql, None if many else parameters)
+                entry['scans'] = [line.strip() for line in entry['plan'] if line.strip().startswith('SCAN')]
+            except sqlite3.Error as e:
+                entry['plan_error'] = str(e)
+            print(json.dumps({'event': 'slow_query', **entry}))
+            SLOW_QUERIES.inc()
+
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                if len(self._stats) >= MAX_TRACKED_STATEMENTS:
+                    return
+                stats = self._stats[normalized] = {'sql': normalized, 'count': 0, 'total_ms': 0.0,
+                                                   'max_ms': 0.0, 'slow_count': 0}
+            ms = seconds * 1000
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            if entry is not None:
+                stats['slow_count'] += 1
+                stats['last_slow'] = {'at': time.time(), **{k: v for k, v in entry.items() if k != 'sql'}}
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [dict(stats) for stats in self._stats.values()]
+
+    def flush(self):
+        """Write this process's statistics for top() in other workers"""
+        write_snapshot(self.directory, self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def top(self, limit: int = 20, sort: str = 'total_ms') -> List[Dict]:
+        """The limit statements with the highest sort value, merged over every live worker"""
+        if sort not in ('total_ms', 'max_ms', 'count', 'slow_count', 'avg_ms'):
+            raise ValueError("sort must be one of: total_ms, max_ms, count, slow_count, avg_ms")
+
+        merged = {}
+        for snapshot in [self.snapshot()] + read_worker_snapshots(self.directory):
+            for stats in snapshot:
+                current = merged.get(stats['sql'])
+                if current is None:
+                    merged[stats['sql']] = dict(stats)
+                    continue
+                current['count'] += stats['count']
+                current['total_ms'] += stats['total_ms']
+                current['max_ms'] = max(current['max_ms'], stats['max_ms'])
+                current['slow_count'] += stats['slow_count']
+                if 'last_slow' in stats and stats['last_slow']['at'] > current.get('last_slow', {}).get('at', 0):
+                    current['last_slow'] = stats['last_slow']
+
+        for stats in merged.values():
+            stats['avg_ms'] = round(stats['total_ms'] / stats['count'], 3)
+            stats['total_ms'] = round(stats['total_ms'], 3)
+            stats['max_ms'] = round(stats['max_ms'], 3)
+        return sorted(merged.values(), key=lambda stats: stats[sort], reverse=True)[:limit]
+
+
+QUERY_LOG = SlowQueryLog()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=QUERY_LOG.reset)
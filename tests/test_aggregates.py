@@ -0,0 +1,80 @@
+from aggregates import rebuild_aggregates
+from create_db import ensure_database
+from data_ingestion import DataIngestion
+from series_store import DailySeriesStore
+
+SUMMARY_TABLES = ('case_cell_counts', 'surveillance_cube')
+
+
+def _case(external_id, lat, lon, age=30, gender='Male', test_date='2024-03-01'):
+    return {
+        'hospital_id': 1,
+        'disease_type': 'Malaria',
+        'test_result': 'Positive',
+        'test_date': test_date,
+        'patient_data': {
+            'hospital_id': 1,
+            'external_patient_id': external_id,
+            'address': 'Abuja',
+            'latitude': lat,
+            'longitude': lon,
+            'age': age,
+            'gender': gender
+        }
+    }
+
+
+def _summaries(conn):
+    return {
+        table: sorted(map(tuple, conn.execute(f'SELECT * FROM {table}')))
+        for table in SUMMARY_TABLES
+    }
+
+
+def _assert_matches_rebuild(ingestion):
+    conn = ingestion.get_connection()
+    incremental = _summaries(conn)
+    rebuild_aggregates(conn.cursor())
+    assert incremental == _summaries(conn)
+    conn.rollback()
+    conn.close()
+
+
+def _ingestion(tmp_path):
+    db_path = str(tmp_path / 'cases.db')
+    ensure_database(db_path)
+    # Results go to the default hospital the new database is created with
+    return DataIngestion(db_path)
+
+
+def test_patient_move_matches_rebuild(tmp_path):
+    ingestion = _ingestion(tmp_path)
+    ingestion.add_test_result(_case('P1', 9.07, 7.40))
+    ingestion.add_test_result(_case('P2', 9.07, 7.40))
+    # P1 moves to Lagos with a second result; their first one must move too
+    ingestion.add_test_result(_case('P1', 6.52, 3.38, test_date='2024-03-02'))
+
+    _assert_matches_rebuild(ingestion)
+
+
+def test_patient_details_change_matches_rebuild(tmp_path):
+    ingestion = _ingestion(tmp_path)
+    ingestion.add_test_result(_case('P1', 9.07, 7.40, age=30))
+    # Same place, but a corrected age and gender move them to another cube row
+    ingestion.add_test_result(_case('P1', 9.07, 7.40, age=70, gender='Female'))
+
+    _assert_matches_rebuild(ingestion)
+
+
+def test_series_follow_moved_patient(tmp_path):
+    ingestion = _ingestion(tmp_path)
+    ingestion.series_store = DailySeriesStore(ingestion.db_path, str(tmp_path / 'series'))
+    ingestion.add_test_result(_case('P1', 9.07, 7.40))
+    ingestion.add_test_result(_case('P1', 6.52, 3.38, test_date='2024-03-02'))
+
+    rebuilt = DailySeriesStore(ingestion.db_path, str(tmp_path / 'rebuilt'))
+    rebuilt.sync()
+    # Both results are now in the Lagos area and none left in Abuja's
+    for area in ingestion.series_store.areas_for('Malaria') + rebuilt.areas_for('Malaria'):
+        incremental = ingestion.series_store.window('Malaria', '2024-03-01', '2024-03-02', area=area)
+        assert (incremental == rebuilt.window('Malaria', '2024-03-01', '2024-03-02', area=area)).all()
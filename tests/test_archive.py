@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+from datetime import date
+
+import pytest
+
+from aggregates import rebuild_aggregates
+from archive import ArchiveRouter, archive_old_results, compact_archives, sweep_tombstones
+from synthetic_data import generate
+
+END_DATE = date(2024, 6, 30)
+
+RANGES = [(None, None), ('2022-01-01', '2022-12-31'), ('2022-11-15', '2024-02-01'), ('2024-01-01', None)]
+
+
+def _read(conn, start_date, end_date):
+    rows = conn.execute('''
+    SELECT result_id, patient_id, disease_type, test_result, test_date, severity FROM test_results
+    WHERE (? IS NULL OR test_date >= ?) AND (? IS NULL OR test_date <= ?)
+    ORDER BY result_id
+    ''', (start_date, start_date, end_date, end_date)).fetchall()
+    return [tuple(row) for row in rows]
+
+
+@pytest.fixture
+def databases(tmp_path):
+    """(unarchived copy, database with results before 2024 archived by year)"""
+    plain = str(tmp_path / 'plain.db')
+    generate(plain, 2000, hospitals=3, days=900, seed=7, end_date=END_DATE, durable=False)
+    archived = str(tmp_path / 'archived.db')
+    shutil.copy(plain, archived)
+    moved = archive_old_results(archived, hot_months=6, today=END_DATE)
+    assert set(moved) == {'2022', '2023'}
+    return plain, archived
+
+
+def _assert_routed_reads_match(plain, archived):
+    expected = sqlite3.connect(plain)
+    router = ArchiveRouter(archived)
+    for start_date, end_date in RANGES:
+        routed = router.connect(start_date, end_date)
+        assert _read(routed, start_date, end_date) == _read(expected, start_date, end_date)
+        routed.close()
+    expected.close()
+
+
+def test_routed_read_matches_unarchived(databases):
+    _assert_routed_reads_match(*databases)
+
+
+def test_compaction_keeps_retired_files_until_swept(databases):
+    plain, archived = databases
+    conn = sqlite3.connect(archived)
+    retired = [partition['path'] for partition in ArchiveRouter(archived).partitions(conn)]
+
+    assert compact_archives(archived, max_files=1) == '2022_2023'
+    _assert_routed_reads_match(plain, archived)
+    # Readers that looked up the catalog before the merge can still attach these
+    assert all(os.path.exists(path) for path in retired)
+
+    assert sweep_tombstones(archived, conn) == 0
+    assert sweep_tombstones(archived, conn, max_age=0) == 2
+    assert not any(os.path.exists(path) for path in retired)
+    _assert_routed_reads_match(plain, archived)
+    conn.close()
+
+
+def test_missing_archive_is_not_recreated(databases):
+    _, archived = databases
+    conn = sqlite3.connect(archived)
+    path = ArchiveRouter(archived).partitions(conn)[0]['path']
+    conn.close()
+    os.remove(path)
+
+    with pytest.raises(sqlite3.OperationalError):
+        ArchiveRouter(archived).connect()
+    assert not os.path.exists(path)
+
+
+def test_rebuild_keeps_archived_summaries(databases):
+    plain, archived = databases
+    conn = sqlite3.connect(archived)
+    rebuild_aggregates(conn.cursor())
+    conn.commit()
+
+    expected = sqlite3.connect(plain)
+    for table in ('case_cell_counts', 'surveillance_cube'):
+        query = f'SELECT * FROM {table}'
+        assert sorted(conn.execute(query)) == sorted(expected.execute(query))
+    expected.close()
+    conn.close()
@@ -0,0 +1,14 @@
+import sqlite3
+
+from geo import bbox_conditions
+
+
+def test_inverted_bbox_matches_nothing():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE patients (geohash TEXT, latitude REAL, longitude REAL)')
+    conn.execute("INSERT INTO patients VALUES ('s1t78', 9.5, 7.5)")
+
+    sql, params = bbox_conditions((10, 8, 9, 7))
+    rows = conn.execute(f'SELECT * FROM patients p WHERE {sql}', params).fetchall()
+
+    assert rows == []
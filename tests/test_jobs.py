@@ -0,0 +1,99 @@
+import sqlite3
+import subprocess
+import sys
+import time
+
+from create_db import ensure_database
+from jobs import JobManager, JobRunner
+
+
+def _manager(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    ensure_database(db_path)
+    return JobManager(db_path)
+
+
+def test_identical_requests_share_a_job(tmp_path):
+    manager = _manager(tmp_path)
+    first = manager.submit('outbreak', ['Malaria'], {'threshold': 2, 'date': '2024-03-01'})
+    second = manager.submit('outbreak', ['Malaria'], {'threshold': '2.0', 'date': '2024-03-01'})
+
+    assert not first['deduplicated']
+    assert second == {'job_id': first['job_id'], 'status': 'queued', 'deduplicated': True}
+    other = manager.submit('outbreak', ['Malaria'], {'threshold': 3, 'date': '2024-03-01'})
+    assert other['job_id'] != first['job_id']
+
+
+def test_failed_job_is_not_reused(tmp_path):
+    manager = _manager(tmp_path)
+    job_id = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})['job_id']
+    conn = sqlite3.connect(manager.db_path)
+    conn.execute("UPDATE analysis_jobs SET status = 'failed' WHERE job_id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+
+    retry = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})
+    assert retry['job_id'] != job_id and not retry['deduplicated']
+
+
+def test_polling_does_not_write(tmp_path):
+    manager = _manager(tmp_path)
+    job_id = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})['job_id']
+    conn = sqlite3.connect(manager.db_path)
+    conn.execute('UPDATE analysis_jobs SET expires_at = 0')
+    conn.commit()
+
+    assert manager.get(job_id) is None
+    # Still there: only the runner purges
+    assert conn.execute('SELECT COUNT(*) FROM analysis_jobs').fetchone()[0] == 1
+    conn.close()
+
+
+def test_runner_fails_jobs_of_an_exited_runner(tmp_path):
+    manager = _manager(tmp_path)
+    job_id = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})['job_id']
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    conn = sqlite3.connect(manager.db_path)
+    conn.execute("UPDATE analysis_jobs SET status = 'running', owner_pid = ?", (exited.pid,))
+    conn.commit()
+
+    JobRunner(manager.db_path).purge(sqlite3.connect(manager.db_path))
+    job = manager.get(job_id)
+    assert job['status'] == 'failed' and 'exited' in job['error']
+    conn.close()
+
+
+def test_runner_completes_queued_job(tmp_path):
+    manager = _manager(tmp_path)
+    job_id = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})['job_id']
+    runner = JobRunner(manager.db_path, max_workers=1)
+    try:
+        assert runner.run_once() == 1
+        deadline = time.time() + 60
+        while manager.get(job_id)['status'] in ('queued', 'running') and time.time() < deadline:
+            time.sleep(0.2)
+    finally:
+        runner.stop()
+
+    job = manager.get(job_id)
+    assert job['status'] == 'done', job.get('error')
+    assert 'Malaria' in job['result']
+
+
+def test_concurrent_insert_returns_the_other_job(tmp_path, monkeypatch):
+    manager = _manager(tmp_path)
+    first = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})
+    # Another worker's insert lands between this one's lookup and insert
+    find = JobManager._find
+    calls = []
+
+    def racing_find(conn, key):
+        calls.append(key)
+        return None if len(calls) == 1 else find(conn, key)
+
+    monkeypatch.setattr(JobManager, '_find', staticmethod(racing_find))
+
+    second = manager.submit('daily_statistics', ['Malaria'], {'date': '2024-03-01'})
+    assert second == {'job_id': first['job_id'], 'status': 'queued', 'deduplicated': True}
+    assert len(calls) == 2
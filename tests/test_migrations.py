@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from create_db import SCHEMA_VERSION, ensure_database
+from data_ingestion import DataIngestion
+from lookups import PATIENTS_TABLE, TEST_RESULTS_TABLE, LookupCodes
+
+# Committed with the original (version 0) schema and sample data
+BASELINE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demicstech.db')
+
+# Addresses are interned trimmed, so the baseline is compared on trim(address)
+PATIENT_COLUMNS = ('patient_id, hospital_id, external_patient_id, age, gender, trim(address), '
+                   'latitude, longitude, phone, created_at')
+RESULT_COLUMNS = ('result_id, patient_id, hospital_id, disease_type, test_result, test_date, '
+                  'severity, symptoms, notes, created_at')
+
+
+def _rows(db_path, table, columns, key):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'SELECT {columns} FROM {table} ORDER BY {key}').fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = str(tmp_path / 'baseline.db')
+    shutil.copy(BASELINE_DB, path)
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    conn.close()
+    return path
+
+
+def test_views_return_the_baseline_rows(baseline):
+    patients = _rows(baseline, 'patients', PATIENT_COLUMNS, 'patient_id')
+    results = _rows(baseline, 'test_results', RESULT_COLUMNS, 'result_id')
+
+    assert ensure_database(baseline)
+
+    conn = sqlite3.connect(baseline)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'test_results'").fetchone()[0] == 'view'
+    conn.close()
+    assert _rows(baseline, 'patients', PATIENT_COLUMNS, 'patient_id') == patients
+    assert _rows(baseline, 'test_results', RESULT_COLUMNS, 'result_id') == results
+
+
+def test_inserts_through_the_views(baseline):
+    ensure_database(baseline)
+    conn = sqlite3.connect(baseline)
+    conn.execute('''
+    INSERT INTO patients (hospital_id, external_patient_id, age, gender, address, latitude, longitude)
+    VALUES (1, 'VIEW-1', 41, 'Female', '  12 Marina Road, Lagos ', 6.45, 3.39)
+    ''')
+    patient_id = conn.execute("SELECT patient_id FROM patients WHERE external_patient_id = 'VIEW-1'").fetchone()[0]
+    conn.execute('''
+    INSERT INTO test_results (patient_id, hospital_id, disease_type, test_result, test_date, severity)
+    VALUES (?, 1, 'Mpox', 'Positive', '2024-05-01', 'Mild')
+    ''', (patient_id,))
+    conn.commit()
+
+    assert conn.execute('SELECT address FROM patients WHERE patient_id = ?',
+                        (patient_id,)).fetchone()[0] == '12 Marina Road, Lagos'
+    assert conn.execute('''
+    SELECT disease_type, test_result, test_date, severity FROM test_results WHERE patient_id = ?
+    ''', (patient_id,)).fetchall() == [('Mpox', 'Positive', '2024-05-01', 'Mild')]
+    # The new value was added to its lookup table, not stored as text
+    assert conn.execute(f'''
+    SELECT COUNT(*) FROM {TEST_RESULTS_TABLE} t JOIN diseases d ON d.disease_id = t.disease_id
+    WHERE d.name = 'Mpox'
+    ''').fetchone()[0] == 1
+    conn.close()
+
+
+def test_ids_continue_after_the_baseline(baseline):
+    conn = sqlite3.connect(baseline)
+    last_patient, last_result = (
+        conn.execute(f'SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()[0]
+        for table in ('patients', 'test_results')
+    )
+    conn.close()
+    ensure_database(baseline)
+
+    conn = sqlite3.connect(baseline)
+    assert conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?',
+                        (PATIENTS_TABLE,)).fetchone()[0] == last_patient
+    conn.close()
+
+    result_id = DataIngestion(baseline).add_test_result({
+        'hospital_id': 1, 'disease_type': 'Malaria', 'test_result': 'Negative', 'test_date': '2024-05-02',
+        'patient_data': {'hospital_id': 1, 'external_patient_id': 'NEW-1', 'address': 'Wuse, Abuja',
+                         'latitude': 9.07, 'longitude': 7.48}
+    })
+    assert result_id == last_result + 1
+    assert _rows(baseline, 'patients', 'patient_id', 'patient_id')[-1] == (last_patient + 1,)
+
+
+def test_lookup_value_added_by_another_connection(baseline):
+    ensure_database(baseline)
+    conn = sqlite3.connect(baseline)
+    other = sqlite3.connect(baseline)
+
+    class RacingCursor:
+        """Lets the other connection add the value just after the first SELECT misses"""
+        def __init__(self, cursor):
+            self.cursor = cursor
+            self.selects = 0
+
+        def execute(self, sql, params=()):
+            result = self.cursor.execute(sql, params)
+            if sql.startswith('SELECT'):
+                self.selects += 1
+                if self.selects == 1:
+                    assert result.fetchone() is None
+                    other.execute("INSERT INTO diseases (name) VALUES ('Lassa Fever')")
+                    other.commit()
+                    return self.cursor.execute('SELECT 1 WHERE 0')
+            return result
+
+    disease_id = LookupCodes().code(RacingCursor(conn.cursor()), 'diseases', 'disease_id', 'Lassa Fever')
+    conn.commit()
+
+    assert conn.execute("SELECT disease_id FROM diseases WHERE name = 'Lassa Fever'").fetchall() == [(disease_id,)]
+    other.close()
+    conn.close()
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+import series_store
+from create_db import ensure_database
+from data_ingestion import DataIngestion
+from series_store import NEGATIVE, POSITIVE, TOTAL, DailySeriesStore
+
+START, END = '2024-03-01', '2024-03-05'
+
+
+def _add_results(ingestion, count, offset=0):
+    for i in range(offset, offset + count):
+        ingestion.add_test_result({
+            'hospital_id': 1,
+            'disease_type': 'Malaria',
+            'test_result': 'Positive' if i % 3 == 0 else 'Negative',
+            'test_date': f'2024-03-0{1 + i % 5}',
+            'patient_data': {'hospital_id': 1, 'external_patient_id': f'P{i}', 'address': 'Abuja',
+                             'latitude': 9.07, 'longitude': 7.40}
+        })
+
+
+def _expected(db_path):
+    """(SERIES_ROWS, days) counts for START..END straight from test_results"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('''
+    SELECT test_date, COUNT(*),
+           SUM(test_result = 'Positive'), SUM(test_result = 'Negative')
+    FROM test_results WHERE disease_type = 'Malaria' AND test_date BETWEEN ? AND ?
+    GROUP BY test_date ORDER BY test_date
+    ''', (START, END)).fetchall()
+    conn.close()
+    return [[row[column] for row in rows] for column in (1, 2, 3)]
+
+
+def _counts(store):
+    window = store.window('Malaria', START, END)
+    return [window[row].tolist() for row in (TOTAL, POSITIVE, NEGATIVE)]
+
+
+@pytest.fixture
+def ingestion(tmp_path):
+    db_path = str(tmp_path / 'cases.db')
+    ensure_database(db_path)
+    return DataIngestion(db_path)
+
+
+def test_sync_counts_only_new_results(ingestion, tmp_path):
+    store = DailySeriesStore(ingestion.db_path, str(tmp_path / 'series'))
+    _add_results(ingestion, 10)
+    assert store.sync() == 10
+    _add_results(ingestion, 7, offset=10)
+    assert store.sync() == 7
+    assert store.sync() == 0
+
+    assert _counts(store) == _expected(ingestion.db_path)
+    assert store.rebuild() == 17
+    assert _counts(store) == _expected(ingestion.db_path)
+
+
+def test_interrupted_sync_is_recounted_not_doubled(ingestion, tmp_path, monkeypatch):
+    store = DailySeriesStore(ingestion.db_path, str(tmp_path / 'series'))
+    _add_results(ingestion, 12)
+    monkeypatch.setattr(series_store, 'SYNC_BATCH', 4)
+
+    add = store._add
+    batches = []
+
+    def crashing_add(rows):
+        batches.append(rows)
+        if len(batches) == 2:
+            raise RuntimeError('killed mid-sync')
+        return add(rows)
+
+    store._add = crashing_add
+    with pytest.raises(RuntimeError):
+        store.sync()
+    del store._add
+
+    # The first batch already landed; the next sync must recount, not add again
+    fresh = DailySeriesStore(ingestion.db_path, store.directory)
+    fresh.sync()
+    assert fresh.version == 12
+    assert _counts(fresh) == _expected(ingestion.db_path)
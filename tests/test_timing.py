@@ -0,0 +1,36 @@
+import sqlite3
+
+from slow_queries import SlowQueryLog
+import timing
+
+
+def test_connection_execute_is_tracked(monkeypatch, tmp_path):
+    log = SlowQueryLog(threshold_ms=0.0001, directory=str(tmp_path))
+    monkeypatch.setattr(timing, 'QUERY_LOG', log)
+
+    conn = sqlite3.connect(':memory:', factory=timing.TimedConnection)
+    conn.execute('CREATE TABLE cases (latitude REAL, longitude REAL)')
+    conn.executemany('INSERT INTO cases VALUES (?, ?)', [(9.05, 7.49), (9.06, 7.48)])
+    row = conn.execute('SELECT COUNT(DISTINCT latitude || longitude) FROM cases WHERE latitude > ?',
+                       (9.0,)).fetchone()
+    conn.close()
+
+    assert row[0] == 2
+    statements = {stats['sql']: stats for stats in log.top(limit=10)}
+    assert 'SELECT COUNT(DISTINCT latitude || longitude) FROM cases WHERE latitude > ?' in statements
+    assert 'INSERT INTO cases VALUES (?+)' in statements
+    assert all(stats['slow_count'] == stats['count'] for stats in statements.values())
+
+
+def test_connection_execute_is_timed():
+    conn = sqlite3.connect(':memory:', factory=timing.TimedConnection)
+    timing.begin(force=True)
+    try:
+        conn.execute('SELECT 1').fetchall()
+        conn.execute('SELECT 2').fetchall()
+    finally:
+        timings = timing.finish()
+        conn.close()
+
+    # execute() and fetchall() of each statement
+    assert timings.as_dict()['sql']['count'] == 4
@@ -0,0 +1,275 @@
+import contextvars
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional
+
+from metrics import SECTION_SECONDS
+from slow_queries import QUERY_LOG
+
+# Set TIMING=true to time every request; otherwise only requests sending TIMING_HEADER: 1
+TIMING = os.environ.get('TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+# Also print each timed request's breakdown as one JSON line
+TIMING_LOG = os.environ.get('TIMING_LOG', 'false').lower() in ('1', 'true', 'yes')
+
+# Request header that turns timing on for a single request
+TIMING_HEADER = 'X-Timing'
+
+_enabled = TIMING
+
+# Timings of the request being handled in this thread (or context), if it is timed
+_current = contextvars.ContextVar('timings', default=None)
+
+
+def set_enabled(enabled: bool):
+    """Turn timing of every request on or off at runtime"""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class Timings:
+    """
+    Time spent in each named section during one request, summed per name
+    Sections may nest and may run in several threads at once (shard
+    fan-out), so durations are inclusive and additions are locked.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._totals: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            total = self._totals.get(name)
+            if total is None:
+                self._totals[name] = [seconds, 1]
+            else:
+                total[0] += seconds
+                total[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Dict]:
+        """{name: {'ms': total milliseconds, 'count': times entered}}, plus the request's total"""
+        with self._lock:
+            sections = {name: {'ms': round(seconds * 1000, 3), 'count': count}
+                        for name, (seconds, count) in self._totals.items()}
+        sections['total'] = {'ms': round(self.elapsed() * 1000, 3), 'count': 1}
+        return sections
+
+    def header(self) -> str:
+        """Server-Timing header value, e.g. 'sql;dur=12.5;desc="4x", total;dur=20.1'"""
+        return ', '.join(
+            f'{name};dur={section["ms"]}' + (f';desc="{section["count"]}x"' if section['count'] > 1 else '')
+            for name, section in self.as_dict().items()
+        )
+
+
+def begin(force: bool = False) -> Optional[Timings]:
+    """Start timing the current request if timing is enabled (or forced); returns its Timings"""
+    timings = Timings() if _enabled or force else None
+    # Always set: a thread reuses its context for the next request
+    _current.set(timings)
+    return timings
+
+
+def finish() -> Optional[Timings]:
+    """Stop timing the current request; returns what was recorded, if it was timed"""
+    timings = _current.get()
+    _current.set(None)
+    return timings
+
+
+def current() -> Optional[Timings]:
+    return _current.get()
+
+
+def log(method: str, path: str, status: int, timings: Timings):
+    print(json.dumps({'event': 'request_timing', 'method': method, 'path': path,
+                      'status': status, 'timings': timings.as_dict()}))
+
+
+class timed:
+    """
+    Time a block or function under name in the current request's Timings
+
+        with timed('cluster'):
+            ...
+
+        @timed('analyzer.detect_hotspots')
+        def detect_hotspots(self, ...):
+
+    Decorated functions are also observed in the section latency metric;
+    blocks outside a timed request cost one context variable lookup.
+    """
+
+    __slots__ = ('name', '_timings', '_started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._timings = _current.get()
+        if self._timings is not None:
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._timings is not None:
+            self._timings.add(self.name, time.perf_counter() - self._started)
+        return False
+
+    def __call__(self, fn: Callable) -> Callable:
+        name = self.name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                SECTION_SECONDS.observe(elapsed, section=name)
+                timings = _current.get()
+                if timings is not None:
+                    timings.add(name, elapsed)
+
+        return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor timing each statement, from execution until its rows are all
+    fetched (or the cursor moves on): as 'sql' in the current request's
+    Timings and, when it is enabled, in the slow query log
+    """
+
+    _statement = None
+    _elapsed = 0.0
+
+    def _run(self, step, *args):
+        started = time.perf_counter()
+        try:
+            return step(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._elapsed += elapsed
+            timings = _current.get()
+            if timings is not None:
+                timings.add('sql', elapsed)
+
+    def _start(self, sql, parameters, many=False):
+        self._finish()
+        if QUERY_LOG.enabled:
+            self._statement = (sql, parameters, many)
+
+    def _finish(self):
+        statement, elapsed = self._statement, self._elapsed
+        self._statement, self._elapsed = None, 0.0
+        if statement is not None:
+            sql, parameters, many = statement
+            QUERY_LOG.record(self.connection, sql, parameters, elapsed, many)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None, many=True)
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        self._finish()
+        return self._run(super().executescript, sql_script)
+
+    # SQLite produces most rows while they are fetched, not in execute()
+    def fetchone(self):
+        row = self._run(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._run(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._run(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._run(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Statements whose rows were never fetched to the end, e.g. an INSERT
+        # run with conn.execute() and its cursor dropped
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are TimedCursors. sqlite3's own execute()
+    shortcuts create a plain cursor without calling cursor(), so they are
+    overridden to run on one from cursor() instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+
+    def cursor(self, factory=TimedCursor):
+        cursor = super().cursor(factory)
+        if isinstance(cursor, TimedCursor):
+            self._cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        # Statements still pending must be explained while the connection is open
+        for cursor in list(self._cursors):
+            cursor._finish()
+        super().close()
+
+
+def open_connection(database, **kwargs) -> sqlite3.Connection:
+    """
+    sqlite3.connect, returning a TimedConnection while the current request
+    is timed or the slow query log is on, and a plain connection otherwise
+    """
+    if QUERY_LOG.enabled or _current.get() is not None:
+        kwargs.setdefault('factory', TimedConnection)
+    return sqlite3.connect(database, **kwargs)